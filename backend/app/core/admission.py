@@ -0,0 +1,150 @@
+"""
+准入控制 Middleware
+
+event loop 延遲或進行中的串流數超過上限，或 worker 正在排空時，新的串流請求直接回傳 503 + Retry-After，
+不進入路由處理；已建立的串流不受影響，得以維持流暢
+"""
+import json
+from functools import lru_cache
+from typing import Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.core.config import get_settings
+from app.core.drain import DrainController, get_drain_controller
+from app.core.loop_monitor import LoopLagMonitor, get_loop_monitor
+from app.core.metrics import metrics
+
+
+ACTIVE_STREAMS_GAUGE = metrics.gauge("chat_active_streams", "進行中的 /api/chat/send 串流數")
+ADMISSION_REJECTED = metrics.counter(
+    "chat_admission_rejected_total", "因負載過高或排空中被拒絕的請求數", ("reason",)
+)
+
+# 各拒絕原因的錯誤訊息
+REJECTION_DETAILS = {
+    "draining": "服務正在重新部署，請稍後再試",
+    "loop_lag": "服務目前負載過高，請稍後再試",
+    "active_streams": "服務目前負載過高，請稍後再試",
+}
+
+
+class AdmissionController:
+    """
+    准入判斷與進行中串流計數
+
+    Attributes:
+        active_streams: 目前進行中的受控請求數
+    """
+
+    def __init__(
+        self,
+        monitor: LoopLagMonitor,
+        max_loop_lag: float = 0.0,
+        max_active_streams: int = 0,
+        retry_after: int = 2,
+        drain: Optional[DrainController] = None
+    ):
+        """
+        Args:
+            monitor: event loop 延遲取樣器
+            max_loop_lag: 延遲上限（秒），0 表示不檢查
+            max_active_streams: 進行中串流上限，0 表示不限制
+            retry_after: 拒絕時建議客戶端等待的秒數
+            drain: 排空控制器（排空中拒絕所有新請求），None 表示不檢查
+        """
+        self.monitor = monitor
+        self.drain = drain
+        self.max_loop_lag = max_loop_lag
+        self.max_active_streams = max_active_streams
+        self.retry_after = retry_after
+        self.active_streams = 0
+
+    def rejection_reason(self) -> Optional[str]:
+        """
+        判斷是否應拒絕新請求
+
+        Returns:
+            Optional[str]: 拒絕原因（"draining" / "loop_lag" / "active_streams"），可接受時回傳 None
+        """
+        if self.drain is not None and self.drain.draining:
+            return "draining"
+        if self.max_loop_lag > 0 and self.monitor.lag > self.max_loop_lag:
+            return "loop_lag"
+        if self.max_active_streams > 0 and self.active_streams >= self.max_active_streams:
+            return "active_streams"
+        return None
+
+
+class AdmissionMiddleware:
+    """對指定路徑套用 AdmissionController 的 ASGI middleware"""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        controller: AdmissionController,
+        paths: tuple[str, ...] = ("/api/chat/send",)
+    ):
+        """
+        Args:
+            app: 下一層 ASGI app
+            controller: 准入控制器
+            paths: 受控的路徑（僅 POST）
+        """
+        self.app = app
+        self.controller = controller
+        self.paths = paths
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        reason = self.controller.rejection_reason()
+        if reason is not None:
+            ADMISSION_REJECTED.inc(reason=reason)
+            await self._reject(send, reason)
+            return
+
+        self.controller.active_streams += 1
+        ACTIVE_STREAMS_GAUGE.set(self.controller.active_streams)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.active_streams -= 1
+            ACTIVE_STREAMS_GAUGE.set(self.controller.active_streams)
+
+    async def _reject(self, send: Send, reason: str) -> None:
+        """回傳 503 + Retry-After（不讀取請求內容，成本極低）"""
+        body = json.dumps(
+            {"detail": REJECTION_DETAILS[reason], "reason": reason},
+            ensure_ascii=False
+        ).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(self.controller.retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+@lru_cache
+def get_admission_controller() -> AdmissionController:
+    """
+    取得全域准入控制器（每個 worker 一份）
+
+    Returns:
+        AdmissionController: 全域單例實例
+    """
+    settings = get_settings()
+    return AdmissionController(
+        get_loop_monitor(),
+        max_loop_lag=settings.ADMISSION_MAX_LOOP_LAG_MS / 1000,
+        max_active_streams=settings.ADMISSION_MAX_ACTIVE_STREAMS,
+        retry_after=settings.ADMISSION_RETRY_AFTER,
+        drain=get_drain_controller()
+    )
@@ -0,0 +1,97 @@
+"""
+上游熔斷器（Circuit Breaker）
+
+連續失敗達門檻時熔斷（open）：期間的請求直接失敗，不再等待上游逾時，
+readiness 也回報未就緒，讓負載平衡器暫時把流量導向其他 worker；
+經過 reset_timeout 後進入半開（half_open），下一個成功的請求恢復為 closed，失敗則再次熔斷
+狀態為每個 worker 各自維護
+"""
+import time
+from functools import lru_cache
+
+from app.core.config import get_settings
+from app.core.metrics import metrics
+
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+CIRCUIT_STATE = metrics.gauge(
+    "upstream_circuit_state", "上游熔斷器狀態（0: closed, 1: half_open, 2: open）"
+)
+CIRCUIT_OPENED = metrics.counter("upstream_circuit_opened_total", "上游熔斷器熔斷次數")
+
+
+class CircuitOpenError(Exception):
+    """熔斷期間拒絕呼叫上游"""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"上游服務暫時無法使用，請於 {retry_after:.0f} 秒後再試")
+
+
+class CircuitBreaker:
+    """依連續失敗次數熔斷的熔斷器"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        Args:
+            failure_threshold: 連續失敗幾次後熔斷，0 表示停用
+            reset_timeout: 熔斷後多久進入半開（秒）
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self._open = False
+
+    @property
+    def state(self) -> str:
+        """目前狀態（"closed" / "half_open" / "open"）"""
+        if not self._open:
+            return CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def check(self) -> None:
+        """
+        呼叫上游前檢查是否允許
+
+        Raises:
+            CircuitOpenError: 熔斷中
+        """
+        if self.state == OPEN:
+            raise CircuitOpenError(self.opened_at + self.reset_timeout - time.monotonic())
+
+    def record_success(self) -> None:
+        """記錄上游成功回應（半開時恢復為 closed）"""
+        self.failures = 0
+        if self._open:
+            self._open = False
+            CIRCUIT_STATE.set(_STATE_VALUES[CLOSED])
+            print("[DEBUG] 上游恢復，熔斷器關閉")
+
+    def record_failure(self) -> None:
+        """記錄上游失敗（逾時或錯誤），連續失敗達門檻或半開時失敗則熔斷"""
+        self.failures += 1
+        if self.failure_threshold <= 0:
+            return
+        if self.state == HALF_OPEN or (not self._open and self.failures >= self.failure_threshold):
+            self._open = True
+            self.opened_at = time.monotonic()
+            CIRCUIT_OPENED.inc()
+            CIRCUIT_STATE.set(_STATE_VALUES[OPEN])
+            print(f"[WARNING] 上游連續失敗 {self.failures} 次，熔斷 {self.reset_timeout:g} 秒")
+
+
+@lru_cache
+def get_circuit_breaker() -> CircuitBreaker:
+    """
+    取得全域上游熔斷器（每個 worker 一份）
+
+    Returns:
+        CircuitBreaker: 全域單例實例
+    """
+    settings = get_settings()
+    return CircuitBreaker(settings.CIRCUIT_FAILURE_THRESHOLD, settings.CIRCUIT_RESET_TIMEOUT)
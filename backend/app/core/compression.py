@@ -0,0 +1,161 @@
+"""
+回應壓縮 Middleware
+
+依 Accept-Encoding 協商 zstd / br / gzip，只壓縮 JSON 類型且超過門檻大小的回應；
+text/event-stream 等串流回應一律直接轉送，不緩衝也不壓縮，避免增加 SSE 延遲
+"""
+import gzip
+from typing import Callable, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:  # 選用相依：pip install brotli
+    import brotli
+except ImportError:
+    brotli = None
+
+try:  # 選用相依：pip install zstandard
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# 可壓縮的 Content-Type（不含 text/event-stream 與 application/x-ndjson 等串流格式）
+COMPRESSIBLE_TYPES = ("application/json", "application/problem+json")
+
+
+def _compressors() -> dict[str, Callable[[bytes], bytes]]:
+    """依已安裝套件建立可用的壓縮函式（順序即伺服器偏好順序）"""
+    available: dict[str, Callable[[bytes], bytes]] = {}
+    if zstandard is not None:
+        zstd_compressor = zstandard.ZstdCompressor(level=3)
+        available["zstd"] = zstd_compressor.compress
+    if brotli is not None:
+        available["br"] = lambda data: brotli.compress(data, quality=4)
+    available["gzip"] = lambda data: gzip.compress(data, compresslevel=6, mtime=0)
+    return available
+
+
+def negotiate_encoding(accept_encoding: str, supported: list[str]) -> Optional[str]:
+    """
+    依 Accept-Encoding 選擇壓縮格式
+
+    Args:
+        accept_encoding: 請求的 Accept-Encoding 標頭
+        supported: 伺服器支援的格式（依偏好排序）
+
+    Returns:
+        Optional[str]: 選中的格式，無可用格式時回傳 None
+    """
+    weights: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[token] = q
+
+    best: Optional[str] = None
+    best_q = 0.0
+    for encoding in supported:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        # 同分時保留較早（伺服器較偏好）的格式
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class CompressionMiddleware:
+    """
+    串流安全的壓縮 Middleware
+
+    - 回應 Content-Type 不可壓縮（例如 SSE）時，start 與每個 body 片段立即轉送
+    - 可壓縮的 JSON 回應先緩衝完整內容，超過 minimum_size 才壓縮
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024):
+        """
+        Args:
+            app: 下一層 ASGI app
+            minimum_size: 最小壓縮大小（bytes），小於此值直接回傳原始內容
+        """
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compressors = _compressors()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = Headers(scope=scope).get("accept-encoding", "")
+        encoding = negotiate_encoding(accept_encoding, list(self.compressors))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(send, encoding, self.compressors[encoding], self.minimum_size)
+        await self.app(scope, receive, responder)
+
+
+class _CompressionResponder:
+    """包裝單一請求的 send，決定直接轉送或緩衝後壓縮"""
+
+    def __init__(
+        self, send: Send, encoding: str, compress: Callable[[bytes], bytes], minimum_size: int
+    ):
+        self.send = send
+        self.encoding = encoding
+        self.compress = compress
+        self.minimum_size = minimum_size
+        self.start_message: Optional[Message] = None
+        self.passthrough = False
+        self.chunks: list[bytes] = []
+
+    async def __call__(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+            self.passthrough = (
+                content_type not in COMPRESSIBLE_TYPES
+                or "content-encoding" in headers
+                or message["status"] in (204, 304)
+            )
+            if self.passthrough:
+                await self.send(message)
+            else:
+                self.start_message = message
+            return
+
+        if self.passthrough or message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        self.chunks.append(message.get("body", b""))
+        if message.get("more_body", False):
+            return
+
+        body = b"".join(self.chunks)
+        start_message = self.start_message
+        headers = MutableHeaders(raw=start_message["headers"])
+        headers.add_vary_header("Accept-Encoding")
+
+        if len(body) >= self.minimum_size:
+            body = self.compress(body)
+            headers["Content-Encoding"] = self.encoding
+            headers["Content-Length"] = str(len(body))
+            # 壓縮後的表示法與原始內容不同，改為弱 ETag
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = f"W/{etag}"
+
+        await self.send(start_message)
+        await self.send({"type": "http.response.body", "body": body, "more_body": False})
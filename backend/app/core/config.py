@@ -2,8 +2,11 @@
 應用程式設定管理
 
 使用 Pydantic Settings 從環境變數載入設定
+設定實例在第一次存取時才建立（get_settings），匯入本模組不會讀取環境變數
 """
+from functools import lru_cache
 from typing import TypedDict
+from pydantic import model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -22,6 +25,12 @@ OPENAI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/openai/"
 # Google Models API URL（用於動態取得模型列表）
 GOOGLE_MODELS_API_URL = "https://generativelanguage.googleapis.com/v1beta/models"
 
+# 未指定 session_id 時使用的預設對話 session
+DEFAULT_SESSION_ID = "default"
+
+# 由伺服器依延遲統計自動選擇模型的虛擬模型 ID
+AUTO_MODEL_ID = "auto"
+
 # 可用的 Google Gemini 模型白名單（通過 OpenAI SDK 訪問）
 AVAILABLE_MODELS: dict[str, ModelInfo] = {
     "gemini-1.5-pro": {
@@ -48,6 +57,51 @@ AVAILABLE_MODELS: dict[str, ModelInfo] = {
 }
 
 
+class GenerationLimits(TypedDict):
+    """模型的生成參數上限與預設值（由伺服器強制，請求超過上限時拒絕）"""
+    max_tokens: int  # 單次回應 token 數上限
+    default_max_tokens: int  # 請求未指定 max_tokens 時使用
+    max_temperature: float
+    default_temperature: float
+    default_top_p: float
+    max_stop_sequences: int
+
+
+# 不在白名單中的模型（動態目錄的其他模型）使用的生成參數限制
+DEFAULT_GENERATION_LIMITS: GenerationLimits = {
+    "max_tokens": 8192,
+    "default_max_tokens": 4096,
+    "max_temperature": 2.0,
+    "default_temperature": 0.7,
+    "default_top_p": 0.95,
+    "max_stop_sequences": 5
+}
+
+# 與 DEFAULT_GENERATION_LIMITS 不同的模型（以 DEFAULT 為基礎覆寫，未列出的模型直接使用 DEFAULT）
+# 白名單模型的上游輸出上限皆為 8192 tokens；gemini-1.5-pro 的每 token 延遲與成本最高，
+# 單次回應另限制為 4096 tokens（預設 2048），避免一個長回應佔用串流名額數分鐘
+GENERATION_LIMITS: dict[str, GenerationLimits] = {
+    "gemini-1.5-pro": {
+        **DEFAULT_GENERATION_LIMITS,
+        "max_tokens": 4096,
+        "default_max_tokens": 2048,
+    },
+}
+
+
+def get_generation_limits(model_id: str) -> GenerationLimits:
+    """
+    取得模型的生成參數限制
+
+    Args:
+        model_id: 模型 ID
+
+    Returns:
+        GenerationLimits: 該模型的限制（未列出的模型使用 DEFAULT_GENERATION_LIMITS）
+    """
+    return GENERATION_LIMITS.get(model_id, DEFAULT_GENERATION_LIMITS)
+
+
 def validate_model(model_id: str) -> bool:
     """
     驗證模型是否在白名單中
@@ -64,9 +118,27 @@ def validate_model(model_id: str) -> bool:
 class Settings(BaseSettings):
     """應用程式設定"""
 
-    # Google Gemini API 設定
-    GEMINI_API_KEY: str
+    # Google Gemini API 設定（GEMINI_API_KEYS 為以逗號分隔的多組 key，設定時優先於 GEMINI_API_KEY）
+    GEMINI_API_KEY: str = ""
+    GEMINI_API_KEYS: str = ""
+    KEY_POOL_STRATEGY: str = "least_loaded"  # "least_loaded" 或 "round_robin"
+    KEY_COOLDOWN_SECONDS: float = 60.0  # key 收到 429 且未附 Retry-After 時的冷卻秒數
     GEMINI_MODEL: str = "gemini-2.0-flash"
+    # Gemini API 位址（留空使用 Google 官方端點；replay 時指向本機的 mock，例如 http://127.0.0.1:8900/v1beta）
+    GEMINI_API_BASE_URL: str = ""
+
+    # auto 模型選擇：在候選模型（逗號分隔，留空為 AVAILABLE_MODELS）中選擇符合最低品質等級且預估 TTFT 最低者
+    AUTO_MODEL_CANDIDATES: str = ""
+    AUTO_MODEL_MIN_TIER: str = "recommended"  # stable / recommended / advanced
+    AUTO_MODEL_DEFAULT: bool = False  # 請求未指定模型時是否使用 auto（否則使用 GEMINI_MODEL）
+    COMPARE_MAX_MODELS: int = 4  # /api/chat/compare 一次最多同時比較的模型數
+
+    # 對沖請求：超過模型近期 TTFT 的 HEDGE_QUANTILE 分位仍未收到首個片段時，送出相同的第二個請求
+    HEDGE_ENABLED: bool = False
+    HEDGE_QUANTILE: float = 0.95
+    HEDGE_BUDGET_RATIO: float = 0.05  # 對沖請求最多佔總請求數的比例
+    HEDGE_MIN_SAMPLES: int = 20  # 模型至少需有的 TTFT 樣本數
+    HEDGE_MIN_DELAY: float = 0.25  # 對沖門檻下限（秒）
 
     # 應用程式基本設定
     APP_NAME: str = "AI Chat API"
@@ -75,6 +147,69 @@ class Settings(BaseSettings):
     # CORS 設定
     ALLOWED_ORIGINS: str = "http://localhost:3000,http://localhost:3001"
 
+    # 共享狀態設定（多 worker 部署時需使用 sqlite）
+    STATE_BACKEND: str = "memory"  # "memory" 或 "sqlite"
+    STATE_SQLITE_PATH: str = "data/state.db"
+    STATE_SQLITE_BUSY_TIMEOUT_MS: int = 1000  # 一般請求等待其他 worker 寫入鎖的上限（毫秒）
+    MODEL_CATALOG_TTL: int = 300  # 模型目錄快取秒數
+    STATE_CACHE_MAX_ENTRIES: int = 10000  # 共享快取（模型目錄、Markdown 渲染結果等）的筆數上限
+    WEB_CONCURRENCY: int = 1  # worker 數量（uvicorn --workers 同樣讀取此環境變數）
+
+    # 啟動時預先載入模型目錄（避免第一個請求承擔 Google API 延遲）
+    PREWARM_MODEL_CATALOG: bool = False
+
+    # 對話摘要壓縮（opt-in）：未壓縮的歷史超過門檻字元數時，
+    # 於背景以低成本模型將較舊的對話濃縮為摘要，之後的請求只送「摘要 + 最近幾輪」
+    HISTORY_COMPACTION_ENABLED: bool = False
+    HISTORY_COMPACTION_THRESHOLD_CHARS: int = 24000
+    HISTORY_COMPACTION_KEEP_RECENT: int = 6  # 保留不壓縮的最近訊息數
+    HISTORY_COMPACTION_MODEL: str = "gemini-1.5-flash"
+
+    # 回應壓縮（JSON 回應超過門檻大小時依 Accept-Encoding 壓縮）
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_MINIMUM_SIZE: int = 1024
+
+    # 准入控制：event loop 延遲或進行中串流數超過上限時，新的 /api/chat/send 直接回傳 503
+    LOOP_LAG_SAMPLE_INTERVAL_MS: int = 100
+    ADMISSION_MAX_LOOP_LAG_MS: float = 250.0  # 0 表示不檢查
+    ADMISSION_MAX_ACTIVE_STREAMS: int = 0  # 每個 worker 的串流上限，0 表示不限制
+    ADMISSION_RETRY_AFTER: int = 2
+
+    # 優雅排空：收到 SIGTERM 後停止接受新的串流，等待進行中的串流完成再關閉
+    DRAIN_TIMEOUT: float = 30.0  # 等待串流完成的最長秒數，逾時的串流會被中止
+    DRAIN_GRACE_SECONDS: float = 0.0  # 排空至少維持的秒數（讓負載平衡器偵測到 readiness 失敗）
+
+    # 上游熔斷：連續失敗達門檻時熔斷（請求直接失敗、readiness 回報未就緒），經過重置時間後再試
+    CIRCUIT_FAILURE_THRESHOLD: int = 5  # 0 表示停用
+    CIRCUIT_RESET_TIMEOUT: float = 30.0
+
+    # 串流期限（秒，0 表示不限制）；客戶端可用 X-Request-Timeout 縮短總時間，但不能超過此上限
+    STREAM_FIRST_TOKEN_TIMEOUT: float = 30.0
+    STREAM_IDLE_TIMEOUT: float = 20.0
+    STREAM_TOTAL_TIMEOUT: float = 180.0
+    UPSTREAM_CONNECT_TIMEOUT: float = 10.0
+
+    # 伺服器端 Markdown 渲染結果的快取秒數（需安裝 markdown-it-py）
+    MARKDOWN_CACHE_TTL: int = 7 * 24 * 3600
+
+    # 模型輸出遮蔽：OUTPUT_REDACT_TERMS 為逗號分隔的字串，OUTPUT_REDACT_SECRETS 另遮蔽伺服器的 API key 與 ADMIN_TOKEN
+    OUTPUT_REDACT_TERMS: str = ""
+    OUTPUT_REDACT_SECRETS: bool = True
+    OUTPUT_REDACT_IGNORE_CASE: bool = True
+    OUTPUT_REDACT_REPLACEMENT: str = "[REDACTED]"
+
+    # Admin 診斷 API（profiler / tracemalloc / task 傾印），未設定 token 時停用
+    ADMIN_TOKEN: str = ""
+
+    # 流量錄製：記錄 /api/chat/send 的請求形狀與片段時間（不含內容）到 NDJSON 檔，留空表示停用
+    TRAFFIC_CAPTURE_PATH: str = ""
+    TRAFFIC_CAPTURE_SAMPLE_RATE: float = 1.0  # 錄製的請求比例（0~1）
+    TRAFFIC_CAPTURE_SALT: str = ""  # session ID 雜湊的金鑰，留空表示每個 worker 隨機產生（多 worker 時應設定）
+
+    # 速率限制（每個客戶端 IP 對 /api/chat/send 的請求數，0 表示停用）
+    RATE_LIMIT_PER_MINUTE: int = 0
+    RATE_LIMIT_BURST: int = 10
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
@@ -82,11 +217,58 @@ class Settings(BaseSettings):
         extra="ignore"
     )
 
+    @model_validator(mode="after")
+    def _check_api_keys(self) -> "Settings":
+        """至少需要設定一組 API key"""
+        if not self.api_keys:
+            raise ValueError("必須設定 GEMINI_API_KEY 或 GEMINI_API_KEYS")
+        return self
+
     @property
     def cors_origins(self) -> list[str]:
         """將 ALLOWED_ORIGINS 字串轉換為列表"""
         return [origin.strip() for origin in self.ALLOWED_ORIGINS.split(",")]
 
+    @property
+    def auto_model_candidates(self) -> list[str]:
+        """auto 模式的候選模型 ID 列表"""
+        candidates = [model.strip() for model in self.AUTO_MODEL_CANDIDATES.split(",") if model.strip()]
+        return candidates or list(AVAILABLE_MODELS)
+
+    @property
+    def openai_base_url(self) -> str:
+        """OpenAI 兼容 API 的位址"""
+        if not self.GEMINI_API_BASE_URL:
+            return OPENAI_BASE_URL
+        return self.GEMINI_API_BASE_URL.rstrip("/") + "/openai/"
+
+    @property
+    def models_api_url(self) -> str:
+        """模型列表 API 的位址"""
+        if not self.GEMINI_API_BASE_URL:
+            return GOOGLE_MODELS_API_URL
+        return self.GEMINI_API_BASE_URL.rstrip("/") + "/models"
+
+    @property
+    def api_keys(self) -> list[str]:
+        """API key 列表（GEMINI_API_KEYS 優先，否則為單一的 GEMINI_API_KEY）"""
+        keys = [key.strip() for key in self.GEMINI_API_KEYS.split(",") if key.strip()]
+        return keys or ([self.GEMINI_API_KEY] if self.GEMINI_API_KEY else [])
+
+
+@lru_cache
+def get_settings() -> Settings:
+    """
+    取得全域設定實例（第一次呼叫時才從環境變數建立）
+
+    Returns:
+        Settings: 應用程式設定
+    """
+    return Settings()
+
 
-# 全域設定實例
-settings = Settings()
+def __getattr__(name: str):
+    """相容舊寫法 `from app.core.config import settings`（存取時才建立設定）"""
+    if name == "settings":
+        return get_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
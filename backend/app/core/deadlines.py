@@ -0,0 +1,140 @@
+"""
+串流期限（Deadline）控制
+
+每個串流請求有三種期限：
+- first_token: 從請求開始到收到第一個內容片段
+- idle: 兩個內容片段之間的最長間隔
+- total: 整個串流的總時間
+
+任一期限到期時取消等待中的上游呼叫，並拋出 DeadlineExceeded 說明是哪一個期限
+"""
+import asyncio
+import time
+from typing import AsyncIterator, Awaitable, Optional, TypeVar
+
+from app.core.metrics import metrics
+
+
+T = TypeVar("T")
+
+DEADLINE_EXCEEDED = metrics.counter(
+    "chat_stream_deadline_exceeded_total", "因期限到期而中止的串流數", ("deadline",)
+)
+
+
+class DeadlineExceeded(Exception):
+    """
+    串流期限到期
+
+    Attributes:
+        deadline: 到期的期限種類（"first_token" / "idle" / "total"）
+        timeout: 該期限的秒數
+    """
+
+    def __init__(self, deadline: str, timeout: float):
+        self.deadline = deadline
+        self.timeout = timeout
+        super().__init__(f"串流逾時（{deadline}，{timeout:g} 秒）")
+
+
+class StreamDeadline:
+    """
+    單一串流請求的期限狀態
+
+    建立時開始計時；各期限為 0 表示不限制
+    """
+
+    def __init__(self, first_token: float = 0.0, idle: float = 0.0, total: float = 0.0):
+        """
+        Args:
+            first_token: 首個內容片段期限（秒）
+            idle: 片段間最長間隔（秒）
+            total: 串流總時間（秒）
+        """
+        self.first_token = first_token
+        self.idle = idle
+        self.total = total
+        self.started = time.monotonic()
+        self.received_first = False
+
+    @classmethod
+    def from_settings(cls, settings, requested_total: Optional[float] = None) -> "StreamDeadline":
+        """
+        依伺服器設定建立期限，客戶端要求的總時間只能縮短、不能超過伺服器上限
+
+        Args:
+            settings: 應用程式設定
+            requested_total: 客戶端要求的總時間（秒），None 表示使用伺服器設定
+
+        Returns:
+            StreamDeadline: 新的期限狀態
+        """
+        total = settings.STREAM_TOTAL_TIMEOUT
+        if requested_total is not None and requested_total > 0:
+            total = min(requested_total, total) if total > 0 else requested_total
+        return cls(
+            first_token=settings.STREAM_FIRST_TOKEN_TIMEOUT,
+            idle=settings.STREAM_IDLE_TIMEOUT,
+            total=total
+        )
+
+    def _next_timeout(self) -> tuple[Optional[float], str]:
+        """
+        計算下一次等待可用的秒數與對應的期限種類
+
+        Returns:
+            tuple[Optional[float], str]: (剩餘秒數，None 表示不限制, 期限種類)
+        """
+        candidates = []
+        if not self.received_first and self.first_token > 0:
+            candidates.append((self.started + self.first_token - time.monotonic(), "first_token"))
+        if self.received_first and self.idle > 0:
+            candidates.append((self.idle, "idle"))
+        if self.total > 0:
+            candidates.append((self.started + self.total - time.monotonic(), "total"))
+        if not candidates:
+            return None, ""
+        remaining, kind = min(candidates)
+        return max(remaining, 0.0), kind
+
+    def _limit(self, kind: str) -> float:
+        """取得期限種類對應的設定秒數"""
+        return {"first_token": self.first_token, "idle": self.idle, "total": self.total}[kind]
+
+    async def guard(self, awaitable: Awaitable[T]) -> T:
+        """
+        在目前適用的期限內等待 awaitable，逾時會取消它
+
+        Raises:
+            DeadlineExceeded: 期限到期
+        """
+        timeout, kind = self._next_timeout()
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            DEADLINE_EXCEEDED.inc(deadline=kind)
+            raise DeadlineExceeded(kind, self._limit(kind)) from None
+
+    async def iterate(self, source: AsyncIterator[T]) -> AsyncIterator[T]:
+        """
+        逐項讀取 source，每項都受期限保護；結束或逾時時關閉 source
+
+        Yields:
+            T: source 產生的項目
+
+        Raises:
+            DeadlineExceeded: 期限到期
+        """
+        iterator = source.__aiter__()
+        try:
+            while True:
+                try:
+                    item = await self.guard(iterator.__anext__())
+                except StopAsyncIteration:
+                    return
+                self.received_first = True
+                yield item
+        finally:
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
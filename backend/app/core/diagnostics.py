@@ -0,0 +1,228 @@
+"""
+執行期診斷工具
+
+- 取樣式 profiler：定期讀取所有執行緒的 frame，輸出 collapsed stack（flamegraph.pl / speedscope 可直接讀取）
+- tracemalloc：記錄基準快照，之後比較記憶體配置差異
+- asyncio task 傾印：列出所有存活 task 的 coroutine 堆疊與存活時間
+
+皆為純標準函式庫實作，不需附加外部工具或重新啟動程序
+"""
+import asyncio
+import gc
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import weakref
+from collections import Counter
+from typing import Any, Optional
+
+
+# task -> 建立時間（monotonic），由 install_task_tracking 安裝的 task factory 記錄
+_task_created: "weakref.WeakKeyDictionary[asyncio.Task, float]" = weakref.WeakKeyDictionary()
+
+# tracemalloc 基準快照
+_baseline: Optional[tracemalloc.Snapshot] = None
+
+
+def _describe_frame(frame) -> str:
+    """以「檔名:函式」表示 frame（不含行號，讓相同函式的樣本合併）"""
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def sample_stacks(duration: float, interval: float) -> Counter:
+    """
+    在 duration 秒內每 interval 秒取樣一次所有執行緒的堆疊（需在獨立執行緒中呼叫）
+
+    Args:
+        duration: 取樣總時間（秒）
+        interval: 取樣間隔（秒）
+
+    Returns:
+        Counter: collapsed stack（以 ; 串接，根在前）-> 樣本數
+    """
+    own_thread = threading.get_ident()
+    counts: Counter = Counter()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_describe_frame(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, f"thread-{thread_id}"))
+            counts[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return counts
+
+
+def format_collapsed(counts: Counter) -> str:
+    """
+    輸出 collapsed stack 文字格式（每行「堆疊 樣本數」）
+
+    Args:
+        counts: sample_stacks 的結果
+
+    Returns:
+        str: collapsed stack 文字
+    """
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+def install_task_tracking(loop: asyncio.AbstractEventLoop) -> None:
+    """
+    安裝 task factory，記錄每個 task 的建立時間（保留原有的 factory）
+
+    Args:
+        loop: 目標 event loop
+    """
+    previous = loop.get_task_factory()
+    if getattr(previous, "_tracks_creation", False):
+        return
+
+    def factory(loop, coro, **kwargs):
+        if previous is not None:
+            task = previous(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        _task_created[task] = time.monotonic()
+        return task
+
+    factory._tracks_creation = True
+    loop.set_task_factory(factory)
+
+
+def _awaited(obj: Any) -> Any:
+    """取得 coroutine / async generator 目前正在等待的物件"""
+    for attr in ("cr_await", "ag_await", "gi_yieldfrom"):
+        awaited = getattr(obj, attr, None)
+        if awaited is not None:
+            return awaited
+    # async for 會等待 async_generator_asend，該物件沒有公開屬性可取得原本的 generator
+    if type(obj).__name__ in ("async_generator_asend", "async_generator_athrow"):
+        for referent in gc.get_referents(obj):
+            if hasattr(referent, "ag_frame"):
+                return referent
+    return None
+
+
+def coroutine_stack(coro: Any, limit: int = 50) -> list[str]:
+    """
+    沿著 await 鏈展開 coroutine 堆疊（外層在前）
+
+    Args:
+        coro: task 的 coroutine
+        limit: 最多展開的層數
+
+    Returns:
+        list[str]: 「檔案:行號 in 函式」列表
+    """
+    stack = []
+    while coro is not None and len(stack) < limit:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "ag_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_filename}:{frame.f_lineno} in {getattr(code, 'co_qualname', code.co_name)}")
+        coro = _awaited(coro)
+    return stack
+
+
+def dump_tasks(stack_limit: int = 50) -> list[dict]:
+    """
+    列出目前 event loop 上所有存活的 task（依存活時間由長到短）
+
+    Args:
+        stack_limit: 每個 task 最多展開的堆疊層數
+
+    Returns:
+        list[dict]: 每個 task 的名稱、coroutine、存活秒數（未追蹤時為 None）與堆疊
+    """
+    now = time.monotonic()
+    tasks = []
+    for task in asyncio.all_tasks():
+        coro = task.get_coro()
+        created = _task_created.get(task)
+        tasks.append({
+            "name": task.get_name(),
+            "coro": getattr(coro, "__qualname__", repr(coro)),
+            "age_seconds": round(now - created, 3) if created is not None else None,
+            "stack": coroutine_stack(coro, stack_limit),
+        })
+    tasks.sort(key=lambda item: item["age_seconds"] or 0.0, reverse=True)
+    return tasks
+
+
+def start_tracemalloc(frames: int = 10) -> None:
+    """
+    開始追蹤記憶體配置並記錄基準快照
+
+    Args:
+        frames: 每筆配置保留的堆疊層數
+    """
+    global _baseline
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    _baseline = _take_snapshot()
+
+
+def stop_tracemalloc() -> None:
+    """停止追蹤並丟棄基準快照"""
+    global _baseline
+    _baseline = None
+    tracemalloc.stop()
+
+
+def _take_snapshot() -> tracemalloc.Snapshot:
+    """取得快照並排除 tracemalloc 與 import 機制本身的配置"""
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+
+
+def tracemalloc_diff(limit: int = 20, group_by: str = "lineno", reset: bool = False) -> dict:
+    """
+    比較目前與基準快照的記憶體配置差異
+
+    Args:
+        limit: 回傳的項目數
+        group_by: 分組方式（"lineno" / "filename" / "traceback"）
+        reset: 比較後是否以目前快照作為新的基準
+
+    Returns:
+        dict: 目前追蹤的記憶體總量與依增量排序的差異項目
+
+    Raises:
+        RuntimeError: 尚未呼叫 start_tracemalloc
+    """
+    global _baseline
+    if _baseline is None or not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc 尚未啟動")
+
+    snapshot = _take_snapshot()
+    stats = snapshot.compare_to(_baseline, group_by)
+    current, peak = tracemalloc.get_traced_memory()
+    if reset:
+        _baseline = snapshot
+
+    entries = []
+    for stat in stats[:limit]:
+        entry = {
+            "location": str(stat.traceback[0]),
+            "size_diff": stat.size_diff,
+            "size": stat.size,
+            "count_diff": stat.count_diff,
+            "count": stat.count,
+        }
+        if group_by == "traceback":
+            entry["traceback"] = stat.traceback.format()
+        entries.append(entry)
+
+    return {"traced_bytes": current, "peak_bytes": peak, "stats": entries}
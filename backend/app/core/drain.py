@@ -0,0 +1,155 @@
+"""
+優雅排空（Graceful Drain）
+
+收到 SIGTERM 時不立即關閉：先標記為排空中（readiness 回報未就緒、准入控制拒絕新的串流請求），
+等待進行中的串流完成（最多 DRAIN_TIMEOUT 秒），逾時仍未完成的串流會被中止並送出 shutting_down 錯誤事件，
+最後才交給原本的 SIGTERM 處理器（uvicorn）進行正常關閉
+"""
+import asyncio
+import os
+import signal
+import threading
+import time
+from functools import lru_cache
+from typing import Callable, Optional
+
+from app.core.config import get_settings
+from app.core.metrics import metrics
+
+
+DRAINING_GAUGE = metrics.gauge("worker_draining", "worker 是否正在排空（1 表示排空中）")
+DRAIN_ABORTED = metrics.counter("chat_drain_aborted_streams_total", "排空逾時而被中止的串流數")
+
+
+class DrainController:
+    """
+    排空狀態與進行中串流的追蹤
+
+    Attributes:
+        draining: 是否正在排空（不再接受新的串流請求）
+        expired: 排空是否已逾時（進行中的串流將被中止）
+    """
+
+    def __init__(self, timeout: float = 30.0, grace: float = 0.0):
+        """
+        Args:
+            timeout: 等待進行中串流完成的最長秒數
+            grace: 排空開始後至少維持的秒數（讓負載平衡器偵測到 readiness 失敗）
+        """
+        self.timeout = timeout
+        self.grace = grace
+        self.draining = False
+        self.expired = False
+        self._streams: set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def active_streams(self) -> int:
+        """進行中的串流數"""
+        return len(self._streams)
+
+    def enter_stream(self) -> Optional[asyncio.Task]:
+        """
+        登記目前的 task 為進行中的串流（於 SSE 產生器開始時呼叫）
+
+        Returns:
+            Optional[asyncio.Task]: 登記的 task，需於結束時傳給 exit_stream
+        """
+        task = asyncio.current_task()
+        if task is not None:
+            self._streams.add(task)
+        return task
+
+    def exit_stream(self, task: Optional[asyncio.Task]) -> None:
+        """串流結束時取消登記"""
+        self._streams.discard(task)
+
+    def start(self, on_drained: Callable[[], None] = lambda: None) -> None:
+        """
+        開始排空（重複呼叫無效）
+
+        Args:
+            on_drained: 排空完成後呼叫（例如交給 uvicorn 關閉）
+        """
+        if self.draining:
+            return
+        self.draining = True
+        DRAINING_GAUGE.set(1)
+        print(f"[WARNING] 開始排空：停止接受新的串流，等待 {self.active_streams} 個串流完成（最多 {self.timeout:g} 秒）")
+
+        async def run() -> None:
+            try:
+                await self.drain()
+            finally:
+                on_drained()
+
+        self._task = asyncio.get_running_loop().create_task(run())
+
+    async def drain(self) -> None:
+        """等待進行中的串流完成；逾時則中止剩餘串流，並等待它們送出結束事件"""
+        started = time.monotonic()
+        limit = max(self.timeout, self.grace)
+        while time.monotonic() - started < limit:
+            if not self._streams and time.monotonic() - started >= self.grace:
+                print("[DEBUG] 排空完成：所有串流已結束")
+                return
+            await asyncio.sleep(0.1)
+
+        if not self._streams:
+            return
+        # 逾時：中止剩餘串流（SSE 產生器會送出 shutting_down 事件並保存已產生的部分回應）
+        self.expired = True
+        remaining = list(self._streams)
+        DRAIN_ABORTED.inc(len(remaining))
+        print(f"[WARNING] 排空逾時，中止 {len(remaining)} 個串流")
+        for task in remaining:
+            task.cancel()
+        deadline = time.monotonic() + 5.0
+        while self._streams and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+    def install_signal_handler(self, loop: asyncio.AbstractEventLoop) -> bool:
+        """
+        將 SIGTERM 改為先排空、再交給原本的處理器（需在主執行緒、於 lifespan 啟動時呼叫）
+
+        第二次收到 SIGTERM 時直接交給原本的處理器
+
+        Args:
+            loop: 執行中的 event loop
+
+        Returns:
+            bool: 是否成功安裝（非主執行緒或 SIGTERM 被忽略時不安裝）
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return False
+        previous = signal.getsignal(signal.SIGTERM)
+        if previous is not signal.SIG_DFL and not callable(previous):
+            return False
+
+        def forward(signum: int, frame) -> None:
+            if callable(previous):
+                previous(signum, frame)
+            else:
+                signal.signal(signum, signal.SIG_DFL)
+                os.kill(os.getpid(), signum)
+
+        def handler(signum: int, frame) -> None:
+            if self.draining:
+                forward(signum, frame)
+                return
+            loop.call_soon_threadsafe(self.start, lambda: forward(signum, frame))
+
+        signal.signal(signal.SIGTERM, handler)
+        return True
+
+
+@lru_cache
+def get_drain_controller() -> DrainController:
+    """
+    取得全域排空控制器（每個 worker 一份）
+
+    Returns:
+        DrainController: 全域單例實例
+    """
+    settings = get_settings()
+    return DrainController(settings.DRAIN_TIMEOUT, settings.DRAIN_GRACE_SECONDS)
@@ -0,0 +1,74 @@
+"""
+HTTP 快取輔助工具
+
+將 JSON 回應預先編碼為 bytes 並計算 ETag，
+支援 If-None-Match 條件請求（304 Not Modified）
+"""
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from fastapi import Request, Response, status
+
+
+@dataclass(frozen=True)
+class CachedJSON:
+    """預先編碼的 JSON 回應內容與對應的 ETag"""
+    body: bytes
+    etag: str
+
+    @classmethod
+    def from_content(cls, content: Any) -> "CachedJSON":
+        """
+        序列化內容並計算 ETag
+
+        Args:
+            content: 可 JSON 序列化的內容
+
+        Returns:
+            CachedJSON: 編碼後的內容
+        """
+        body = json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        return cls(body=body, etag=etag)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    以弱比較（weak comparison）判斷 If-None-Match 是否命中
+
+    Args:
+        if_none_match: 請求的 If-None-Match 標頭
+        etag: 目前資源的 ETag
+
+    Returns:
+        bool: 是否命中（應回傳 304）
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    current = etag.removeprefix("W/")
+    return any(
+        candidate.strip().removeprefix("W/") == current
+        for candidate in if_none_match.split(",")
+    )
+
+
+def cached_json_response(request: Request, cached: CachedJSON, cache_control: str) -> Response:
+    """
+    建立帶有 ETag / Cache-Control 的回應，條件請求命中時回傳 304
+
+    Args:
+        request: 目前的請求
+        cached: 預先編碼的內容
+        cache_control: Cache-Control 標頭值
+
+    Returns:
+        Response: 200（含內容）或 304（無內容）
+    """
+    headers = {"ETag": cached.etag, "Cache-Control": cache_control}
+    if etag_matches(request.headers.get("if-none-match"), cached.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=cached.body, media_type="application/json", headers=headers)
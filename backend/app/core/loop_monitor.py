@@ -0,0 +1,79 @@
+"""
+Event Loop 延遲監測
+
+背景工作以固定間隔 sleep，實際醒來時間與預期時間的差距即為 event loop 延遲（lag）。
+延遲升高代表 loop 已飽和，所有串流都會開始卡頓
+"""
+import asyncio
+from functools import lru_cache
+from typing import Optional
+
+from app.core.config import get_settings
+from app.core.metrics import metrics
+
+
+LOOP_LAG_GAUGE = metrics.gauge(
+    "event_loop_lag_seconds", "Event loop 延遲（指數移動平均）"
+)
+LOOP_LAG_HISTOGRAM = metrics.histogram(
+    "event_loop_lag_sample_seconds",
+    "Event loop 延遲取樣分佈",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+
+
+class LoopLagMonitor:
+    """
+    Event loop 延遲取樣器
+
+    lag 為指數移動平均（避免單次 GC 停頓觸發拒絕），last_sample 為最近一次取樣值
+    """
+
+    def __init__(self, interval: float = 0.1, smoothing: float = 0.3):
+        """
+        Args:
+            interval: 取樣間隔（秒）
+            smoothing: 指數移動平均的新樣本權重（0~1）
+        """
+        self.interval = interval
+        self.smoothing = smoothing
+        self.lag = 0.0
+        self.last_sample = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """啟動背景取樣（需在 event loop 內呼叫）"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="loop-lag-monitor")
+
+    async def stop(self) -> None:
+        """停止背景取樣"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            sample = max(0.0, loop.time() - started - self.interval)
+            self.last_sample = sample
+            self.lag = self.smoothing * sample + (1 - self.smoothing) * self.lag
+            LOOP_LAG_GAUGE.set(self.lag)
+            LOOP_LAG_HISTOGRAM.observe(sample)
+
+
+@lru_cache
+def get_loop_monitor() -> LoopLagMonitor:
+    """
+    取得全域 event loop 延遲取樣器（每個 worker 一份，取樣工作於 lifespan 啟動）
+
+    Returns:
+        LoopLagMonitor: 全域單例實例
+    """
+    return LoopLagMonitor(interval=get_settings().LOOP_LAG_SAMPLE_INTERVAL_MS / 1000)
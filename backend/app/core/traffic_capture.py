@@ -0,0 +1,227 @@
+"""
+流量錄製 Middleware
+
+記錄每個串流請求的「形狀」而不記錄內容，供 scripts/replay_traffic.py 以實際的到達模式與 prompt 長度分布重播：
+到達時間、模型、訊息與歷史長度，以及 SSE 串流中每個 chunk 事件的時間與字元數
+session ID 只保留加鹽雜湊（HMAC-SHA256），檔案為精簡的 NDJSON（每個請求一行），多個 worker 可附加寫入同一個檔案
+"""
+import hashlib
+import hmac
+import json
+import os
+import random
+import secrets
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import DEFAULT_SESSION_ID, get_settings
+from app.core.metrics import metrics
+
+
+CAPTURED = metrics.counter("traffic_captured_requests_total", "已錄製的請求數", ("status",))
+
+# 請求內容超過此大小時不解析（訊息長度上限為 10000 字元，正常請求遠小於此）
+MAX_BODY_BYTES = 256 * 1024
+
+
+def anonymize_session(session_id: str, salt: str) -> str:
+    """
+    session ID 的加鹽雜湊（同一 session 的請求仍可串接）
+
+    未加鹽的雜湊可對常見或較短的 ID 做字典攻擊還原，因此以 salt 為金鑰計算 HMAC；
+    不知道 salt 的人無法由錄製檔反推 session ID
+
+    Args:
+        session_id: 原本的 session ID
+        salt: 雜湊金鑰
+
+    Returns:
+        str: 12 個十六進位字元的識別碼
+    """
+    return hmac.new(salt.encode("utf-8"), session_id.encode("utf-8"), hashlib.sha256).hexdigest()[:12]
+
+
+class TrafficRecorder:
+    """
+    將錄製結果附加寫入 NDJSON 檔
+
+    每筆記錄以單次 os.write 寫入以 O_APPEND 開啟的檔案，多個 worker 同時寫入時不會交錯
+    """
+
+    def __init__(self, path: str, sample_rate: float = 1.0, salt: Optional[str] = None):
+        """
+        Args:
+            path: 輸出檔案路徑（不存在時建立）
+            sample_rate: 錄製的請求比例（0~1）
+            salt: session ID 雜湊的金鑰，未指定時每個錄製器隨機產生（不寫入檔案）
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.salt = salt or secrets.token_hex(16)
+        self._fd: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def sampled(self) -> bool:
+        """本次請求是否錄製"""
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def write(self, record: dict[str, Any]) -> None:
+        """寫入一筆記錄"""
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        with self._lock:
+            if self._fd is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+            os.write(self._fd, line)
+
+    def close(self) -> None:
+        """關閉檔案"""
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+class _Capture:
+    """單一請求的錄製狀態（解析 SSE 事件）"""
+
+    def __init__(self, started: float):
+        self.started = started
+        self.request: dict[str, Any] = {}
+        self.history_messages = 0
+        self.history_chars = 0
+        self.status_code = 0
+        self.model: Optional[str] = None
+        self.status = "incomplete"
+        self.offsets_ms: list[int] = []
+        self.chunk_chars: list[int] = []
+        self._buffer = b""
+
+    def feed(self, data: bytes) -> None:
+        """解析回應內容中的完整 SSE 事件"""
+        self._buffer += data
+        *events, self._buffer = self._buffer.split(b"\n\n")
+        for event in events:
+            name, _, payload = event.partition(b"\ndata: ")
+            name = name.removeprefix(b"event: ")
+            if name == b"chunk":
+                self.offsets_ms.append(round((time.perf_counter() - self.started) * 1000))
+                self.chunk_chars.append(len(json.loads(payload).get("content", "")))
+            elif name == b"start":
+                self.model = json.loads(payload).get("model")
+            elif name == b"done":
+                self.status = "done"
+            elif name == b"error":
+                self.status = json.loads(payload).get("code") or "error"
+
+
+class TrafficCaptureMiddleware:
+    """錄製指定路徑的串流請求（僅 POST）"""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        recorder: TrafficRecorder,
+        history_stats: Callable[[str], Awaitable[tuple[int, int]]],
+        paths: tuple[str, ...] = ("/api/chat/send",)
+    ):
+        """
+        Args:
+            app: 下一層 ASGI app
+            recorder: 錄製結果的輸出
+            history_stats: 以 session ID 取得目前歷史 (訊息數, 字元數) 的 async 函式（記錄請求到達時的歷史長度）
+            paths: 錄製的路徑
+        """
+        self.app = app
+        self.recorder = recorder
+        self.history_stats = history_stats
+        self.paths = paths
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http" or scope["method"] != "POST"
+            or scope["path"] not in self.paths or not self.recorder.sampled()
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        arrival = time.time()
+        capture = _Capture(time.perf_counter())
+        body = bytearray()
+
+        async def receive_wrapper() -> Message:
+            message = await receive()
+            if message["type"] == "http.request" and len(body) < MAX_BODY_BYTES:
+                body.extend(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message: Message) -> None:
+            try:
+                if message["type"] == "http.response.start":
+                    capture.status_code = message["status"]
+                    # 路由已讀完請求，串流尚未寫入歷史：此時的歷史即為本次 prompt 的上下文
+                    await self._inspect_request(bytes(body), capture)
+                elif message["type"] == "http.response.body" and capture.status_code == 200:
+                    capture.feed(message.get("body", b""))
+            except Exception as e:
+                capture.status = "capture_error"
+                print(f"[WARNING] 流量錄製解析失敗: {type(e).__name__}: {e}")
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            self._record(scope["path"], arrival, capture)
+
+    async def _inspect_request(self, body: bytes, capture: _Capture) -> None:
+        """解析請求內容並記錄目前的歷史長度（在轉送回應開頭前查詢，查詢不在事件迴圈上執行）"""
+        capture.request = json.loads(body) if body else {}
+        capture.history_messages, capture.history_chars = await self.history_stats(
+            capture.request.get("session_id") or DEFAULT_SESSION_ID
+        )
+
+    def _record(self, path: str, arrival: float, capture: _Capture) -> None:
+        """組合並寫入一筆記錄（錄製失敗不影響請求）"""
+        try:
+            request = capture.request
+            status = capture.status if capture.status_code == 200 else f"http_{capture.status_code}"
+            self.recorder.write({
+                "ts": round(arrival, 3),
+                "path": path,
+                "session": anonymize_session(request.get("session_id") or DEFAULT_SESSION_ID, self.recorder.salt),
+                "requested_model": request.get("model"),
+                "model": capture.model,
+                "message_chars": len(request.get("message", "")),
+                "history_messages": capture.history_messages,
+                "history_chars": capture.history_chars,
+                "status": status,
+                "offsets_ms": capture.offsets_ms,
+                "chunk_chars": capture.chunk_chars,
+            })
+            CAPTURED.inc(status=status)
+        except Exception as e:
+            print(f"[WARNING] 流量錄製失敗: {type(e).__name__}: {e}")
+
+
+@lru_cache
+def get_traffic_recorder() -> Optional[TrafficRecorder]:
+    """
+    取得全域流量錄製器
+
+    Returns:
+        Optional[TrafficRecorder]: TRAFFIC_CAPTURE_PATH 有設定時為全域單例實例，否則為 None
+    """
+    settings = get_settings()
+    if not settings.TRAFFIC_CAPTURE_PATH:
+        return None
+    if not settings.TRAFFIC_CAPTURE_SALT and settings.WEB_CONCURRENCY > 1:
+        print("[WARNING] 未設定 TRAFFIC_CAPTURE_SALT：各 worker 使用不同的隨機 salt，同一 session 在不同 worker 的記錄無法串接")
+    return TrafficRecorder(
+        settings.TRAFFIC_CAPTURE_PATH, settings.TRAFFIC_CAPTURE_SAMPLE_RATE, settings.TRAFFIC_CAPTURE_SALT or None
+    )
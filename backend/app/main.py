@@ -2,13 +2,32 @@
 FastAPI 應用程式主入口
 
 初始化 FastAPI app、註冊路由與 middleware
+服務實例（OpenAI 客戶端、模型服務、狀態儲存）皆在第一次使用或 lifespan 啟動時才建立；
+依設定加入的 middleware 在第一次收到 ASGI 事件時才建立，匯入本模組（例如產生 OpenAPI 文件）不需要讀取設定
 """
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from functools import lru_cache
+
+from fastapi import Depends, FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.openapi.docs import get_redoc_html, get_swagger_ui_html
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 
-from app.core.config import settings
-from app.routers import chat
+from app.core.admission import AdmissionMiddleware, get_admission_controller
+from app.core.circuit_breaker import OPEN, CircuitBreaker, get_circuit_breaker
+from app.core.compression import CompressionMiddleware
+from app.core.config import Settings, get_settings
+from app.core.diagnostics import install_task_tracking
+from app.core.drain import DrainController, get_drain_controller
+from app.core.http_cache import CachedJSON, cached_json_response
+from app.core.loop_monitor import get_loop_monitor
+from app.core.metrics import metrics
+from app.core.traffic_capture import TrafficCaptureMiddleware, get_traffic_recorder
+from app.routers import admin, chat
+from app.services.model_service import ModelService, get_model_service
+from app.services.openai_service import get_openai_service
+from app.services.state_store import get_state_store
 
 
 # OpenAPI 標籤定義
@@ -35,12 +54,106 @@ tags_metadata = [
     },
 ]
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    應用程式生命週期
+
+    啟動：開始 event loop 延遲取樣，依 PREWARM_MODEL_CATALOG 預先載入模型目錄，並將 SIGTERM 改為先排空
+    關閉：等待背景摘要壓縮完成，關閉流量錄製檔，再釋放已建立的狀態儲存
+    """
+    settings = get_settings()
+    loop_monitor = get_loop_monitor()
+    traffic_recorder = get_traffic_recorder()
+    loop = asyncio.get_running_loop()
+    if settings.ADMIN_TOKEN:
+        # 記錄 task 建立時間，供 /api/admin/tasks 顯示存活時間
+        install_task_tracking(loop)
+    if not get_drain_controller().install_signal_handler(loop):
+        print("[WARNING] 無法安裝 SIGTERM 排空處理器，關閉時不會等待進行中的串流")
+    loop_monitor.start()
+    if settings.PREWARM_MODEL_CATALOG:
+        await get_model_service().prewarm()
+
+    yield
+
+    await loop_monitor.stop()
+
+    if get_openai_service.cache_info().currsize:
+        await get_openai_service().compactor.wait_for_pending(timeout=10.0)
+
+    if traffic_recorder is not None:
+        traffic_recorder.close()
+
+    # 僅關閉實際建立過的狀態儲存，避免在關閉階段才建立
+    if get_state_store.cache_info().currsize:
+        get_state_store().close()
+
+
+def install_middleware(app: FastAPI, settings: Settings) -> None:
+    """
+    依設定加入 middleware（後加入的位於外層）
+
+    Args:
+        app: FastAPI 應用程式
+        settings: 應用程式設定
+    """
+    # 准入控制（放在 CORS 內層，503 回應同樣帶有 CORS 標頭）
+    app.add_middleware(
+        AdmissionMiddleware,
+        controller=get_admission_controller(),
+        paths=("/api/chat/send", "/api/chat/regenerate", "/api/chat/compare")
+    )
+
+    # CORS 設定
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=settings.cors_origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    # 回應壓縮（僅 JSON；SSE 串流直接轉送，不受影響）
+    if settings.COMPRESSION_ENABLED:
+        app.add_middleware(CompressionMiddleware, minimum_size=settings.COMPRESSION_MINIMUM_SIZE)
+
+    # 流量錄製（最外層：被准入控制拒絕的請求同樣記錄到達時間）
+    traffic_recorder = get_traffic_recorder()
+    if traffic_recorder is not None:
+        app.add_middleware(
+            TrafficCaptureMiddleware,
+            recorder=traffic_recorder,
+            history_stats=lambda session_id: get_openai_service().get_history_stats(session_id)
+        )
+
+
+class ChatAPI(FastAPI):
+    """
+    在建立 middleware stack 時（第一次收到 ASGI 事件，通常是 lifespan 啟動）才讀取設定
+
+    APP_NAME、DEBUG 與依設定加入的 middleware 都在此時套用，
+    匯入 app.main 或產生 OpenAPI 文件時不需要 GEMINI_API_KEY
+    """
+
+    def build_middleware_stack(self):
+        settings = get_settings()
+        self.title = settings.APP_NAME
+        self.debug = settings.DEBUG
+        install_middleware(self, settings)
+        return super().build_middleware_stack()
+
+
 # 建立 FastAPI 應用程式
-app = FastAPI(
-    title=settings.APP_NAME,
+app = ChatAPI(
+    title=Settings.model_fields["APP_NAME"].default,
     description="AI 對話聊天 API，整合 Google Gemini（通過 OpenAI SDK）",
     version="1.0.0",
-    debug=settings.DEBUG,
+    lifespan=lifespan,
+    # 改由下方的快取版本提供 OpenAPI JSON 與文件頁面
+    openapi_url=None,
+    docs_url=None,
+    redoc_url=None,
     openapi_tags=tags_metadata,
     contact={
         "name": "開發團隊",
@@ -64,18 +177,33 @@ app = FastAPI(
 )
 
 
-# CORS 設定
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=settings.cors_origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-
 # 註冊路由
 app.include_router(chat.router)
+app.include_router(admin.router)
+
+
+@lru_cache
+def _openapi_payload() -> CachedJSON:
+    """OpenAPI 文件只在第一次請求時產生並編碼，之後重用同一份 bytes"""
+    return CachedJSON.from_content(app.openapi())
+
+
+@app.get("/openapi.json", include_in_schema=False)
+async def openapi_json(request: Request) -> Response:
+    """OpenAPI 規格（預先編碼，支援 ETag / 304）"""
+    return cached_json_response(request, _openapi_payload(), cache_control="public, max-age=3600")
+
+
+@app.get("/docs", include_in_schema=False)
+async def swagger_ui() -> HTMLResponse:
+    """Swagger UI 文件頁面"""
+    return get_swagger_ui_html(openapi_url="/openapi.json", title=f"{app.title} - Swagger UI")
+
+
+@app.get("/redoc", include_in_schema=False)
+async def redoc() -> HTMLResponse:
+    """ReDoc 文件頁面"""
+    return get_redoc_html(openapi_url="/openapi.json", title=f"{app.title} - ReDoc")
 
 
 @app.get("/", tags=["root"])
@@ -89,15 +217,55 @@ async def root() -> JSONResponse:
     })
 
 
+@app.get("/metrics", tags=["health"], response_class=PlainTextResponse)
+async def metrics_endpoint() -> PlainTextResponse:
+    """Prometheus 格式的 metrics（每個 worker 各自回報）"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/health", tags=["health"])
 async def health_check() -> JSONResponse:
-    """健康檢查 endpoint"""
+    """健康檢查 endpoint（與 /health/live 相同，保留給既有的監控設定）"""
     return JSONResponse({
         "status": "healthy",
-        "service": settings.APP_NAME
+        "service": get_settings().APP_NAME
     })
 
 
+@app.get("/health/live", tags=["health"])
+async def liveness() -> JSONResponse:
+    """Liveness：程序與 event loop 仍在運作（排空中也回報存活，避免被提前重啟）"""
+    return JSONResponse({"status": "alive"})
+
+
+@app.get("/health/ready", tags=["health"])
+async def readiness(
+    model_service: ModelService = Depends(get_model_service),
+    breaker: CircuitBreaker = Depends(get_circuit_breaker),
+    drain: DrainController = Depends(get_drain_controller)
+) -> JSONResponse:
+    """
+    Readiness：是否可以接收新流量
+
+    模型目錄已載入、上游熔斷器未熔斷且未在排空時才回報就緒（200），否則回傳 503；
+    目錄尚未載入時會在背景開始預熱
+    """
+    circuit = breaker.state
+    checks = {
+        "catalog_warm": model_service.catalog_warm,
+        "upstream_circuit": circuit,
+        "draining": drain.draining,
+        "active_streams": drain.active_streams,
+    }
+    ready = checks["catalog_warm"] and circuit != OPEN and not drain.draining
+    if not checks["catalog_warm"]:
+        model_service.ensure_prewarm()
+    return JSONResponse(
+        {"status": "ready" if ready else "not_ready", "checks": checks},
+        status_code=200 if ready else 503
+    )
+
+
 # 全域例外處理（可選，未來擴充）
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
@@ -106,6 +274,6 @@ async def global_exception_handler(request, exc):
         status_code=500,
         content={
             "detail": "Internal server error",
-            "message": str(exc) if settings.DEBUG else "發生系統錯誤，請稍後再試"
+            "message": str(exc) if get_settings().DEBUG else "發生系統錯誤，請稍後再試"
         }
     )
@@ -0,0 +1,194 @@
+"""
+Admin 診斷 API Endpoints
+
+提供取樣式 profiler、tracemalloc 快照比較、asyncio task 傾印，以及對話歷史的串流匯出 / 匯入
+需設定 ADMIN_TOKEN 並以 Authorization: Bearer <token> 呼叫；未設定時所有 endpoint 回傳 404
+"""
+import asyncio
+import hmac
+import zlib
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+from app.core import diagnostics
+from app.core.config import Settings, get_settings
+from app.routers.chat import search_response
+from app.schemas.chat import SearchResponse
+from app.services.history_transfer import (
+    EXPORT_FORMATS,
+    HistoryImporter,
+    available_compressions,
+    export_ndjson
+)
+from app.services.state_store import StateStore, get_state_store
+
+
+async def require_admin_token(
+    authorization: Optional[str] = Header(None),
+    settings: Settings = Depends(get_settings)
+) -> None:
+    """
+    驗證 admin token
+
+    Raises:
+        HTTPException: 未設定 ADMIN_TOKEN 時返回 404，token 錯誤時返回 401
+    """
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), settings.ADMIN_TOKEN.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="無效的 admin token",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+
+router = APIRouter(
+    prefix="/api/admin",
+    tags=["Admin"],
+    dependencies=[Depends(require_admin_token)],
+    include_in_schema=False
+)
+
+# 同一時間只允許一個 profiler 執行
+_profile_lock = asyncio.Lock()
+
+
+@router.post("/profile", response_class=PlainTextResponse)
+async def profile(
+    duration: float = Query(5.0, gt=0, le=60, description="取樣時間（秒）"),
+    interval_ms: float = Query(5.0, ge=1, le=1000, description="取樣間隔（毫秒）")
+) -> PlainTextResponse:
+    """
+    在獨立執行緒中取樣所有執行緒的堆疊，回傳 collapsed stack 文字
+
+    輸出可直接交給 flamegraph.pl 或 speedscope 產生火焰圖
+
+    Raises:
+        HTTPException: 已有 profiler 執行中時返回 409
+    """
+    if _profile_lock.locked():
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="已有 profiler 執行中")
+
+    async with _profile_lock:
+        counts = await asyncio.to_thread(diagnostics.sample_stacks, duration, interval_ms / 1000)
+    return PlainTextResponse(diagnostics.format_collapsed(counts))
+
+
+@router.get("/tasks")
+async def list_tasks(
+    stack_limit: int = Query(50, ge=1, le=500, description="每個 task 最多展開的堆疊層數")
+) -> JSONResponse:
+    """列出所有存活的 asyncio task（含 coroutine 堆疊與存活時間）"""
+    tasks = diagnostics.dump_tasks(stack_limit)
+    return JSONResponse({"count": len(tasks), "tasks": tasks})
+
+
+@router.post("/tracemalloc/start")
+async def tracemalloc_start(
+    frames: int = Query(10, ge=1, le=100, description="每筆配置保留的堆疊層數")
+) -> JSONResponse:
+    """開始追蹤記憶體配置，並以目前狀態作為比較基準"""
+    await asyncio.to_thread(diagnostics.start_tracemalloc, frames)
+    return JSONResponse({"tracing": True, "frames": frames})
+
+
+@router.get("/tracemalloc/diff")
+async def tracemalloc_diff(
+    limit: int = Query(20, ge=1, le=500, description="回傳項目數"),
+    group_by: Literal["lineno", "filename", "traceback"] = Query("lineno", description="分組方式"),
+    reset: bool = Query(False, description="比較後以目前快照作為新基準")
+) -> JSONResponse:
+    """
+    比較目前與基準快照的記憶體配置差異
+
+    Raises:
+        HTTPException: tracemalloc 尚未啟動時返回 409
+    """
+    try:
+        result = await asyncio.to_thread(diagnostics.tracemalloc_diff, limit, group_by, reset)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return JSONResponse(result)
+
+
+@router.post("/tracemalloc/stop")
+async def tracemalloc_stop() -> JSONResponse:
+    """停止追蹤記憶體配置"""
+    diagnostics.stop_tracemalloc()
+    return JSONResponse({"tracing": False})
+
+
+@router.get("/search", response_model=SearchResponse)
+async def search_all_sessions(
+    q: str = Query(..., min_length=1, max_length=200, description="查詢字串，所有詞皆須命中"),
+    session_id: Optional[str] = Query(
+        None, min_length=1, max_length=64, pattern=r"^[A-Za-z0-9_\-]+$",
+        description="僅搜尋指定 session，留空則搜尋全部"
+    ),
+    limit: int = Query(20, ge=1, le=100, description="每頁筆數"),
+    offset: int = Query(0, ge=0, description="略過筆數"),
+    store: StateStore = Depends(get_state_store)
+) -> SearchResponse:
+    """跨 session 全文檢索（回傳各命中訊息所屬的 session，僅供管理用途）"""
+    total, hits = await store.run(store.search_messages, q, session_id, limit, offset)
+    return search_response(q, limit, offset, total, hits)
+
+
+@router.get("/export")
+async def export_history(
+    session_id: Optional[str] = Query(None, max_length=64, description="僅匯出指定 session，留空表示全部"),
+    compression: Literal["none", "gzip", "zstd"] = Query("gzip", description="壓縮格式"),
+    store: StateStore = Depends(get_state_store)
+) -> StreamingResponse:
+    """
+    以 NDJSON 串流匯出對話歷史（逐批讀取與壓縮，記憶體用量固定）
+
+    Raises:
+        HTTPException: 壓縮格式不可用（zstd 需安裝 zstandard）時返回 400
+    """
+    if compression not in available_compressions():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"不支援的壓縮格式: {compression}（可用: {available_compressions()}）"
+        )
+
+    media_type, extension = EXPORT_FORMATS[compression]
+    # 同步 generator 由 StreamingResponse 在執行緒池中迭代，讀取儲存不阻塞 event loop
+    return StreamingResponse(
+        export_ndjson(store, session_id, compression),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="chat-history{extension}"'}
+    )
+
+
+@router.post("/import")
+async def import_history(
+    request: Request,
+    batch_size: int = Query(1000, ge=1, le=50000, description="每次批次寫入的訊息數"),
+    store: StateStore = Depends(get_state_store)
+) -> JSONResponse:
+    """
+    匯入 export 產生的 NDJSON（可為 gzip / zstd 壓縮，依檔頭自動判斷）
+
+    請求內容逐片段解壓、解析並批次寫入，不需一次載入整份檔案；訊息 ID 重新指派
+    解壓與寫入（SQLite 批次交易可能等待寫入鎖）在 thread 中執行，不阻塞 event loop 上的串流
+
+    Raises:
+        HTTPException: 資料格式錯誤時返回 400（已寫入的批次不會回滾）
+    """
+    importer = HistoryImporter(store, batch_size)
+    try:
+        async for chunk in request.stream():
+            await asyncio.to_thread(importer.feed, chunk)
+        imported = await asyncio.to_thread(importer.close)
+    except (ValueError, zlib.error) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{e}（已匯入 {importer.imported} 筆）"
+        )
+    return JSONResponse({"imported": imported})
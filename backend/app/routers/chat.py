@@ -4,23 +4,73 @@ Chat 相關 API Endpoints
 提供聊天功能的 RESTful API，支援 Server-Sent Events (SSE) streaming
 使用 OpenAI SDK 搭配 Google Vertex AI OpenAI 兼容 API
 """
+import asyncio
 import json
-from typing import AsyncGenerator
-from fastapi import APIRouter, HTTPException, status
+import time
+from typing import AsyncGenerator, Callable, Optional, Union
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
 from fastapi.responses import StreamingResponse
 
-from app.core.config import AVAILABLE_MODELS, validate_model, settings
+from app.core.config import (
+    AUTO_MODEL_ID,
+    AVAILABLE_MODELS,
+    DEFAULT_SESSION_ID,
+    Settings,
+    get_settings,
+    validate_model
+)
+from app.core.deadlines import DeadlineExceeded, StreamDeadline
+from app.core.drain import get_drain_controller
+from app.core.http_cache import cached_json_response
 from app.schemas.chat import (
     ChatMessageRequest,
+    CompareRequest,
+    CompareStartEvent,
+    CompareChunkEvent,
+    CompareErrorEvent,
+    CompareModelResult,
+    CompareDoneEvent,
     ChatHistoryResponse,
     ClearHistoryResponse,
+    RegenerateRequest,
+    ForkRequest,
+    GenerationControls,
+    SwitchBranchRequest,
+    BranchInfo,
+    BranchListResponse,
+    SearchResponse,
+    SearchResult,
     StreamStartEvent,
     StreamChunkEvent,
+    StreamBlockEvent,
     StreamDoneEvent,
+    StreamErrorEvent,
+    ModelSelectionInfo,
     MessageRole
 )
-from app.services.openai_service import openai_service
-from app.services.model_service import model_service
+from app.services.history import HistoryEntry
+from app.services.markdown_renderer import (
+    IncrementalMarkdownRenderer,
+    cache_rendered_html,
+    get_rendered_html,
+    markdown_available
+)
+from app.services.openai_service import (
+    QUOTA_EXCEEDED_MESSAGE,
+    CompletionStats,
+    OpenAIService,
+    generation_params,
+    get_openai_service
+)
+from app.services.model_selector import ModelSelection
+from app.services.model_service import ModelService, get_model_service
+from app.services.output_filters import ChunkPipeline, build_output_pipeline
+from app.services.search_index import make_snippet
+from app.services.state_store import StateStore, get_state_store
+
+
+# 排空逾時、串流被中止時送出的錯誤事件
+SHUTTING_DOWN_EVENT = StreamErrorEvent(error="伺服器正在重新部署，回應已中斷，請重新送出", code="shutting_down")
 
 
 router = APIRouter(
@@ -48,17 +98,22 @@ router = APIRouter(
                 }
             }
         },
+        304: {"description": "模型列表未變更（If-None-Match 命中）"},
         500: {"description": "伺服器內部錯誤"}
     }
 )
-async def get_available_models():
+async def get_available_models(
+    request: Request,
+    model_service: ModelService = Depends(get_model_service)
+) -> Response:
     """
     取得可用的 Gemini 模型列表
 
-    從 Google Generative Language API 動態獲取可用模型列表
+    從 Google Generative Language API 動態獲取可用模型列表；
+    回應內容依目錄版本預先編碼，並以 ETag 支援 304 條件請求
 
     Returns:
-        dict: 包含模型列表與預設模型的回應
+        Response: 包含模型列表與預設模型的 JSON 回應
             - models: 模型資訊列表
             - default_model: 預設模型 ID
 
@@ -66,12 +121,8 @@ async def get_available_models():
         HTTPException: 若 Google API 呼叫失敗，返回 500 錯誤
     """
     try:
-        # 從 Google API 動態取得模型列表
-        models = await model_service.get_available_models()
-        return {
-            "models": models,
-            "default_model": model_service.get_default_model()
-        }
+        # 取得預先編碼的模型列表（僅在目錄版本改變時重新序列化）
+        payload = await model_service.get_models_payload()
     except Exception as e:
         # 若 API 失敗，返回 500 錯誤
         raise HTTPException(
@@ -79,47 +130,278 @@ async def get_available_models():
             detail=f"無法取得模型列表: {str(e)}"
         )
 
+    return cached_json_response(request, payload, cache_control="public, max-age=60")
+
+
+SESSION_ID_QUERY = Query(
+    DEFAULT_SESSION_ID,
+    min_length=1,
+    max_length=64,
+    pattern=r"^[A-Za-z0-9_\-]+$",
+    description="對話 session ID"
+)
+
+
+async def enforce_rate_limit(
+    request: Request,
+    settings: Settings = Depends(get_settings),
+    store: StateStore = Depends(get_state_store)
+) -> None:
+    """
+    依客戶端 IP 套用 token bucket 速率限制（RATE_LIMIT_PER_MINUTE 為 0 時停用）
 
-async def generate_sse_stream(user_message: str, model: str) -> AsyncGenerator[str, None]:
+    桶狀態存放於共享狀態儲存，多 worker 部署時所有 worker 共用同一份額度
+
+    Raises:
+        HTTPException: 超過速率限制時返回 429 並附帶 Retry-After
+    """
+    if settings.RATE_LIMIT_PER_MINUTE <= 0:
+        return
+
+    client_host = request.client.host if request.client else "unknown"
+    allowed, retry_after = await store.run(
+        store.consume_token,
+        f"send:{client_host}",
+        capacity=max(settings.RATE_LIMIT_BURST, 1),
+        refill_per_second=settings.RATE_LIMIT_PER_MINUTE / 60.0
+    )
+    if not allowed:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="請求過於頻繁，請稍後再試",
+            headers={"Retry-After": str(max(1, round(retry_after)))}
+        )
+
+
+async def generate_sse_stream(
+    openai_service: OpenAIService,
+    user_message: Optional[str],
+    model: str,
+    session_id: str = DEFAULT_SESSION_ID,
+    deadline: Optional[StreamDeadline] = None,
+    renderer: Optional[IncrementalMarkdownRenderer] = None,
+    selection: Optional[ModelSelection] = None,
+    pipeline: Optional[ChunkPipeline] = None,
+    generation: Optional[GenerationControls] = None
+) -> AsyncGenerator[str, None]:
     """
     生成 Server-Sent Events (SSE) 格式的串流回應
 
     Args:
-        user_message: 使用者輸入的訊息
+        openai_service: 負責呼叫模型與記錄歷史的服務
+        user_message: 使用者輸入的訊息，None 表示重新產生目前分支最後一則使用者訊息的回應
         model: 使用的 Google Gemini 模型 ID（通過 OpenAI API 訪問）
+        session_id: 對話 session ID
+        deadline: 串流期限（None 表示不限制）
+        renderer: 增量 Markdown 渲染器（None 表示不渲染，不送出 block 事件）
+        selection: auto 模式的選擇結果（於 start 事件中說明）
+        pipeline: 輸出過濾管線（於 SSE 封裝前套用，None 表示不過濾）
+        generation: 生成參數（None 表示使用模型的預設值）
 
     Yields:
         str: SSE 格式的事件資料
     """
+    block_index = 0
+    drain = get_drain_controller()
+    stream_task = drain.enter_stream()
+
     try:
         # 發送 start 事件（包含使用的模型資訊）
         start_event = StreamStartEvent(role=MessageRole.ASSISTANT, model=model)
-        yield f"event: start\ndata: {start_event.model_dump_json()}\n\n"
+        if selection is not None:
+            start_event.selection = ModelSelectionInfo(
+                tier=selection.tier,
+                reason=selection.reason,
+                expected_ttft_ms=round(selection.expected_ttft * 1000, 1) if selection.expected_ttft is not None else None,
+                prompt_chars=selection.prompt_chars
+            )
+        yield f"event: start\ndata: {start_event.model_dump_json(exclude_none=True)}\n\n"
 
         # 收集完整回應
         complete_content_parts = []
 
         # 串流 OpenAI 回應（使用 Google Gemini 模型）
-        async for chunk in openai_service.generate_streaming_response(user_message, model=model):
+        if user_message is None:
+            chunks = openai_service.regenerate_streaming_response(
+                model=model, session_id=session_id, deadline=deadline, pipeline=pipeline, generation=generation
+            )
+        else:
+            chunks = openai_service.generate_streaming_response(
+                user_message, model=model, session_id=session_id, deadline=deadline, pipeline=pipeline,
+                generation=generation
+            )
+        async for chunk in chunks:
             complete_content_parts.append(chunk)
 
             # 發送 chunk 事件
             chunk_event = StreamChunkEvent(content=chunk)
             yield f"event: chunk\ndata: {chunk_event.model_dump_json()}\n\n"
 
-        # 發送 done 事件
+            # 發送新定稿的 Markdown 區塊
+            if renderer is not None:
+                for html in renderer.feed(chunk):
+                    block_event = StreamBlockEvent(index=block_index, html=html)
+                    yield f"event: block\ndata: {block_event.model_dump_json()}\n\n"
+                    block_index += 1
+
         complete_content = "".join(complete_content_parts)
+
+        # 渲染剩餘內容，並快取完整 HTML 供重新載入歷史時使用
+        if renderer is not None:
+            for html in renderer.flush():
+                block_event = StreamBlockEvent(index=block_index, html=html)
+                yield f"event: block\ndata: {block_event.model_dump_json()}\n\n"
+                block_index += 1
+            await openai_service.store.run(
+                cache_rendered_html,
+                openai_service.store, complete_content, renderer.html, ttl=get_settings().MARKDOWN_CACHE_TTL
+            )
+
+        # 發送 done 事件
         done_event = StreamDoneEvent(
             role=MessageRole.ASSISTANT,
             complete_content=complete_content
         )
         yield f"event: done\ndata: {done_event.model_dump_json()}\n\n"
 
+    except DeadlineExceeded as e:
+        # 期限到期：上游已取消，說明是哪一個期限
+        error_event = StreamErrorEvent(
+            error=str(e), code="deadline_exceeded", deadline=e.deadline, timeout=e.timeout
+        )
+        yield f"event: error\ndata: {error_event.model_dump_json(exclude_none=True)}\n\n"
+
+    except asyncio.CancelledError:
+        # 排空逾時而被中止：告知客戶端後正常結束串流（已產生的部分回應已寫入歷史）
+        if not drain.expired:
+            raise
+        yield f"event: error\ndata: {SHUTTING_DOWN_EVENT.model_dump_json(exclude_none=True)}\n\n"
+
     except Exception as e:
         # 發送錯誤事件
         error_data = {"error": str(e)}
         yield f"event: error\ndata: {json.dumps(error_data)}\n\n"
 
+    finally:
+        drain.exit_stream(stream_task)
+
+
+async def ensure_valid_model(model: str, settings: Settings, model_service: ModelService) -> None:
+    """
+    以動態模型目錄驗證模型
+
+    Raises:
+        HTTPException: 模型無效時返回 400（附上可用模型列表）
+    """
+    if await model_service.validate_model(model):
+        return
+    # 取得可用模型列表以顯示在錯誤訊息中
+    try:
+        available_models = await model_service.get_available_models()
+        model_ids = [m["id"] for m in available_models]
+    except Exception:
+        model_ids = [settings.GEMINI_MODEL]
+
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"無效的模型: {model}。可用模型: {model_ids}"
+    )
+
+
+def ensure_generation_params(model: str, controls: GenerationControls) -> None:
+    """
+    依模型的上限驗證生成參數（auto 模式以選中的模型驗證）
+
+    Raises:
+        HTTPException: 參數超過模型的上限時返回 400
+    """
+    try:
+        generation_params(model, controls)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+async def select_auto_model(
+    message: str,
+    quality_tier: Optional[str],
+    session_id: str,
+    settings: Settings,
+    openai_service: OpenAIService,
+    model_service: ModelService
+) -> ModelSelection:
+    """
+    為 auto 模式選擇模型
+
+    候選模型為 AUTO_MODEL_CANDIDATES 與模型目錄的交集（目錄無法取得時使用內建白名單）
+
+    Args:
+        message: 要回覆的使用者訊息（用於估計 prompt 長度）
+        quality_tier: 要求的最低品質等級，None 表示使用 AUTO_MODEL_MIN_TIER
+
+    Returns:
+        ModelSelection: 選擇結果
+
+    Raises:
+        HTTPException: 沒有模型容得下此對話長度時返回 400
+    """
+    candidates = set(settings.auto_model_candidates)
+    try:
+        catalog = await model_service.get_available_models()
+    except Exception:
+        catalog = []
+    models = [m for m in catalog if m["id"] in candidates]
+    if not models:
+        models = [AVAILABLE_MODELS[m] for m in candidates if m in AVAILABLE_MODELS]
+
+    prompt_chars = await openai_service.store.run(openai_service.estimate_prompt_chars, session_id, message)
+    try:
+        return openai_service.model_selector.choose(
+            models, prompt_chars, quality_tier or settings.AUTO_MODEL_MIN_TIER
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+async def resolve_model(
+    request: Union[ChatMessageRequest, RegenerateRequest],
+    message: str,
+    session_id: str,
+    settings: Settings,
+    openai_service: OpenAIService,
+    model_service: ModelService
+) -> tuple[str, Optional[ModelSelection]]:
+    """
+    決定請求使用的模型（/send 與 /regenerate 共用）
+
+    未指定模型時依 AUTO_MODEL_DEFAULT 使用 auto 或 GEMINI_MODEL；auto 模式依延遲統計選擇，
+    明確指定的模型則依模型目錄驗證，最後依選中的模型驗證生成參數
+
+    Args:
+        request: 含 model、quality_tier 與生成參數的請求
+        message: 要回覆的使用者訊息（auto 模式用於估計 prompt 長度）
+        session_id: 對話 session ID
+
+    Returns:
+        tuple[str, Optional[ModelSelection]]: (使用的模型, auto 模式的選擇結果；非 auto 時為 None)
+
+    Raises:
+        HTTPException: 模型無效、沒有模型容得下此對話長度或生成參數超過模型上限時返回 400
+    """
+    model_to_use = request.model or (AUTO_MODEL_ID if settings.AUTO_MODEL_DEFAULT else settings.GEMINI_MODEL)
+    selection = None
+    if model_to_use == AUTO_MODEL_ID:
+        # auto 模式：依各模型延遲統計、對話長度與品質等級選擇
+        selection = await select_auto_model(
+            message, request.quality_tier, session_id, settings, openai_service, model_service
+        )
+        model_to_use = selection.model
+    print(f"[DEBUG] model_to_use: {model_to_use} (GEMINI_MODEL from .env: {settings.GEMINI_MODEL})")
+    if request.model and selection is None:
+        # 使用動態驗證（來自 Google API 的模型列表）
+        await ensure_valid_model(request.model, settings, model_service)
+    ensure_generation_params(model_to_use, request)
+    return model_to_use, selection
+
 
 @router.post(
     "/send",
@@ -136,7 +418,7 @@ async def generate_sse_stream(user_message: str, model: str) -> AsyncGenerator[s
             }
         },
         400: {
-            "description": "請求錯誤：訊息為空或模型無效",
+            "description": "請求錯誤：訊息為空、模型無效或生成參數超過模型上限",
             "content": {
                 "application/json": {
                     "example": {"detail": "訊息內容不能為空白"}
@@ -144,10 +426,23 @@ async def generate_sse_stream(user_message: str, model: str) -> AsyncGenerator[s
             }
         },
         422: {"description": "請求驗證失敗（Validation Error）"},
+        429: {"description": "超過速率限制"},
         500: {"description": "伺服器內部錯誤或 API 呼叫失敗"}
-    }
+    },
+    dependencies=[Depends(enforce_rate_limit)]
 )
-async def send_message(request: ChatMessageRequest) -> StreamingResponse:
+async def send_message(
+    request: ChatMessageRequest,
+    request_timeout: Optional[float] = Header(
+        None,
+        alias="X-Request-Timeout",
+        gt=0,
+        description="客戶端要求的串流總時間（秒），不能超過伺服器上限"
+    ),
+    settings: Settings = Depends(get_settings),
+    openai_service: OpenAIService = Depends(get_openai_service),
+    model_service: ModelService = Depends(get_model_service)
+) -> StreamingResponse:
     """
     發送訊息到 Gemini API 並回傳 streaming 回應
 
@@ -155,6 +450,7 @@ async def send_message(request: ChatMessageRequest) -> StreamingResponse:
 
     Args:
         request: 包含使用者訊息與可選模型的請求
+        request_timeout: X-Request-Timeout 標頭（秒）
 
     Returns:
         StreamingResponse: SSE 格式的串流回應
@@ -173,25 +469,303 @@ async def send_message(request: ChatMessageRequest) -> StreamingResponse:
         )
 
     # 驗證模型（如果提供的話）
-    model_to_use = request.model or settings.GEMINI_MODEL
-    print(f"[DEBUG] model_to_use: {model_to_use} (GEMINI_MODEL from .env: {settings.GEMINI_MODEL})")
-    if request.model:
-        # 使用動態驗證（來自 Google API 的模型列表）
-        if not await model_service.validate_model(request.model):
-            # 取得可用模型列表以顯示在錯誤訊息中
-            try:
-                available_models = await model_service.get_available_models()
-                model_ids = [m["id"] for m in available_models]
-            except Exception:
-                model_ids = [settings.GEMINI_MODEL]
-
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"無效的模型: {request.model}。可用模型: {model_ids}"
+    session_id = request.session_id or DEFAULT_SESSION_ID
+    model_to_use, selection = await resolve_model(
+        request, request.message.strip(), session_id, settings, openai_service, model_service
+    )
+
+    if request.render_markdown and not markdown_available():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="伺服器未安裝 markdown-it-py，無法啟用 Markdown 渲染"
+        )
+
+    return StreamingResponse(
+        generate_sse_stream(
+            openai_service,
+            request.message.strip(),
+            model_to_use,
+            session_id=session_id,
+            deadline=StreamDeadline.from_settings(settings, request_timeout),
+            renderer=IncrementalMarkdownRenderer() if request.render_markdown else None,
+            selection=selection,
+            pipeline=build_output_pipeline(),
+            generation=request
+        ),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"  # 停用 nginx 緩衝（若使用 nginx）
+        }
+    )
+
+
+@router.post(
+    "/regenerate",
+    response_class=StreamingResponse,
+    summary="重新產生回應",
+    description="為目前分支最後一則使用者訊息重新產生回應（Server-Sent Events），原回應保留為另一個分支",
+    responses={
+        200: {"description": "成功，返回 Server-Sent Events 串流（格式同 /send）"},
+        400: {"description": "目前分支沒有使用者訊息、模型無效或生成參數超過模型上限"},
+        422: {"description": "請求驗證失敗（Validation Error）"},
+        429: {"description": "超過速率限制"}
+    },
+    dependencies=[Depends(enforce_rate_limit)]
+)
+async def regenerate_message(
+    request: RegenerateRequest,
+    request_timeout: Optional[float] = Header(
+        None,
+        alias="X-Request-Timeout",
+        gt=0,
+        description="客戶端要求的串流總時間（秒），不能超過伺服器上限"
+    ),
+    settings: Settings = Depends(get_settings),
+    openai_service: OpenAIService = Depends(get_openai_service),
+    model_service: ModelService = Depends(get_model_service)
+) -> StreamingResponse:
+    """
+    重新產生回應
+
+    新回應與原回應為同一則使用者訊息的兩個分支，可透過 /switch 切換
+
+    Args:
+        request: 包含可選模型（auto 依延遲統計選擇）、session 與生成參數的請求
+        request_timeout: X-Request-Timeout 標頭（秒）
+
+    Returns:
+        StreamingResponse: SSE 格式的串流回應
+
+    Raises:
+        HTTPException: 目前分支沒有使用者訊息、模型無效或生成參數超過模型上限時返回 400
+    """
+    session_id = request.session_id or DEFAULT_SESSION_ID
+    try:
+        target = await openai_service.store.run(openai_service.regenerate_target, session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    model_to_use, selection = await resolve_model(
+        request, target.content, session_id, settings, openai_service, model_service
+    )
+
+    if request.render_markdown and not markdown_available():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="伺服器未安裝 markdown-it-py，無法啟用 Markdown 渲染"
+        )
+
+    return StreamingResponse(
+        generate_sse_stream(
+            openai_service,
+            None,
+            model_to_use,
+            session_id=session_id,
+            deadline=StreamDeadline.from_settings(settings, request_timeout),
+            renderer=IncrementalMarkdownRenderer() if request.render_markdown else None,
+            selection=selection,
+            pipeline=build_output_pipeline(),
+            generation=request
+        ),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"  # 停用 nginx 緩衝（若使用 nginx）
+        }
+    )
+
+
+async def generate_compare_stream(
+    openai_service: OpenAIService,
+    messages: list[dict[str, str]],
+    models: list[str],
+    deadline_factory: Callable[[], StreamDeadline] = StreamDeadline,
+    pipeline_factory: Callable[[], Optional[ChunkPipeline]] = lambda: None,
+    generation: Optional[GenerationControls] = None
+) -> AsyncGenerator[str, None]:
+    """
+    將同一個 prompt 同時送往多個模型，並把各模型的片段多工到同一個 SSE 串流
+
+    每個模型由獨立的 task 讀取上游串流並放入共用佇列，事件依到達順序送出（以 model 欄位區分）；
+    單一模型失敗只送出該模型的 error 事件，其他模型繼續；客戶端中斷時取消所有上游請求
+
+    Args:
+        openai_service: 負責呼叫模型的服務
+        messages: 送往所有模型的訊息（OpenAI 格式）
+        models: 比較的模型 ID
+        deadline_factory: 為每個模型建立串流期限的函式
+        pipeline_factory: 為每個模型建立輸出過濾管線的函式（回傳 None 表示不過濾）
+        generation: 套用於每個模型的生成參數（None 表示使用各模型的預設值）
+
+    Yields:
+        str: SSE 格式的事件資料（start → chunk / error … → done）
+    """
+    queue: asyncio.Queue[tuple[str, Optional[str], Optional[Exception]]] = asyncio.Queue()
+    stats = {model: CompletionStats(include_usage=True) for model in models}
+    errors: dict[str, str] = {}
+    started = time.monotonic()
+
+    async def pump(model: str) -> None:
+        # content 為 None 表示該模型結束（error 為 None 表示成功）
+        pipeline = pipeline_factory()
+        try:
+            async for content in openai_service.stream_completion(
+                messages, model, deadline_factory(), stats[model], generation=generation
+            ):
+                if pipeline is not None:
+                    content = pipeline.feed(content)
+                if content:
+                    queue.put_nowait((model, content, None))
+            if pipeline is not None and (tail := pipeline.flush()):
+                queue.put_nowait((model, tail, None))
+            queue.put_nowait((model, None, None))
+        except Exception as e:
+            queue.put_nowait((model, None, e))
+
+    drain = get_drain_controller()
+    stream_task = drain.enter_stream()
+    tasks = [asyncio.create_task(pump(model)) for model in models]
+    try:
+        yield f"event: start\ndata: {CompareStartEvent(models=models).model_dump_json()}\n\n"
+
+        remaining = len(models)
+        while remaining:
+            model, content, error = await queue.get()
+            if content is not None:
+                chunk_event = CompareChunkEvent(model=model, content=content)
+                yield f"event: chunk\ndata: {chunk_event.model_dump_json()}\n\n"
+                continue
+
+            remaining -= 1
+            if error is None:
+                continue
+            if isinstance(error, DeadlineExceeded):
+                error_event = CompareErrorEvent(
+                    model=model, error=str(error), code="deadline_exceeded",
+                    deadline=error.deadline, timeout=error.timeout
+                )
+            elif openai_service.is_quota_error(error):
+                error_event = CompareErrorEvent(model=model, error=QUOTA_EXCEEDED_MESSAGE, code="quota_exceeded")
+            else:
+                error_event = CompareErrorEvent(model=model, error=str(error))
+            errors[model] = error_event.error
+            yield f"event: error\ndata: {error_event.model_dump_json(exclude_none=True)}\n\n"
+
+        results = [
+            CompareModelResult(
+                model=model,
+                status="error" if model in errors else "ok",
+                ttft_ms=round(stats[model].ttft * 1000, 1) if stats[model].ttft is not None else None,
+                duration_ms=round(stats[model].duration * 1000, 1) if stats[model].duration is not None else None,
+                chunks=stats[model].chunks,
+                chars=stats[model].chars,
+                prompt_tokens=stats[model].prompt_tokens,
+                completion_tokens=stats[model].completion_tokens,
+                error=errors.get(model)
             )
+            for model in models
+        ]
+        done_event = CompareDoneEvent(results=results, wall_time_ms=round((time.monotonic() - started) * 1000, 1))
+        yield f"event: done\ndata: {done_event.model_dump_json(exclude_none=True)}\n\n"
+
+    except asyncio.CancelledError:
+        # 排空逾時而被中止：告知客戶端後正常結束串流
+        if not drain.expired:
+            raise
+        yield f"event: error\ndata: {SHUTTING_DOWN_EVENT.model_dump_json(exclude_none=True)}\n\n"
+
+    finally:
+        drain.exit_stream(stream_task)
+        # 正常結束時 task 皆已完成；客戶端中斷時取消仍在串流的模型（上游連線關閉並歸還 key）
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@router.post(
+    "/compare",
+    response_class=StreamingResponse,
+    summary="多模型比較",
+    description="將同一則訊息同時送往多個模型，並以單一 SSE 串流回傳（片段以 model 欄位區分）",
+    responses={
+        200: {
+            "description": "成功，返回多工的 Server-Sent Events 串流",
+            "content": {
+                "text/event-stream": {
+                    "example": "event: start\ndata: {\"models\": [\"gemini-2.0-flash\", \"gemini-1.5-pro\"]}\n\nevent: chunk\ndata: {\"model\": \"gemini-2.0-flash\", \"content\": \"你好\"}\n\nevent: done\ndata: {\"results\": [...], \"wall_time_ms\": 1830.5}\n\n"
+                }
+            }
+        },
+        400: {"description": "請求錯誤：訊息為空、模型重複、數量超過上限或模型無效"},
+        422: {"description": "請求驗證失敗（Validation Error）"},
+        429: {"description": "超過速率限制"}
+    },
+    dependencies=[Depends(enforce_rate_limit)]
+)
+async def compare_models(
+    request: CompareRequest,
+    request_timeout: Optional[float] = Header(
+        None,
+        alias="X-Request-Timeout",
+        gt=0,
+        description="每個模型的串流總時間（秒），不能超過伺服器上限"
+    ),
+    settings: Settings = Depends(get_settings),
+    openai_service: OpenAIService = Depends(get_openai_service),
+    model_service: ModelService = Depends(get_model_service)
+) -> StreamingResponse:
+    """
+    同時以多個模型回應同一則訊息
+
+    比較結果不寫入對話歷史；整體耗時取決於最慢的模型，而不是各模型時間的總和
+
+    Args:
+        request: 訊息、比較的模型、可選的上下文 session 與生成參數
+        request_timeout: X-Request-Timeout 標頭（秒，套用於每個模型）
+
+    Returns:
+        StreamingResponse: SSE 格式的串流回應，最後的 done 事件包含各模型的 TTFT、耗時與 token 數
+
+    Raises:
+        HTTPException: 當請求驗證失敗或生成參數超過任一模型的上限時返回 400
+    """
+    message = request.message.strip()
+    if not message:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="訊息內容不能為空白"
+        )
+    if len(set(request.models)) != len(request.models):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="比較的模型不可重複"
+        )
+    if len(request.models) > settings.COMPARE_MAX_MODELS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"一次最多比較 {settings.COMPARE_MAX_MODELS} 個模型"
+        )
+    invalid = [model for model in request.models if not await model_service.validate_model(model)]
+    if invalid:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"無效的模型: {', '.join(invalid)}"
+        )
+    for model in request.models:
+        ensure_generation_params(model, request)
 
     return StreamingResponse(
-        generate_sse_stream(request.message.strip(), model_to_use),
+        generate_compare_stream(
+            openai_service,
+            await openai_service.store.run(openai_service.preview_prompt, message, request.session_id),
+            request.models,
+            deadline_factory=lambda: StreamDeadline.from_settings(settings, request_timeout),
+            pipeline_factory=build_output_pipeline,
+            generation=request
+        ),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -205,41 +779,232 @@ async def send_message(request: ChatMessageRequest) -> StreamingResponse:
     "/history",
     response_model=ChatHistoryResponse,
     summary="取得對話歷史",
-    description="取得目前對話歷史（記憶體版本）",
+    description="取得指定 session 的對話歷史",
     responses={
         200: {"description": "成功取得對話歷史"},
         500: {"description": "伺服器內部錯誤"}
     }
 )
-async def get_chat_history() -> ChatHistoryResponse:
+async def get_chat_history(
+    session_id: str = SESSION_ID_QUERY,
+    render_markdown: bool = Query(False, description="是否附上 AI 回應的渲染 HTML"),
+    settings: Settings = Depends(get_settings),
+    openai_service: OpenAIService = Depends(get_openai_service)
+) -> Response:
     """
     取得對話歷史
 
+    Args:
+        session_id: 對話 session ID
+        render_markdown: 是否附上 AI 回應的渲染 HTML（優先使用串流時已快取的結果）
+
+    Returns:
+        Response: ChatHistoryResponse 格式的 JSON 回應
+
+    Raises:
+        HTTPException: 要求渲染但伺服器未安裝 markdown-it-py 時返回 400
+    """
+    if render_markdown and not markdown_available():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="伺服器未安裝 markdown-it-py，無法啟用 Markdown 渲染"
+        )
+
+    def build() -> bytes:
+        # 歷史記錄已是有效資料：直接建構並序列化，略過 response_model 的重複驗證
+        messages = [entry.to_message() for entry in openai_service.get_history(session_id)]
+        if render_markdown:
+            for message in messages:
+                if message.role == MessageRole.ASSISTANT:
+                    message.html = get_rendered_html(
+                        openai_service.store, message.content, ttl=settings.MARKDOWN_CACHE_TTL
+                    )
+        return ChatHistoryResponse.model_construct(messages=messages).model_dump_json(exclude_none=True)
+
+    return Response(content=await openai_service.store.run(build), media_type="application/json")
+
+
+def history_response(entries: list[HistoryEntry]) -> ChatHistoryResponse:
+    """將歷史轉換為回應（資料已有效，略過驗證）"""
+    return ChatHistoryResponse.model_construct(messages=[entry.to_message() for entry in entries])
+
+
+@router.get(
+    "/branches",
+    response_model=BranchListResponse,
+    summary="列出對話分支",
+    description="列出指定 session 的所有分支（各分支的最後一筆訊息）與目前的分支",
+    responses={
+        200: {"description": "成功取得分支列表"}
+    }
+)
+async def list_branches(
+    session_id: str = SESSION_ID_QUERY,
+    openai_service: OpenAIService = Depends(get_openai_service)
+) -> BranchListResponse:
+    """
+    列出對話分支
+
+    Args:
+        session_id: 對話 session ID
+
     Returns:
-        ChatHistoryResponse: 包含對話記錄列表的回應
+        BranchListResponse: 目前的 head 與所有分支
     """
-    messages = openai_service.get_history()
-    return ChatHistoryResponse(messages=messages)
+    head_id, leaves = await openai_service.store.run(openai_service.list_branches, session_id)
+    return BranchListResponse(
+        head_id=head_id,
+        branches=[BranchInfo(leaf=leaf.to_message(), active=leaf.id == head_id) for leaf in leaves]
+    )
+
+
+@router.post(
+    "/fork",
+    response_model=ChatHistoryResponse,
+    summary="建立分支",
+    description="在指定訊息之後建立新分支（編輯訊息時於其父訊息建立分支再送出新內容），原本的後續訊息保留在舊分支",
+    responses={
+        200: {"description": "成功建立分支，返回新分支目前的歷史"},
+        404: {"description": "訊息不存在"}
+    }
+)
+async def fork_history(
+    request: ForkRequest,
+    openai_service: OpenAIService = Depends(get_openai_service)
+) -> ChatHistoryResponse:
+    """
+    建立分支
+
+    只移動 head，不複製任何訊息；之後的 /send 會接在分支點之後
+
+    Args:
+        request: 分支點的訊息 ID 與 session
+
+    Returns:
+        ChatHistoryResponse: 新分支目前的歷史
+
+    Raises:
+        HTTPException: 訊息不存在時返回 404
+    """
+    try:
+        entries = await openai_service.store.run(
+            openai_service.fork_history, request.message_id, request.session_id or DEFAULT_SESSION_ID
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    return history_response(entries)
+
+
+@router.post(
+    "/switch",
+    response_model=ChatHistoryResponse,
+    summary="切換分支",
+    description="切換到經過指定訊息的分支（有多個分支時選擇最新的一個）",
+    responses={
+        200: {"description": "成功切換，返回切換後的歷史"},
+        404: {"description": "訊息不存在"}
+    }
+)
+async def switch_branch(
+    request: SwitchBranchRequest,
+    openai_service: OpenAIService = Depends(get_openai_service)
+) -> ChatHistoryResponse:
+    """
+    切換分支
+
+    Args:
+        request: 分支上的訊息 ID 與 session
+
+    Returns:
+        ChatHistoryResponse: 切換後的歷史
+
+    Raises:
+        HTTPException: 訊息不存在時返回 404
+    """
+    try:
+        entries = await openai_service.store.run(
+            openai_service.switch_branch, request.message_id, request.session_id or DEFAULT_SESSION_ID
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    return history_response(entries)
+
+
+def search_response(query: str, limit: int, offset: int, total: int, hits: list) -> SearchResponse:
+    """將搜尋結果組成回應（附上命中片段）"""
+    return SearchResponse(
+        query=query,
+        total=total,
+        limit=limit,
+        offset=offset,
+        results=[
+            SearchResult(
+                id=entry.id,
+                session_id=owner,
+                role=entry.role,
+                snippet=make_snippet(entry.content, query),
+                timestamp=entry.timestamp,
+                score=round(score, 4)
+            )
+            for owner, entry, score in hits
+        ]
+    )
+
+
+@router.get(
+    "/search",
+    response_model=SearchResponse,
+    summary="搜尋對話歷史",
+    description="全文檢索指定 session 的對話內容（支援中文），依相關度排序並分頁",
+    responses={
+        200: {"description": "成功取得搜尋結果"},
+        422: {"description": "請求驗證失敗（Validation Error）"}
+    }
+)
+async def search_chat_history(
+    q: str = Query(..., min_length=1, max_length=200, description="查詢字串，所有詞皆須命中"),
+    session_id: str = SESSION_ID_QUERY,
+    limit: int = Query(20, ge=1, le=100, description="每頁筆數"),
+    offset: int = Query(0, ge=0, description="略過筆數"),
+    openai_service: OpenAIService = Depends(get_openai_service)
+) -> SearchResponse:
+    """
+    搜尋對話歷史
+
+    只搜尋指定的 session（session 是 API 唯一的隔離邊界）；跨 session 搜尋請使用 /api/admin/search
+    訊息在寫入歷史時即已建立索引，查詢不需掃描全部訊息
+
+    Returns:
+        SearchResponse: 命中總數與依相關度排序的結果
+    """
+    total, hits = await openai_service.store.run(openai_service.search_history, q, session_id, limit, offset)
+    return search_response(q, limit, offset, total, hits)
 
 
 @router.delete(
     "/clear",
     response_model=ClearHistoryResponse,
     summary="清除對話歷史",
-    description="清除目前對話歷史",
+    description="清除指定 session 的對話歷史",
     responses={
         200: {"description": "成功清除對話歷史"},
         500: {"description": "伺服器內部錯誤"}
     }
 )
-async def clear_chat_history() -> ClearHistoryResponse:
+async def clear_chat_history(
+    session_id: str = SESSION_ID_QUERY,
+    openai_service: OpenAIService = Depends(get_openai_service)
+) -> ClearHistoryResponse:
     """
     清除對話歷史
 
+    Args:
+        session_id: 對話 session ID
+
     Returns:
         ClearHistoryResponse: 清除結果回應
     """
-    openai_service.clear_history()
+    await openai_service.store.run(openai_service.clear_history, session_id)
     return ClearHistoryResponse(
         success=True,
         message="對話歷史已清除"
@@ -3,7 +3,7 @@ Chat 相關的 Pydantic Schemas
 """
 from datetime import datetime
 from enum import Enum
-from typing import Optional, TypedDict
+from typing import Annotated, Literal, Optional, TypedDict
 from pydantic import BaseModel, Field
 
 
@@ -22,7 +22,35 @@ class ModelInfo(TypedDict):
     context_window: int
 
 
-class ChatMessageRequest(BaseModel):
+class GenerationControls(BaseModel):
+    """
+    生成參數（留空則使用模型的預設值）
+
+    範圍檢查以外，伺服器另依模型的上限驗證（app.core.config.get_generation_limits），超過時返回 400
+    """
+    max_tokens: Optional[int] = Field(
+        default=None,
+        ge=1,
+        description="回應的 token 數上限；只需要簡短回答時設小可縮短生成時間"
+    )
+    stop: Optional[list[Annotated[str, Field(min_length=1, max_length=100)]]] = Field(
+        default=None,
+        description="停止序列，模型產生任一序列時停止（序列本身不包含在回應中）"
+    )
+    temperature: Optional[float] = Field(
+        default=None,
+        ge=0,
+        description="取樣溫度，越低越確定"
+    )
+    top_p: Optional[float] = Field(
+        default=None,
+        gt=0,
+        le=1,
+        description="nucleus sampling 的累積機率"
+    )
+
+
+class ChatMessageRequest(GenerationControls):
     """使用者發送訊息的 Request Schema"""
     message: str = Field(
         ...,
@@ -32,7 +60,22 @@ class ChatMessageRequest(BaseModel):
     )
     model: Optional[str] = Field(
         default=None,
-        description="使用的 Gemini 模型,留空則使用預設值"
+        description="使用的 Gemini 模型,留空則使用預設值；auto 表示依延遲統計自動選擇"
+    )
+    session_id: Optional[str] = Field(
+        default=None,
+        min_length=1,
+        max_length=64,
+        pattern=r"^[A-Za-z0-9_\-]+$",
+        description="對話 session ID，留空則使用預設 session"
+    )
+    quality_tier: Optional[Literal["stable", "recommended", "advanced"]] = Field(
+        default=None,
+        description="model 為 auto 時要求的最低品質等級，留空則使用伺服器設定"
+    )
+    render_markdown: bool = Field(
+        default=False,
+        description="是否由伺服器增量渲染 Markdown（額外送出 block 事件）"
     )
 
     model_config = {
@@ -45,6 +88,12 @@ class ChatMessageRequest(BaseModel):
                 {
                     "message": "什麼是機器學習？",
                     "model": None
+                },
+                {
+                    "message": "台灣的首都是哪裡？只回答城市名稱",
+                    "max_tokens": 16,
+                    "stop": ["\n"],
+                    "temperature": 0
                 }
             ]
         }
@@ -53,14 +102,18 @@ class ChatMessageRequest(BaseModel):
 
 class ChatMessage(BaseModel):
     """單筆對話記錄"""
+    id: Optional[int] = Field(default=None, description="訊息 ID")
+    parent_id: Optional[int] = Field(default=None, description="父訊息 ID（分支點），對話的第一筆為 null")
     role: MessageRole = Field(..., description="訊息角色（user 或 assistant）")
     content: str = Field(..., description="訊息內容")
     timestamp: datetime = Field(default_factory=datetime.utcnow, description="訊息時間戳記")
+    html: Optional[str] = Field(default=None, description="渲染後的 HTML（僅在要求渲染時提供）")
 
     model_config = {
         "json_schema_extra": {
             "examples": [
                 {
+                    "id": 1,
                     "role": "user",
                     "content": "你好，請介紹一下自己",
                     "timestamp": "2024-01-01T12:00:00Z"
@@ -107,10 +160,21 @@ class StreamEvent(BaseModel):
     pass
 
 
+class ModelSelectionInfo(BaseModel):
+    """auto 模式的模型選擇說明"""
+    tier: str = Field(..., description="選中模型的品質等級")
+    reason: str = Field(..., description="選擇原因（latency：預估 TTFT 最低 / explore：探索 / prior：尚無統計）")
+    expected_ttft_ms: Optional[float] = Field(default=None, description="預估的 time-to-first-token（毫秒）")
+    prompt_chars: int = Field(..., description="本次 prompt（含歷史）的字元數")
+
+
 class StreamStartEvent(StreamEvent):
     """串流開始事件"""
     role: MessageRole = Field(default=MessageRole.ASSISTANT, description="回應角色")
     model: str = Field(..., description="使用的 Gemini 模型")
+    selection: Optional[ModelSelectionInfo] = Field(
+        default=None, description="auto 模式的選擇說明（僅 model 為 auto 時提供）"
+    )
 
 
 class StreamChunkEvent(StreamEvent):
@@ -118,7 +182,183 @@ class StreamChunkEvent(StreamEvent):
     content: str = Field(..., description="內容片段")
 
 
+class StreamBlockEvent(StreamEvent):
+    """已定稿的 Markdown 區塊 HTML 事件（render_markdown 模式）"""
+    index: int = Field(..., description="區塊序號（從 0 開始）")
+    html: str = Field(..., description="區塊的 HTML")
+
+
 class StreamDoneEvent(StreamEvent):
     """串流完成事件"""
     role: MessageRole = Field(default=MessageRole.ASSISTANT, description="回應角色")
     complete_content: str = Field(..., description="完整回應內容")
+
+
+class StreamErrorEvent(StreamEvent):
+    """串流錯誤事件"""
+    error: str = Field(..., description="錯誤訊息")
+    code: Optional[str] = Field(default=None, description="錯誤類型（例如 deadline_exceeded）")
+    deadline: Optional[str] = Field(
+        default=None, description="到期的期限種類（first_token / idle / total）"
+    )
+    timeout: Optional[float] = Field(default=None, description="到期期限的秒數")
+
+
+class CompareRequest(GenerationControls):
+    """多模型比較的 Request Schema（生成參數套用於每個模型，並依各模型的上限驗證）"""
+    message: str = Field(
+        ...,
+        min_length=1,
+        max_length=10000,
+        description="送往所有模型的訊息內容"
+    )
+    models: list[str] = Field(
+        ...,
+        min_length=2,
+        description="要比較的 Gemini 模型（不可重複，數量上限為 COMPARE_MAX_MODELS）"
+    )
+    session_id: Optional[str] = Field(
+        default=None,
+        min_length=1,
+        max_length=64,
+        pattern=r"^[A-Za-z0-9_\-]+$",
+        description="作為上下文的對話 session（僅讀取，比較結果不寫入歷史），留空則不帶歷史"
+    )
+
+    model_config = {
+        "json_schema_extra": {
+            "examples": [
+                {
+                    "message": "用三句話解釋什麼是 CRDT",
+                    "models": ["gemini-2.0-flash", "gemini-1.5-pro"]
+                }
+            ]
+        }
+    }
+
+
+class CompareStartEvent(StreamEvent):
+    """多模型比較開始事件"""
+    models: list[str] = Field(..., description="比較的模型")
+
+
+class CompareChunkEvent(StreamEvent):
+    """多模型比較的內容片段事件"""
+    model: str = Field(..., description="片段所屬的模型")
+    content: str = Field(..., description="內容片段")
+
+
+class CompareErrorEvent(StreamErrorEvent):
+    """單一模型失敗事件（其他模型繼續串流）"""
+    model: str = Field(..., description="失敗的模型")
+
+
+class CompareModelResult(BaseModel):
+    """單一模型的比較結果"""
+    model: str = Field(..., description="模型 ID")
+    status: Literal["ok", "error"] = Field(..., description="是否成功完成")
+    ttft_ms: Optional[float] = Field(default=None, description="time-to-first-token（毫秒）")
+    duration_ms: Optional[float] = Field(default=None, description="從送出請求到串流結束的時間（毫秒）")
+    chunks: int = Field(default=0, description="內容片段數")
+    chars: int = Field(default=0, description="回應字元數")
+    prompt_tokens: Optional[int] = Field(default=None, description="上游回報的輸入 token 數")
+    completion_tokens: Optional[int] = Field(default=None, description="上游回報的輸出 token 數")
+    error: Optional[str] = Field(default=None, description="錯誤訊息（失敗時）")
+
+
+class CompareDoneEvent(StreamEvent):
+    """多模型比較完成事件"""
+    results: list[CompareModelResult] = Field(..., description="各模型結果（依請求順序）")
+    wall_time_ms: float = Field(..., description="整體耗時（毫秒，約等於最慢模型的時間）")
+
+
+class SearchResult(BaseModel):
+    """單筆搜尋結果"""
+    id: int = Field(..., description="訊息 ID")
+    session_id: str = Field(..., description="訊息所屬的對話 session")
+    role: MessageRole = Field(..., description="訊息角色")
+    snippet: str = Field(..., description="命中內容片段")
+    timestamp: datetime = Field(..., description="訊息時間戳記")
+    score: float = Field(..., description="相關度分數（越高越相關）")
+
+
+class SearchResponse(BaseModel):
+    """對話搜尋回應 Schema"""
+    query: str = Field(..., description="查詢字串")
+    total: int = Field(..., description="命中總數")
+    limit: int = Field(..., description="每頁筆數")
+    offset: int = Field(..., description="略過筆數")
+    results: list[SearchResult] = Field(default_factory=list, description="依相關度排序的結果")
+
+
+class RegenerateRequest(GenerationControls):
+    """重新產生回應的 Request Schema"""
+    model: Optional[str] = Field(
+        default=None,
+        description="使用的 Gemini 模型，留空則使用預設值；auto 表示依延遲統計自動選擇"
+    )
+    session_id: Optional[str] = Field(
+        default=None,
+        min_length=1,
+        max_length=64,
+        pattern=r"^[A-Za-z0-9_\-]+$",
+        description="對話 session ID，留空則使用預設 session"
+    )
+    quality_tier: Optional[Literal["stable", "recommended", "advanced"]] = Field(
+        default=None,
+        description="model 為 auto 時要求的最低品質等級，留空則使用伺服器設定"
+    )
+    render_markdown: bool = Field(
+        default=False,
+        description="是否由伺服器增量渲染 Markdown（額外送出 block 事件）"
+    )
+
+
+class ForkRequest(BaseModel):
+    """建立分支的 Request Schema"""
+    message_id: Optional[int] = Field(
+        ...,
+        description="分支點的訊息 ID（之後送出的訊息接在此訊息之後），null 表示從第一則訊息之前開始"
+    )
+    session_id: Optional[str] = Field(
+        default=None,
+        min_length=1,
+        max_length=64,
+        pattern=r"^[A-Za-z0-9_\-]+$",
+        description="對話 session ID，留空則使用預設 session"
+    )
+
+    model_config = {
+        "json_schema_extra": {
+            "examples": [
+                {"message_id": 3}
+            ]
+        }
+    }
+
+
+class SwitchBranchRequest(BaseModel):
+    """切換分支的 Request Schema"""
+    message_id: int = Field(
+        ...,
+        description="分支上的任一訊息 ID（通常為分支列表中的最後一筆），有多個分支經過時選擇最新的一個"
+    )
+    session_id: Optional[str] = Field(
+        default=None,
+        min_length=1,
+        max_length=64,
+        pattern=r"^[A-Za-z0-9_\-]+$",
+        description="對話 session ID，留空則使用預設 session"
+    )
+
+
+class BranchInfo(BaseModel):
+    """單一分支"""
+    leaf: ChatMessage = Field(..., description="分支的最後一筆訊息")
+    active: bool = Field(..., description="是否為目前的分支")
+
+
+class BranchListResponse(BaseModel):
+    """分支列表回應 Schema"""
+    head_id: Optional[int] = Field(default=None, description="目前分支最後一筆訊息的 ID")
+    branches: list[BranchInfo] = Field(default_factory=list, description="所有分支（依建立順序）")
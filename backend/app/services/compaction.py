@@ -0,0 +1,197 @@
+"""
+對話摘要壓縮模組
+
+長對話的每次請求都會重送完整歷史；開啟壓縮後，當 session 未壓縮部分超過門檻，
+於請求路徑之外以低成本模型將較舊的對話濃縮成摘要，並與歷史一起存放在共享狀態儲存。
+之後組裝 prompt 時只送「摘要 + 最近幾輪」，prompt 大小因此有上限
+摘要涵蓋的是某個分支的前綴，只有在目前分支包含該前綴時才會使用
+"""
+import asyncio
+from typing import TYPE_CHECKING, Callable, Optional
+
+from app.core.config import get_settings
+from app.services.history import HistoryEntry
+from app.services.state_store import StateStore
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+
+# 產生摘要時使用的系統指示
+SUMMARY_INSTRUCTION = (
+    "請將以下對話濃縮成一段摘要，供後續對話作為背景。"
+    "保留關鍵事實、使用者的偏好與需求、已做出的結論以及尚未完成的事項；"
+    "使用與對話相同的語言，不要加入對話中沒有的資訊。"
+)
+
+# 送給主模型的摘要前綴
+SUMMARY_PREFIX = "以下是先前對話的摘要：\n"
+
+
+def _summary_key(session_id: str) -> str:
+    """摘要在共享狀態儲存中的快取鍵"""
+    return f"summary:{session_id}"
+
+
+class HistoryCompactor:
+    """
+    對話摘要壓縮器
+
+    摘要格式：{"summary": str, "until_id": int}，until_id 為已被摘要涵蓋的最後一筆訊息 ID
+    （摘要涵蓋由第一筆到 until_id 的路徑）
+    """
+
+    def __init__(self, store: StateStore, client_factory: Callable[[], "AsyncOpenAI"]):
+        """
+        Args:
+            store: 共享狀態儲存（歷史與摘要）
+            client_factory: 取得 AsyncOpenAI 客戶端的函式（延遲建立）
+        """
+        settings = get_settings()
+        self.store = store
+        self.client_factory = client_factory
+        self.enabled = settings.HISTORY_COMPACTION_ENABLED
+        self.threshold_chars = settings.HISTORY_COMPACTION_THRESHOLD_CHARS
+        self.keep_recent = max(settings.HISTORY_COMPACTION_KEEP_RECENT, 1)
+        self.model = settings.HISTORY_COMPACTION_MODEL
+        # 進行中的背景壓縮（同一 session 同時只跑一個）
+        self._in_progress: set[str] = set()
+        self._tasks: set[asyncio.Task] = set()
+
+    def get_summary(self, session_id: str) -> Optional[dict]:
+        """取得 session 目前的摘要（未啟用時回傳 None）"""
+        if not self.enabled:
+            return None
+        return self.store.cache_get(_summary_key(session_id))
+
+    def _summary_on_path(self, session_id: str, entries: list[HistoryEntry]) -> Optional[dict]:
+        """取得涵蓋目前分支前綴的摘要（摘要屬於其他分支時回傳 None）"""
+        summary = self.get_summary(session_id)
+        if summary is None:
+            return None
+        until_id = summary["until_id"]
+        return summary if any(entry.id == until_id for entry in entries) else None
+
+    def build_prompt(self, session_id: str, entries: list[HistoryEntry]) -> list[dict[str, str]]:
+        """
+        組裝送往模型的訊息：有摘要時以系統訊息帶入摘要，並只附上摘要之後的訊息
+
+        Args:
+            session_id: 對話 session ID
+            entries: 目前分支的歷史
+
+        Returns:
+            list[dict[str, str]]: OpenAI Chat Completions 訊息格式
+        """
+        summary = self._summary_on_path(session_id, entries)
+        if summary is None:
+            return [entry.to_openai() for entry in entries]
+
+        until_id = summary["until_id"]
+        messages = [{"role": "system", "content": SUMMARY_PREFIX + summary["summary"]}]
+        messages.extend(entry.to_openai() for entry in entries if entry.id > until_id)
+        return messages
+
+    def maybe_schedule(self, session_id: str) -> None:
+        """
+        排程背景壓縮（不阻塞目前請求）
+
+        是否超過門檻在背景工作中經由 store.run() 判斷，呼叫端（串流結束時的 event loop）不讀取儲存
+
+        Args:
+            session_id: 對話 session ID
+        """
+        if not self.enabled or session_id in self._in_progress:
+            return
+
+        self._in_progress.add(session_id)
+        task = asyncio.create_task(self._compact(session_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def forget(self, session_id: str) -> None:
+        """刪除 session 的摘要（清除歷史時呼叫）"""
+        self.store.cache_delete(_summary_key(session_id))
+
+    async def wait_for_pending(self, timeout: float) -> None:
+        """
+        等待進行中的背景壓縮完成（關閉時呼叫）
+
+        Args:
+            timeout: 最長等待秒數，逾時後取消剩餘工作
+        """
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+
+    def _uncompacted(self, session_id: str, entries: list[HistoryEntry]) -> list[HistoryEntry]:
+        """取得尚未被摘要涵蓋的訊息"""
+        summary = self._summary_on_path(session_id, entries)
+        if summary is None:
+            return entries
+        return [entry for entry in entries if entry.id > summary["until_id"]]
+
+    def _save_summary(self, session_id: str, summary_text: str, until_id: int) -> bool:
+        """
+        寫入新摘要（其他 worker 可能已寫入涵蓋範圍更新的摘要，只在範圍前進時覆寫；屬於其他分支的摘要直接取代）
+
+        Returns:
+            bool: 是否寫入
+        """
+        current = self.store.cache_get(_summary_key(session_id))
+        path_ids = {entry.id for entry in self.store.get_messages(session_id)}
+        if current is not None and current["until_id"] in path_ids and current["until_id"] >= until_id:
+            return False
+        self.store.cache_set(_summary_key(session_id), {"summary": summary_text, "until_id": until_id})
+        return True
+
+    def _compaction_input(self, session_id: str) -> tuple[list[HistoryEntry], Optional[dict]]:
+        """
+        讀取需要壓縮的訊息（同步讀取儲存，經由 store.run() 呼叫）
+
+        Returns:
+            tuple[list[HistoryEntry], Optional[dict]]: (要濃縮的較舊訊息, 先前的摘要)；
+            未壓縮部分未超過門檻時訊息為空列表
+        """
+        entries = self.store.get_messages(session_id)
+        pending = self._uncompacted(session_id, entries)
+        if len(pending) <= self.keep_recent or sum(len(entry.content) for entry in pending) < self.threshold_chars:
+            return [], None
+        return pending[:-self.keep_recent], self._summary_on_path(session_id, entries)
+
+    async def _compact(self, session_id: str) -> None:
+        """超過門檻時產生新摘要：先前摘要 + 較舊的未壓縮訊息 → 新摘要"""
+        try:
+            older, previous = await self.store.run(self._compaction_input, session_id)
+            if not older:
+                return
+
+            transcript = "\n\n".join(f"{entry.role.value}: {entry.content}" for entry in older)
+            if previous is not None:
+                transcript = f"[先前摘要]\n{previous['summary']}\n\n[後續對話]\n{transcript}"
+
+            response = await self.client_factory().chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": SUMMARY_INSTRUCTION},
+                    {"role": "user", "content": transcript}
+                ],
+                temperature=0.2,
+                max_tokens=1024
+            )
+            summary_text = (response.choices[0].message.content or "").strip()
+            if not summary_text:
+                return
+
+            until_id = older[-1].id
+            if not await self.store.run(self._save_summary, session_id, summary_text, until_id):
+                return
+            print(f"[DEBUG] compacted session {session_id}: {len(older)} messages → {len(summary_text)} chars")
+
+        except Exception as e:
+            # 壓縮失敗不影響對話，下次回應完成時會再嘗試
+            print(f"[Compaction Error] session {session_id}: {type(e).__name__}: {e}")
+        finally:
+            self._in_progress.discard(session_id)
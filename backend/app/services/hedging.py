@@ -0,0 +1,118 @@
+"""
+對沖請求（Hedged Requests）
+
+請求送出後若超過該模型近期 TTFT 的高百分位數（例如 p95）仍未收到首個片段，
+再送出一個相同的請求，先產生首個片段者勝出、另一個取消，以降低 TTFT 的長尾
+額外請求受預算限制：每個請求累積 budget_ratio 的額度，送出一次對沖消耗 1，
+因此對沖請求數最多約為總請求數的 budget_ratio（保護 API 額度）
+統計與預算為每個 worker 各自維護
+"""
+import threading
+from functools import lru_cache
+from typing import Optional
+
+from app.core.config import get_settings
+from app.core.metrics import metrics
+from app.services.model_selector import LatencyProfile
+
+
+HEDGE_ELIGIBLE = metrics.counter(
+    "chat_hedge_eligible_requests_total", "啟用對沖時的上游請求數（對沖率的分母）", ("model",)
+)
+HEDGE_SENT = metrics.counter("chat_hedge_requests_total", "送出的對沖請求數", ("model",))
+HEDGE_WINS = metrics.counter("chat_hedge_wins_total", "對沖請求先產生首個片段的次數", ("model",))
+HEDGE_BUDGET_EXHAUSTED = metrics.counter(
+    "chat_hedge_budget_exhausted_total", "超過門檻但因預算不足而未對沖的次數", ("model",)
+)
+
+
+class HedgePolicy:
+    """決定何時送出對沖請求，並以預算限制額外請求的比例"""
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        quantile: float = 0.95,
+        budget_ratio: float = 0.05,
+        min_samples: int = 20,
+        min_delay: float = 0.25,
+        max_credit: float = 10.0
+    ):
+        """
+        Args:
+            enabled: 是否啟用對沖
+            quantile: 以近期 TTFT 的哪個分位作為對沖門檻（0~1）
+            budget_ratio: 對沖請求相對於總請求數的上限比例
+            min_samples: 模型至少要有多少 TTFT 樣本才會對沖（樣本不足時門檻不可靠）
+            min_delay: 門檻下限（秒），避免對極快的模型過早對沖
+            max_credit: 預算累積上限（限制閒置後一次湧出的對沖數）
+        """
+        self.enabled = enabled
+        self.quantile = quantile
+        self.budget_ratio = budget_ratio
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_credit = max_credit
+        self._credit = 0.0
+        self._lock = threading.Lock()
+
+    def delay_for(self, model: str, profile: LatencyProfile) -> Optional[float]:
+        """
+        取得本次請求的對沖門檻，並累積預算（每個上游請求呼叫一次）
+
+        Args:
+            model: 模型 ID
+            profile: 模型的延遲統計
+
+        Returns:
+            Optional[float]: 超過此秒數仍未收到首個片段時對沖，None 表示本次不對沖
+        """
+        if not self.enabled:
+            return None
+        HEDGE_ELIGIBLE.inc(model=model)
+        with self._lock:
+            self._credit = min(self._credit + self.budget_ratio, self.max_credit)
+        if profile.samples < self.min_samples:
+            return None
+        threshold = profile.quantile(self.quantile)
+        return max(threshold, self.min_delay) if threshold is not None else None
+
+    def try_hedge(self, model: str) -> bool:
+        """
+        嘗試使用一次對沖預算
+
+        Args:
+            model: 模型 ID
+
+        Returns:
+            bool: 是否可以送出對沖請求
+        """
+        with self._lock:
+            if self._credit >= 1.0:
+                self._credit -= 1.0
+                HEDGE_SENT.inc(model=model)
+                return True
+        HEDGE_BUDGET_EXHAUSTED.inc(model=model)
+        return False
+
+    def record_win(self, model: str) -> None:
+        """記錄對沖請求勝出"""
+        HEDGE_WINS.inc(model=model)
+
+
+@lru_cache
+def get_hedge_policy() -> HedgePolicy:
+    """
+    取得依設定建立的全域對沖策略（每個 worker 一份）
+
+    Returns:
+        HedgePolicy: 全域單例實例
+    """
+    settings = get_settings()
+    return HedgePolicy(
+        enabled=settings.HEDGE_ENABLED,
+        quantile=settings.HEDGE_QUANTILE,
+        budget_ratio=settings.HEDGE_BUDGET_RATIO,
+        min_samples=settings.HEDGE_MIN_SAMPLES,
+        min_delay=settings.HEDGE_MIN_DELAY
+    )
@@ -0,0 +1,110 @@
+"""
+對話歷史的精簡記憶體表示
+
+HistoryEntry 以 __slots__ 儲存（角色為 enum 單例、時間為 float），
+內容字串經由 ContentPool 去重；Pydantic ChatMessage 只在 API 邊界才建立
+對話以樹狀結構儲存：每筆訊息記錄父訊息 ID，分支共用相同的前綴，不複製訊息
+"""
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from app.schemas.chat import ChatMessage, MessageRole
+
+
+class HistoryEntry:
+    """單筆對話記錄（精簡表示）"""
+
+    __slots__ = ("role", "content", "created_at", "id", "parent_id")
+
+    def __init__(
+        self,
+        role: MessageRole,
+        content: str,
+        created_at: Optional[float] = None,
+        id: Optional[int] = None,
+        parent_id: Optional[int] = None
+    ):
+        """
+        Args:
+            role: 訊息角色
+            content: 訊息內容
+            created_at: 建立時間（UNIX 秒數），預設為現在
+            id: 訊息 ID（寫入狀態儲存時指派）
+            parent_id: 父訊息 ID（寫入狀態儲存時指派，None 表示對話的第一筆）
+        """
+        self.role = role
+        self.content = content
+        self.created_at = time.time() if created_at is None else created_at
+        self.id = id
+        self.parent_id = parent_id
+
+    @property
+    def timestamp(self) -> datetime:
+        """建立時間（naive UTC，與 ChatMessage.timestamp 相同格式）"""
+        return datetime.fromtimestamp(self.created_at, timezone.utc).replace(tzinfo=None)
+
+    def to_message(self) -> ChatMessage:
+        """
+        轉換為 API 回應用的 ChatMessage（欄位已知有效，略過驗證）
+
+        Returns:
+            ChatMessage: Pydantic 模型
+        """
+        return ChatMessage.model_construct(
+            id=self.id, parent_id=self.parent_id, role=self.role, content=self.content, timestamp=self.timestamp
+        )
+
+    def to_openai(self) -> dict[str, str]:
+        """轉換為 OpenAI Chat Completions 訊息格式"""
+        return {"role": self.role.value, "content": self.content}
+
+    def __repr__(self) -> str:
+        return f"HistoryEntry(id={self.id}, parent_id={self.parent_id}, role={self.role.value!r}, content={self.content[:30]!r})"
+
+
+class ContentPool:
+    """
+    訊息內容去重池
+
+    相同內容的訊息共用同一個字串物件；以引用計數追蹤，
+    最後一筆引用移除時即從池中刪除，避免無限成長
+    """
+
+    def __init__(self):
+        """初始化內容池"""
+        self._entries: dict[str, list] = {}  # content -> [共用字串, 引用數]
+
+    def acquire(self, content: str) -> str:
+        """
+        取得內容的共用字串並增加引用數
+
+        Args:
+            content: 訊息內容
+
+        Returns:
+            str: 池中的共用字串
+        """
+        entry = self._entries.get(content)
+        if entry is None:
+            self._entries[content] = [content, 1]
+            return content
+        entry[1] += 1
+        return entry[0]
+
+    def release(self, content: str) -> None:
+        """
+        減少內容的引用數，歸零時移出池
+
+        Args:
+            content: 訊息內容
+        """
+        entry = self._entries.get(content)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self._entries[content]
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,257 @@
+"""
+對話歷史的串流匯出 / 匯入
+
+格式為 NDJSON：每行一筆訊息
+    {"session_id": "...", "id": 1, "parent_id": null, "role": "user", "content": "...", "timestamp": "2024-01-01T12:00:00"}
+
+parent_id 保留分支結構（匯入時依原 ID 對應到新指派的 ID）；沒有 parent_id 欄位的舊版資料依序接成單一分支
+
+匯出逐批讀取並逐批壓縮（gzip / zstd），記憶體用量與資料量無關；
+匯入以增量解壓與逐行解析，累積一批後以 StateStore.append_messages 批次寫入
+"""
+import json
+import zlib
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, Optional
+
+from app.schemas.chat import MessageRole
+from app.services.history import HistoryEntry
+from app.services.state_store import SessionEntry, StateStore
+
+try:  # 選用相依：pip install zstandard
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# 壓縮格式 -> (Content-Type, 副檔名)
+EXPORT_FORMATS = {
+    "none": ("application/x-ndjson", ".ndjson"),
+    "gzip": ("application/gzip", ".ndjson.gz"),
+    "zstd": ("application/zstd", ".ndjson.zst"),
+}
+
+# gzip 與 zstd 檔頭
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def available_compressions() -> list[str]:
+    """目前可用的壓縮格式（zstd 需安裝 zstandard）"""
+    return [name for name in EXPORT_FORMATS if name != "zstd" or zstandard is not None]
+
+
+def encode_entry(session_id: str, entry: HistoryEntry) -> bytes:
+    """將一筆訊息編碼為 NDJSON 行"""
+    record = {
+        "session_id": session_id,
+        "id": entry.id,
+        "parent_id": entry.parent_id,
+        "role": entry.role.value,
+        "content": entry.content,
+        "timestamp": entry.timestamp.isoformat(),
+    }
+    return json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def decode_entry(line: bytes) -> SessionEntry:
+    """
+    解析一行 NDJSON 為 (session_id, 訊息)
+
+    Raises:
+        ValueError: 格式錯誤或欄位無效
+    """
+    try:
+        record = json.loads(line)
+        session_id = record["session_id"]
+        role = MessageRole(record["role"])
+        content = record["content"]
+        timestamp = datetime.fromisoformat(record["timestamp"])
+    except (KeyError, TypeError, json.JSONDecodeError) as e:
+        raise ValueError(f"無效的匯入資料: {e}") from None
+    if not isinstance(session_id, str) or not session_id or not isinstance(content, str):
+        raise ValueError("無效的匯入資料: session_id 與 content 必須為字串")
+
+    # 只有帶 parent_id 的資料才保留原 ID，用來對應分支結構
+    message_id = parent_id = None
+    if "parent_id" in record:
+        message_id, parent_id = record.get("id"), record["parent_id"]
+        if not isinstance(message_id, int) or not (parent_id is None or isinstance(parent_id, int)):
+            raise ValueError("無效的匯入資料: id 與 parent_id 必須為整數")
+
+    # 無時區資訊視為 UTC（與匯出格式一致）
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return session_id, HistoryEntry(role, content, timestamp.timestamp(), id=message_id, parent_id=parent_id)
+
+
+def export_ndjson(
+    store: StateStore,
+    session_id: Optional[str] = None,
+    compression: str = "none",
+    batch_size: int = 1000
+) -> Iterator[bytes]:
+    """
+    逐批產生匯出資料
+
+    Args:
+        store: 狀態儲存
+        session_id: 僅匯出指定 session，None 表示全部
+        compression: 壓縮格式（"none" / "gzip" / "zstd"）
+        batch_size: 每批訊息數（每批產生一個輸出片段）
+
+    Yields:
+        bytes: NDJSON（或壓縮後）的資料片段
+
+    Raises:
+        ValueError: 不支援的壓縮格式
+    """
+    if compression not in available_compressions():
+        raise ValueError(f"不支援的壓縮格式: {compression}（可用: {available_compressions()}）")
+
+    if compression == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        compress, finish = compressor.compress, compressor.flush
+    elif compression == "zstd":
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+        compress, finish = compressor.compress, compressor.flush
+    else:
+        compress, finish = (lambda data: data), (lambda: b"")
+
+    batch: list[bytes] = []
+    for owner, entry in store.iter_messages(session_id, batch_size=batch_size):
+        batch.append(encode_entry(owner, entry))
+        if len(batch) >= batch_size:
+            data = compress(b"".join(batch))
+            batch.clear()
+            if data:
+                yield data
+    data = compress(b"".join(batch)) + finish()
+    if data:
+        yield data
+
+
+class NDJSONDecoder:
+    """
+    增量解碼器：自動偵測 gzip / zstd 檔頭並解壓，切分完整的行
+
+    feed() 可接受任意大小的位元組片段，不完整的最後一行會保留到下一次
+    """
+
+    def __init__(self):
+        self._decompress = None
+        self._pending = b""
+        self._head = b""
+
+    def _detect(self, data: bytes, final: bool = False) -> bytes:
+        """累積至足以判斷檔頭後建立解壓器"""
+        self._head += data
+        if len(self._head) < len(_ZSTD_MAGIC) and not final:
+            return b""
+        head, self._head = self._head, b""
+        if head.startswith(_GZIP_MAGIC):
+            self._decompress = zlib.decompressobj(47).decompress
+        elif head.startswith(_ZSTD_MAGIC):
+            if zstandard is None:
+                raise ValueError("伺服器未安裝 zstandard，無法解壓 zstd 資料")
+            self._decompress = zstandard.ZstdDecompressor().decompressobj().decompress
+        else:
+            self._decompress = lambda chunk: chunk
+        return self._decompress(head)
+
+    def feed(self, data: bytes) -> list[bytes]:
+        """
+        加入資料片段
+
+        Args:
+            data: 原始（可能已壓縮）資料
+
+        Returns:
+            list[bytes]: 本次可解析的完整行（不含空行）
+        """
+        text = self._detect(data) if self._decompress is None else self._decompress(data)
+        self._pending += text
+        lines = self._pending.split(b"\n")
+        self._pending = lines.pop()
+        return [line for line in lines if line.strip()]
+
+    def close(self) -> list[bytes]:
+        """
+        結束輸入，回傳剩餘的最後一行
+
+        Returns:
+            list[bytes]: 剩餘的完整行
+        """
+        if self._decompress is None:
+            self._pending += self._detect(b"", final=True)
+        lines = [self._pending] if self._pending.strip() else []
+        self._pending = b""
+        return lines
+
+
+class HistoryImporter:
+    """
+    批次匯入器：逐片段餵入原始資料，每累積 batch_size 筆即寫入一次
+
+    資料格式錯誤時拋出 ValueError，已寫入的批次不會回滾
+    """
+
+    def __init__(self, store: StateStore, batch_size: int = 1000):
+        """
+        Args:
+            store: 狀態儲存
+            batch_size: 每次批次寫入的訊息數
+        """
+        self.store = store
+        self.batch_size = batch_size
+        self.imported = 0
+        self._decoder = NDJSONDecoder()
+        self._batch: list[SessionEntry] = []
+        self._id_map: dict[int, int] = {}  # 原訊息 ID -> 新 ID（跨批次保留分支結構）
+
+    def _add(self, lines: list[bytes]) -> None:
+        for line in lines:
+            self._batch.append(decode_entry(line))
+            if len(self._batch) >= self.batch_size:
+                self._flush()
+
+    def _flush(self) -> None:
+        if self._batch:
+            self.imported += self.store.append_messages(self._batch, self._id_map)
+            self._batch = []
+
+    def feed(self, chunk: bytes) -> None:
+        """加入原始（可能已壓縮）資料片段"""
+        self._add(self._decoder.feed(chunk))
+
+    def close(self) -> int:
+        """
+        寫入剩餘資料
+
+        Returns:
+            int: 匯入總筆數
+        """
+        self._add(self._decoder.close())
+        self._flush()
+        return self.imported
+
+
+def import_ndjson(store: StateStore, chunks: Iterable[bytes], batch_size: int = 1000) -> int:
+    """
+    從位元組片段序列匯入訊息
+
+    Args:
+        store: 狀態儲存
+        chunks: 原始（可能已壓縮）資料片段
+        batch_size: 每次批次寫入的訊息數
+
+    Returns:
+        int: 匯入筆數
+
+    Raises:
+        ValueError: 資料格式錯誤（已寫入的批次不會回滾）
+    """
+    importer = HistoryImporter(store, batch_size)
+    for chunk in chunks:
+        importer.feed(chunk)
+    return importer.close()
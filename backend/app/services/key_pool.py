@@ -0,0 +1,212 @@
+"""
+API Key 池
+
+每組 key 擁有獨立的 AsyncOpenAI 客戶端（延遲建立），依 least-loaded 或 round-robin 選擇；
+收到 429 的 key 進入冷卻期，冷卻期間不會被選中，整體吞吐量隨 key 數量擴展
+冷卻狀態為每個 worker 各自維護（同一組 key 在其他 worker 收到 429 時也會各自進入冷卻）
+"""
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Optional
+
+from app.core.config import get_settings
+from app.core.metrics import metrics
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+
+KEY_REQUESTS = metrics.counter("gemini_key_requests_total", "各 API key 發出的請求數", ("key",))
+KEY_RATE_LIMITED = metrics.counter("gemini_key_rate_limited_total", "各 API key 收到 429 的次數", ("key",))
+KEY_IN_FLIGHT = metrics.gauge("gemini_key_in_flight", "各 API key 進行中的請求數", ("key",))
+KEY_COOLDOWN_UNTIL = metrics.gauge(
+    "gemini_key_cooldown_until_seconds", "各 API key 冷卻結束時間（UNIX 秒數，0 表示可用）", ("key",)
+)
+
+STRATEGIES = ("least_loaded", "round_robin")
+
+
+def create_openai_client(api_key: str) -> "AsyncOpenAI":
+    """
+    建立指向 Gemini OpenAI 兼容 API 的客戶端（第一次呼叫時才匯入 openai SDK，位址可由 GEMINI_API_BASE_URL 覆寫）
+
+    Args:
+        api_key: Gemini API key
+
+    Returns:
+        AsyncOpenAI: 客戶端實例
+    """
+    import httpx
+    from openai import AsyncOpenAI
+
+    settings = get_settings()
+    # 逐請求的期限由 StreamDeadline 控制；這裡的 HTTP 逾時只是最後防線，
+    # 避免任何一次讀取無限期等待
+    read_timeout = max(settings.STREAM_FIRST_TOKEN_TIMEOUT, settings.STREAM_IDLE_TIMEOUT)
+    return AsyncOpenAI(
+        api_key=api_key,
+        base_url=settings.openai_base_url,
+        # 多組 key 時由 key 池改用下一組 key，不在同一組 key 上重試 429
+        max_retries=0 if len(settings.api_keys) > 1 else 2,
+        timeout=httpx.Timeout(
+            settings.STREAM_TOTAL_TIMEOUT or None,
+            connect=settings.UPSTREAM_CONNECT_TIMEOUT or None,
+            read=read_timeout or None
+        )
+    )
+
+
+class KeySlot:
+    """
+    單一 API key 的狀態
+
+    Attributes:
+        label: metrics 與日誌使用的名稱（不含 key 本身）
+        in_flight: 進行中的請求數
+        cooldown_until: 冷卻結束時間（UNIX 秒數）
+    """
+
+    def __init__(self, index: int, api_key: str):
+        self.index = index
+        self.label = f"key{index}"
+        self.api_key = api_key
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.client: Optional[Any] = None
+
+    def available(self, now: float) -> bool:
+        """是否已結束冷卻"""
+        return self.cooldown_until <= now
+
+
+class ApiKeyPool:
+    """API key 池：選擇、借用 / 歸還與 429 冷卻"""
+
+    def __init__(
+        self,
+        api_keys: list[str],
+        strategy: str = "least_loaded",
+        cooldown: float = 60.0,
+        client_factory: Callable[[str], Any] = create_openai_client
+    ):
+        """
+        Args:
+            api_keys: API key 列表
+            strategy: 選擇策略（"least_loaded" / "round_robin"）
+            cooldown: 收到 429 且未附 Retry-After 時的冷卻秒數
+            client_factory: 依 key 建立客戶端的函式
+
+        Raises:
+            ValueError: key 列表為空或策略無效
+        """
+        if not api_keys:
+            raise ValueError("API key 池至少需要一組 key")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"無效的 KEY_POOL_STRATEGY: {strategy}（可用值: {', '.join(STRATEGIES)}）")
+        self.slots = [KeySlot(index, key) for index, key in enumerate(api_keys)]
+        self.strategy = strategy
+        self.cooldown = cooldown
+        self.client_factory = client_factory
+        self._cursor = 0
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def select(self, exclude: Iterable[int] = ()) -> KeySlot:
+        """
+        選擇一組 key（不增加進行中計數）
+
+        冷卻中的 key 不會被選中；若所有候選 key 都在冷卻，改選最早結束冷卻的那一組
+
+        Args:
+            exclude: 不考慮的 key 索引（例如本次請求已收到 429 的 key）
+
+        Returns:
+            KeySlot: 選中的 key
+        """
+        excluded = set(exclude)
+        candidates = [slot for slot in self.slots if slot.index not in excluded] or self.slots
+        now = time.time()
+        ready = [slot for slot in candidates if slot.available(now)]
+        if not ready:
+            return min(candidates, key=lambda slot: slot.cooldown_until)
+
+        # 從游標位置開始輪替，least_loaded 在進行中數量相同時也會平均分配
+        ordered = sorted(ready, key=lambda slot: (slot.index - self._cursor) % len(self.slots))
+        if self.strategy == "least_loaded":
+            chosen = min(ordered, key=lambda slot: slot.in_flight)
+        else:
+            chosen = ordered[0]
+        self._cursor = chosen.index + 1
+        return chosen
+
+    def acquire(self, exclude: Iterable[int] = ()) -> KeySlot:
+        """
+        選擇並借用一組 key（進行中計數 +1，用完需呼叫 release）
+
+        Args:
+            exclude: 不考慮的 key 索引
+
+        Returns:
+            KeySlot: 借用的 key
+        """
+        slot = self.select(exclude)
+        slot.in_flight += 1
+        KEY_REQUESTS.inc(key=slot.label)
+        KEY_IN_FLIGHT.set(slot.in_flight, key=slot.label)
+        return slot
+
+    def release(self, slot: KeySlot) -> None:
+        """歸還借用的 key"""
+        slot.in_flight -= 1
+        KEY_IN_FLIGHT.set(slot.in_flight, key=slot.label)
+
+    def client(self, slot: KeySlot) -> Any:
+        """取得 key 專屬的客戶端（第一次使用時才建立）"""
+        if slot.client is None:
+            slot.client = self.client_factory(slot.api_key)
+        return slot.client
+
+    def mark_rate_limited(self, slot: KeySlot, retry_after: Optional[float] = None) -> None:
+        """
+        記錄 key 收到 429 並進入冷卻
+
+        Args:
+            slot: 收到 429 的 key
+            retry_after: 上游建議的等待秒數，None 表示使用預設冷卻時間
+        """
+        seconds = retry_after if retry_after is not None and retry_after > 0 else self.cooldown
+        slot.cooldown_until = max(slot.cooldown_until, time.time() + seconds)
+        KEY_RATE_LIMITED.inc(key=slot.label)
+        KEY_COOLDOWN_UNTIL.set(slot.cooldown_until, key=slot.label)
+        print(f"[WARNING] API key {slot.label} 收到 429，冷卻 {seconds:g} 秒")
+
+
+def retry_after_seconds(source: Any) -> Optional[float]:
+    """
+    取得上游回應的 Retry-After 秒數
+
+    Args:
+        source: 上游錯誤（openai.APIStatusError / httpx.HTTPStatusError）或 httpx.Response
+
+    Returns:
+        Optional[float]: 秒數，未提供或無法解析時為 None
+    """
+    response = getattr(source, "response", source)
+    value = getattr(response, "headers", {}).get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+@lru_cache
+def get_key_pool() -> ApiKeyPool:
+    """
+    取得全域 API key 池（第一次呼叫時才建立）
+
+    Returns:
+        ApiKeyPool: 全域單例實例
+    """
+    settings = get_settings()
+    return ApiKeyPool(settings.api_keys, settings.KEY_POOL_STRATEGY, settings.KEY_COOLDOWN_SECONDS)
@@ -0,0 +1,268 @@
+"""
+伺服器端 Markdown 渲染
+
+串流時以「區塊」為單位增量渲染：只有確定不會再被後續內容改變的區塊才渲染並送出，
+前端不必在每個 chunk 重新解析整段 Markdown；完整回應的 HTML 依內容雜湊快取於 StateStore，
+重新載入對話時直接取用。區塊邊界只由內容決定（與串流的切分方式無關），
+快取的 HTML 一律為「各區塊分別渲染後串接」的形式，串流寫入與未命中時重新渲染的結果一致
+"""
+import hashlib
+import re
+from functools import lru_cache
+from typing import Callable, Optional
+
+from app.services.state_store import StateStore
+
+try:  # 選用相依：pip install markdown-it-py
+    from markdown_it import MarkdownIt
+except ImportError:
+    MarkdownIt = None
+
+
+# 快取鍵前綴（後接內容的 SHA-256）
+HTML_CACHE_PREFIX = "markdown-html:"
+
+# 圍欄程式碼區塊開頭（``` 或 ~~~，三個以上）
+_FENCE_RE = re.compile(r"^(`{3,}|~{3,})")
+# 清單項目開頭（- / * / + 或 1. / 1)）
+_LIST_ITEM_RE = re.compile(r"^([-*+]|\d{1,9}[.)])[ \t]")
+
+
+def markdown_available() -> bool:
+    """是否已安裝 markdown-it-py"""
+    return MarkdownIt is not None
+
+
+@lru_cache
+def _parser() -> "MarkdownIt":
+    """
+    建立與前端 marked 設定一致的解析器（GFM 表格 / 刪除線、換行轉 <br>）
+
+    不允許原始 HTML，連結網址由 markdown-it 內建規則過濾（javascript: 等會被拒絕）
+    """
+    if MarkdownIt is None:
+        raise RuntimeError("伺服器未安裝 markdown-it-py，無法渲染 Markdown")
+    return MarkdownIt("commonmark", {"html": False, "breaks": True}).enable(["table", "strikethrough"])
+
+
+def render_markdown(content: str) -> str:
+    """
+    將 Markdown 渲染為 HTML
+
+    Args:
+        content: Markdown 內容
+
+    Returns:
+        str: HTML 字串
+
+    Raises:
+        RuntimeError: 未安裝 markdown-it-py
+    """
+    return _parser().render(content)
+
+
+class _BlockScanner:
+    """
+    逐行追蹤區塊邊界的狀態（是否在圍欄程式碼區塊內、前一行是否為空行）
+
+    狀態跨呼叫保留，每一行只需檢查一次
+    """
+
+    def __init__(self):
+        self.fence: Optional[str] = None
+        self.after_blank = False
+
+    def starts_block(self, line: str) -> bool:
+        """
+        處理一個完整的行
+
+        只在「圍欄程式碼區塊外的空行之後，且該行不是縮排或清單項目」處切分，
+        避免切開程式碼區塊、清單或清單項目的延續段落
+
+        Args:
+            line: 完整的一行（含換行字元）
+
+        Returns:
+            bool: 該行開頭是否為可安全切分的區塊邊界
+        """
+        stripped = line.strip()
+
+        if self.fence is not None:
+            if stripped.startswith(self.fence) and stripped == stripped[0] * len(stripped):
+                self.fence = None
+            return False
+
+        if not stripped:
+            self.after_blank = True
+            return False
+
+        boundary = self.after_blank and line[0] not in " \t" and not _LIST_ITEM_RE.match(line)
+        self.after_blank = False
+
+        match = _FENCE_RE.match(stripped)
+        if match:
+            self.fence = match.group(1)
+        return boundary
+
+
+def find_block_boundary(text: str) -> int:
+    """
+    找出 text 中最後一個可安全切分的區塊邊界（只檢查已完整收到的行）
+
+    Args:
+        text: 尚未定稿的 Markdown 文字
+
+    Returns:
+        int: 邊界位置（之前的內容可定稿），0 表示目前沒有可定稿的區塊
+    """
+    scanner = _BlockScanner()
+    boundary = 0
+    position = 0
+    for line in text[:text.rfind("\n") + 1].splitlines(keepends=True):
+        if scanner.starts_block(line):
+            boundary = position
+        position += len(line)
+    return boundary
+
+
+class IncrementalMarkdownRenderer:
+    """
+    串流用的增量 Markdown 渲染器
+
+    feed() 每收到一段文字就回傳新定稿區塊的 HTML（每個區塊分別渲染）；串流結束時呼叫 flush() 渲染剩餘內容
+    區塊邊界的掃描狀態跨 feed() 保留，每個字元只檢查一次：即使在很長的程式碼區塊或沒有空行的段落中
+    （長時間沒有可定稿的區塊），整個串流的掃描成本仍與回應長度成正比
+    """
+
+    def __init__(self, render: Callable[[str], str] = render_markdown):
+        """
+        Args:
+            render: Markdown → HTML 函式
+        """
+        self._render = render
+        self._scanner = _BlockScanner()
+        self._settled: list[str] = []  # 已確定可定稿、尚未渲染的區塊
+        self._open: list[str] = []  # 最後一個邊界之後的完整行
+        self._tail: list[str] = []  # 尚未收到換行的最後一行
+        self._parts: list[str] = []
+
+    @property
+    def html(self) -> str:
+        """目前已定稿區塊的 HTML"""
+        return "".join(self._parts)
+
+    def _emit(self, blocks: list[str]) -> list[str]:
+        # 只有空行的區塊（例如回應開頭的空行）不輸出
+        rendered = [self._render(block) for block in blocks if block.strip()]
+        self._parts.extend(rendered)
+        return rendered
+
+    def feed(self, chunk: str) -> list[str]:
+        """
+        加入新的文字片段
+
+        Args:
+            chunk: 串流收到的文字
+
+        Returns:
+            list[str]: 新定稿的 HTML 區塊（可能為空）
+        """
+        newline = chunk.rfind("\n")
+        if newline < 0:
+            self._tail.append(chunk)
+            return []
+
+        # 只掃描這次新完成的行（上次未完成的最後一行 + 本次片段到最後一個換行）
+        self._tail.append(chunk[:newline + 1])
+        complete = "".join(self._tail)
+        self._tail = [chunk[newline + 1:]]
+        for line in complete.splitlines(keepends=True):
+            if self._scanner.starts_block(line) and self._open:
+                self._settled.append("".join(self._open))
+                self._open = []
+            self._open.append(line)
+
+        blocks, self._settled = self._settled, []
+        return self._emit(blocks)
+
+    def flush(self) -> list[str]:
+        """
+        渲染所有剩餘內容（串流結束時呼叫）
+
+        Returns:
+            list[str]: 最後的 HTML 區塊（沒有剩餘內容時為空）
+        """
+        blocks = self._settled + ["".join(self._open + self._tail)]
+        self._settled, self._open, self._tail = [], [], []
+        return self._emit(blocks)
+
+
+def render_blocks(content: str, render: Callable[[str], str] = render_markdown) -> str:
+    """
+    以與串流相同的區塊切分渲染完整內容（快取的標準形式）
+
+    Args:
+        content: Markdown 內容
+        render: Markdown → HTML 函式
+
+    Returns:
+        str: 各區塊 HTML 串接的結果，與串流時 IncrementalMarkdownRenderer.html 相同
+    """
+    renderer = IncrementalMarkdownRenderer(render)
+    renderer.feed(content)
+    renderer.flush()
+    return renderer.html
+
+
+def _cache_key(content: str) -> str:
+    return HTML_CACHE_PREFIX + hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def forget_rendered_html(store: StateStore, content: str) -> None:
+    """
+    刪除內容的渲染快取（清除對話時呼叫）
+
+    Args:
+        store: 狀態儲存
+        content: Markdown 原文
+    """
+    store.cache_delete(_cache_key(content))
+
+
+def cache_rendered_html(store: StateStore, content: str, html: str, ttl: Optional[float] = None) -> None:
+    """
+    依內容雜湊快取渲染結果
+
+    Args:
+        store: 狀態儲存
+        content: Markdown 原文
+        html: 渲染後的 HTML
+        ttl: 快取秒數，None 表示不過期
+    """
+    store.cache_set(_cache_key(content), html, ttl=ttl)
+
+
+def get_rendered_html(
+    store: StateStore,
+    content: str,
+    ttl: Optional[float] = None,
+    render: Callable[[str], str] = render_blocks
+) -> str:
+    """
+    取得快取的渲染結果，未命中時渲染並寫入快取
+
+    Args:
+        store: 狀態儲存
+        content: Markdown 原文
+        ttl: 快取秒數，None 表示不過期
+        render: 完整內容 → HTML 函式（預設與串流相同的分區塊渲染）
+
+    Returns:
+        str: HTML 字串
+    """
+    key = _cache_key(content)
+    html = store.cache_get(key)
+    if html is None:
+        html = render(content)
+        store.cache_set(key, html, ttl=ttl)
+    return html
@@ -0,0 +1,235 @@
+"""
+延遲感知的 auto 模型選擇
+
+每個模型維護滾動的 time-to-first-token（TTFT）與錯誤率統計：
+TTFT 以指數加權的線性迴歸對 prompt 長度建模，預估值再依錯誤率換算為含重試的期望時間；
+錯誤率隨時間衰減（半衰期），一段錯誤暴增後不再被選中的模型過一陣子仍會重新被選擇；
+auto 模式在符合品質等級與 context window 的模型中選擇期望 TTFT 最低者，
+並以少量比例探索尚無統計的模型，讓各模型的統計保持更新
+統計為每個 worker 各自維護
+"""
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+from app.core.config import ModelInfo
+from app.core.metrics import metrics
+
+
+# 品質等級（數字越大品質越高），對應 ModelService._classify_model 的分類
+TIER_RANK = {"stable": 0, "recommended": 1, "advanced": 2}
+
+AUTO_SELECTED = metrics.counter(
+    "chat_auto_model_selected_total", "auto 模式選中的模型次數", ("model", "reason")
+)
+EXPECTED_TTFT = metrics.gauge(
+    "chat_model_expected_ttft_seconds", "auto 模式最近一次決策時各模型的預估 TTFT", ("model",)
+)
+OBSERVED_TTFT = metrics.histogram(
+    "chat_ttft_seconds", "各模型實際的 time-to-first-token", ("model",),
+    buckets=(0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 30.0)
+)
+
+
+class LatencyProfile:
+    """
+    單一模型的滾動延遲與錯誤統計
+
+    以指數加權的一階、二階動差估計 TTFT 對 prompt 長度（千字元）的線性關係，
+    另保留最近的 TTFT 樣本供百分位數查詢
+
+    錯誤率除了成功請求時衰減，也依經過時間衰減：錯誤率高的模型不會被選中、也就沒有成功請求，
+    若只在成功時衰減，一次錯誤暴增就會讓該模型永遠不被選擇
+    """
+
+    def __init__(self, alpha: float = 0.2, window: int = 200, error_half_life: float = 60.0):
+        """
+        Args:
+            alpha: 新樣本權重（0~1）
+            window: 保留的最近樣本數
+            error_half_life: 錯誤率減半所需的秒數
+        """
+        self.alpha = alpha
+        self.error_half_life = error_half_life
+        self.samples = 0
+        self.error_updated_at = time.monotonic()
+        self._error_rate = 0.0
+        self.recent: deque[float] = deque(maxlen=window)
+        self._mean_x = self._mean_y = self._mean_xx = self._mean_xy = 0.0
+
+    def record_success(self, ttft: float, prompt_chars: int) -> None:
+        """記錄一次成功請求的 TTFT"""
+        x = prompt_chars / 1000
+        weight = 1.0 if self.samples == 0 else self.alpha
+        self._mean_x += weight * (x - self._mean_x)
+        self._mean_y += weight * (ttft - self._mean_y)
+        self._mean_xx += weight * (x * x - self._mean_xx)
+        self._mean_xy += weight * (x * ttft - self._mean_xy)
+        self._set_error_rate(self.error_rate * (1 - self.alpha))
+        self.samples += 1
+        self.recent.append(ttft)
+
+    def record_error(self) -> None:
+        """記錄一次失敗（逾時或上游錯誤）"""
+        error_rate = self.error_rate
+        self._set_error_rate(error_rate + self.alpha * (1 - error_rate))
+
+    @property
+    def error_rate(self) -> float:
+        """目前的錯誤率（依上次更新後經過的時間衰減）"""
+        elapsed = time.monotonic() - self.error_updated_at
+        return self._error_rate * 0.5 ** (max(elapsed, 0.0) / self.error_half_life)
+
+    def _set_error_rate(self, error_rate: float) -> None:
+        self._error_rate = error_rate
+        self.error_updated_at = time.monotonic()
+
+    def expected_ttft(self, prompt_chars: int) -> Optional[float]:
+        """
+        預估指定 prompt 長度的 TTFT
+
+        Returns:
+            Optional[float]: 預估秒數，尚無樣本時為 None
+        """
+        if self.samples == 0:
+            return None
+        variance = self._mean_xx - self._mean_x ** 2
+        slope = (self._mean_xy - self._mean_x * self._mean_y) / variance if variance > 1e-6 else 0.0
+        # prompt 越長不會越快；負斜率視為雜訊
+        slope = max(slope, 0.0)
+        return max(self._mean_y + slope * (prompt_chars / 1000 - self._mean_x), 0.0)
+
+    def expected_cost(self, prompt_chars: int) -> Optional[float]:
+        """含失敗重試的期望 TTFT（預估 TTFT / 成功率）"""
+        ttft = self.expected_ttft(prompt_chars)
+        if ttft is None:
+            return None
+        return ttft / (1 - min(self.error_rate, 0.9))
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        最近樣本的 TTFT 百分位數
+
+        Args:
+            q: 0~1 之間的分位
+
+        Returns:
+            Optional[float]: 秒數，尚無樣本時為 None
+        """
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+@dataclass(frozen=True)
+class ModelSelection:
+    """auto 模式的選擇結果"""
+    model: str
+    tier: str
+    prompt_chars: int
+    expected_ttft: Optional[float]
+    reason: str  # "latency" / "explore" / "prior"
+
+
+class ModelSelector:
+    """依各模型延遲統計、prompt 長度與品質等級選擇模型"""
+
+    def __init__(
+        self, explore_ratio: float = 0.05, rng: Optional[random.Random] = None, error_half_life: float = 60.0
+    ):
+        """
+        Args:
+            explore_ratio: 選擇尚無統計的模型的機率
+            rng: 亂數產生器（測試時可固定）
+            error_half_life: 各模型錯誤率減半所需的秒數
+        """
+        self.explore_ratio = explore_ratio
+        self.error_half_life = error_half_life
+        self.rng = rng or random.Random()
+        self.profiles: dict[str, LatencyProfile] = {}
+
+    def profile(self, model: str) -> LatencyProfile:
+        """取得（必要時建立）模型的延遲統計"""
+        profile = self.profiles.get(model)
+        if profile is None:
+            profile = self.profiles[model] = LatencyProfile(error_half_life=self.error_half_life)
+        return profile
+
+    def record_success(self, model: str, ttft: float, prompt_chars: int) -> None:
+        """記錄模型一次成功請求的 TTFT"""
+        self.profile(model).record_success(ttft, prompt_chars)
+        OBSERVED_TTFT.observe(ttft, model=model)
+
+    def record_error(self, model: str) -> None:
+        """記錄模型一次失敗"""
+        self.profile(model).record_error()
+
+    def choose(self, models: list[ModelInfo], prompt_chars: int, min_tier: str) -> ModelSelection:
+        """
+        選擇期望 TTFT 最低且符合品質等級的模型
+
+        Args:
+            models: 候選模型（來自模型目錄）
+            prompt_chars: 本次 prompt（含歷史）的字元數
+            min_tier: 最低品質等級（stable / recommended / advanced）
+
+        Returns:
+            ModelSelection: 選擇結果
+
+        Raises:
+            ValueError: 沒有任何模型的 context window 容得下此 prompt
+        """
+        # 以字元數作為 token 數上限（中文約一字一 token，英文更少），保守判斷 context window
+        fitting = [m for m in models if not m.get("context_window") or prompt_chars <= m["context_window"]]
+        if not fitting:
+            raise ValueError(f"沒有可容納此對話長度（約 {prompt_chars} 字元）的模型")
+
+        required = TIER_RANK.get(min_tier, 0)
+        eligible = [m for m in fitting if TIER_RANK.get(m["category"], 0) >= required]
+        if not eligible:
+            # 沒有符合等級的模型時，退而選擇可用的最高等級
+            best = max(TIER_RANK.get(m["category"], 0) for m in fitting)
+            eligible = [m for m in fitting if TIER_RANK.get(m["category"], 0) == best]
+
+        costs = {m["id"]: self.profile(m["id"]).expected_cost(prompt_chars) for m in eligible}
+        for model_id, cost in costs.items():
+            if cost is not None:
+                EXPECTED_TTFT.set(cost, model=model_id)
+
+        known = [m for m in eligible if costs[m["id"]] is not None]
+        unknown = [m for m in eligible if costs[m["id"]] is None]
+
+        if not known:
+            # 尚無任何統計：選擇符合條件的最低等級（通常也是最快的模型）
+            chosen = min(eligible, key=lambda m: TIER_RANK.get(m["category"], 0))
+            reason = "prior"
+        elif unknown and self.rng.random() < self.explore_ratio:
+            chosen = self.rng.choice(unknown)
+            reason = "explore"
+        else:
+            chosen = min(known, key=lambda m: costs[m["id"]])
+            reason = "latency"
+
+        AUTO_SELECTED.inc(model=chosen["id"], reason=reason)
+        return ModelSelection(
+            model=chosen["id"],
+            tier=chosen["category"],
+            prompt_chars=prompt_chars,
+            expected_ttft=costs[chosen["id"]],
+            reason=reason
+        )
+
+
+@lru_cache
+def get_model_selector() -> ModelSelector:
+    """
+    取得全域模型選擇器（每個 worker 一份）
+
+    Returns:
+        ModelSelector: 全域單例實例
+    """
+    return ModelSelector()
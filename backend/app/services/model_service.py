@@ -3,27 +3,136 @@ Model Service 模組
 
 管理 AI 模型資訊的取得，從 Google Generative Language API 動態獲取
 """
+import asyncio
+import hashlib
+import json
+import time
 import httpx
+from dataclasses import dataclass
+from functools import lru_cache
 from typing import Optional
 
-from app.core.config import settings, GOOGLE_MODELS_API_URL
+from app.core.config import get_settings
+from app.core.http_cache import CachedJSON
 from app.schemas.chat import ModelInfo
+from app.services.key_pool import get_key_pool, retry_after_seconds
+from app.services.state_store import StateStore, get_state_store
+
+
+# 模型目錄在共享狀態儲存中的快取鍵
+MODEL_CATALOG_CACHE_KEY = "model_catalog"
+
+# 程序內模型目錄副本的有效秒數（避免每個請求都讀取共享狀態儲存）
+LOCAL_CATALOG_TTL = 5.0
+
+
+@dataclass(frozen=True)
+class ModelCatalog:
+    """模型目錄快照（version 為模型列表內容的雜湊值）"""
+    version: str
+    models: list[ModelInfo]
+
+
+def _catalog_version(models: list[ModelInfo]) -> str:
+    """計算模型列表的版本字串"""
+    canonical = json.dumps(models, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(canonical).hexdigest()[:16]
 
 
 class ModelService:
     """
     模型服務類
 
-    從 Google API 動態獲取可用模型列表
+    從 Google API 動態獲取可用模型列表，結果快取於共享狀態儲存（所有 worker 共用）
     """
 
-    def __init__(self):
-        """初始化模型服務"""
-        self.api_url = GOOGLE_MODELS_API_URL
-        self.api_key = settings.GEMINI_API_KEY
+    def __init__(self, store: StateStore):
+        """
+        初始化模型服務
+
+        Args:
+            store: 存放模型目錄快取的共享狀態儲存
+        """
+        settings = get_settings()
+        self.api_url = settings.models_api_url
+        self.key_pool = get_key_pool()
+        self.default_model = settings.GEMINI_MODEL
         self.timeout = 10.0
+        self.cache_ttl = settings.MODEL_CATALOG_TTL
+        self.store = store
+        # 程序內副本：(到期時間, 目錄)
+        self._local: Optional[tuple[float, ModelCatalog]] = None
+        # 預先編碼的 /models 回應：(目錄版本, 編碼內容)
+        self._encoded: Optional[tuple[str, CachedJSON]] = None
+        # 背景預熱工作（readiness 檢查時若目錄尚未載入則啟動）
+        self._prewarm_task: Optional[asyncio.Task] = None
+
+    async def get_catalog(self) -> ModelCatalog:
+        """
+        取得模型目錄快照
+
+        依序查詢程序內副本、共享狀態儲存，皆未命中時才呼叫 Google API
+
+        Returns:
+            ModelCatalog: 模型目錄快照
+
+        Raises:
+            Exception: API 呼叫失敗時拋出異常
+        """
+        now = time.monotonic()
+        if self._local is not None and self._local[0] > now:
+            return self._local[1]
+
+        cached = await self.store.run(self.store.cache_get, MODEL_CATALOG_CACHE_KEY)
+        if isinstance(cached, dict) and "version" in cached:
+            catalog = ModelCatalog(version=cached["version"], models=cached["models"])
+        else:
+            models = await self._fetch_models()
+            catalog = ModelCatalog(version=_catalog_version(models), models=models)
+            await self.store.run(
+                self.store.cache_set,
+                MODEL_CATALOG_CACHE_KEY,
+                {"version": catalog.version, "models": catalog.models},
+                ttl=self.cache_ttl
+            )
+
+        self._local = (now + min(LOCAL_CATALOG_TTL, self.cache_ttl), catalog)
+        return catalog
 
     async def get_available_models(self) -> list[ModelInfo]:
+        """
+        取得可用模型列表
+
+        Returns:
+            list[ModelInfo]: 可用模型列表
+
+        Raises:
+            Exception: API 呼叫失敗時拋出異常
+        """
+        return (await self.get_catalog()).models
+
+    async def get_models_payload(self) -> CachedJSON:
+        """
+        取得預先編碼的 /api/chat/models 回應內容
+
+        僅在目錄版本改變時重新序列化，其餘請求直接重用同一份 bytes
+
+        Returns:
+            CachedJSON: 編碼後的回應內容與 ETag
+
+        Raises:
+            Exception: API 呼叫失敗時拋出異常
+        """
+        catalog = await self.get_catalog()
+        if self._encoded is None or self._encoded[0] != catalog.version:
+            payload = CachedJSON.from_content({
+                "models": catalog.models,
+                "default_model": self.get_default_model()
+            })
+            self._encoded = (catalog.version, payload)
+        return self._encoded[1]
+
+    async def _fetch_models(self) -> list[ModelInfo]:
         """
         從 Google API 動態獲取可用模型列表
 
@@ -35,11 +144,14 @@ class ModelService:
         """
         try:
             # 使用 httpx 非同步呼叫 Google API
+            slot = self.key_pool.select()
             async with httpx.AsyncClient(timeout=self.timeout) as client:
                 response = await client.get(
                     self.api_url,
-                    params={"key": self.api_key}
+                    params={"key": slot.api_key}
                 )
+                if response.status_code == 429:
+                    self.key_pool.mark_rate_limited(slot, retry_after_seconds(response))
                 response.raise_for_status()
 
             data = response.json()
@@ -103,7 +215,32 @@ class ModelService:
         Returns:
             str: 預設模型 ID
         """
-        return settings.GEMINI_MODEL
+        return self.default_model
+
+    async def prewarm(self) -> bool:
+        """
+        預先載入模型目錄到快取（於 lifespan 啟動階段呼叫）
+
+        Returns:
+            bool: 是否成功載入；失敗時不拋出例外，由第一個請求重試
+        """
+        try:
+            await self.get_available_models()
+            return True
+        except Exception as e:
+            print(f"[WARNING] 模型目錄預熱失敗: {e}")
+            return False
+
+    @property
+    def catalog_warm(self) -> bool:
+        """本 worker 是否已載入過模型目錄（過期後仍視為已預熱，下次請求會在背景更新）"""
+        return self._local is not None
+
+    def ensure_prewarm(self) -> None:
+        """目錄尚未載入且沒有進行中的預熱時，於背景啟動預熱（不等待結果）"""
+        if self.catalog_warm or (self._prewarm_task is not None and not self._prewarm_task.done()):
+            return
+        self._prewarm_task = asyncio.create_task(self.prewarm())
 
     async def validate_model(self, model_id: str) -> bool:
         """
@@ -123,5 +260,12 @@ class ModelService:
             return False
 
 
-# 全域單例實例
-model_service = ModelService()
+@lru_cache
+def get_model_service() -> ModelService:
+    """
+    取得全域模型服務（第一次呼叫時才建立，可作為 FastAPI dependency）
+
+    Returns:
+        ModelService: 全域單例實例
+    """
+    return ModelService(get_state_store())
@@ -4,36 +4,242 @@ OpenAI Service 模組
 使用 OpenAI SDK 搭配 Google Vertex AI OpenAI 兼容 API
 實現對話生成與串流回應功能
 """
-from typing import AsyncGenerator
-from openai import AsyncOpenAI
-
-from app.core.config import settings, OPENAI_BASE_URL
-from app.schemas.chat import ChatMessage, MessageRole
+import asyncio
+import time
+from contextlib import aclosing
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, AsyncGenerator, AsyncIterator, Callable, Optional
+
+from app.core.config import DEFAULT_SESSION_ID, get_generation_limits
+from app.core.circuit_breaker import CircuitBreaker, get_circuit_breaker
+from app.core.deadlines import DeadlineExceeded, StreamDeadline
+from app.schemas.chat import ChatMessage, GenerationControls, MessageRole
+from app.services.compaction import HistoryCompactor
+from app.services.hedging import HedgePolicy, get_hedge_policy
+from app.services.history import HistoryEntry
+from app.services.key_pool import ApiKeyPool, KeySlot, get_key_pool, retry_after_seconds
+from app.services.markdown_renderer import forget_rendered_html
+from app.services.model_selector import ModelSelector, get_model_selector
+from app.services.output_filters import ChunkPipeline
+from app.services.state_store import SearchHit, StateStore, get_state_store
+
+if TYPE_CHECKING:
+    # openai SDK 匯入成本高，僅在第一次呼叫 API 時才載入
+    from openai import AsyncOpenAI
 
 
 # 預設的額度用完訊息
 QUOTA_EXCEEDED_MESSAGE = "抱歉，AI 服務額度已用完，請稍後再試或聯繫管理員。"
 
 
+@dataclass
+class CompletionStats:
+    """
+    單次串流呼叫的統計
+
+    Attributes:
+        include_usage: 是否要求上游在最後一個片段附上 token 用量
+        ttft: 首個內容片段的時間（秒），尚未收到時為 None
+        duration: 從送出請求到串流結束的時間（秒）
+        chunks: 內容片段數
+        chars: 回應字元數
+        prompt_tokens / completion_tokens: 上游回報的 token 用量（未回報時為 None）
+    """
+    include_usage: bool = False
+    ttft: Optional[float] = None
+    duration: Optional[float] = None
+    chunks: int = 0
+    chars: int = 0
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+
+
+def generation_params(model: str, controls: Optional[GenerationControls] = None) -> dict[str, Any]:
+    """
+    依模型的上限驗證生成參數，並補上預設值
+
+    Args:
+        model: 模型 ID
+        controls: 請求指定的生成參數（None 表示全部使用預設值）
+
+    Returns:
+        dict[str, Any]: chat.completions.create 的生成參數
+
+    Raises:
+        ValueError: 參數超過模型的上限
+    """
+    limits = get_generation_limits(model)
+    controls = controls or GenerationControls()
+    if controls.max_tokens is not None and controls.max_tokens > limits["max_tokens"]:
+        raise ValueError(f"max_tokens 超過模型 {model} 的上限 {limits['max_tokens']}")
+    if controls.temperature is not None and controls.temperature > limits["max_temperature"]:
+        raise ValueError(f"temperature 超過模型 {model} 的上限 {limits['max_temperature']:g}")
+    if controls.stop and len(controls.stop) > limits["max_stop_sequences"]:
+        raise ValueError(f"停止序列最多 {limits['max_stop_sequences']} 個")
+
+    params: dict[str, Any] = {
+        "temperature": limits["default_temperature"] if controls.temperature is None else controls.temperature,
+        "top_p": limits["default_top_p"] if controls.top_p is None else controls.top_p,
+        "max_tokens": controls.max_tokens or limits["default_max_tokens"],
+    }
+    if controls.stop:
+        params["stop"] = controls.stop
+    return params
+
+
 class OpenAIService:
     """
     OpenAI 服務類
 
-    使用 AsyncOpenAI 實現對話生成
-    管理對話歷史記錄（記憶體版本）
+    使用 AsyncOpenAI 實現對話生成，每個請求從 API key 池借用一組 key（收到 429 時改用下一組）
+    對話歷史依 session 存放於共享的 StateStore
     """
 
-    def __init__(self):
-        """初始化 OpenAI 客戶端"""
-        self.client = AsyncOpenAI(
-            api_key=settings.GEMINI_API_KEY,
-            base_url=OPENAI_BASE_URL
-        )
-        # 對話歷史（記憶體存儲）
-        self._message_history: list[ChatMessage] = []
+    def __init__(
+        self,
+        store: StateStore,
+        key_pool: Optional[ApiKeyPool] = None,
+        model_selector: Optional[ModelSelector] = None,
+        hedge_policy: Optional[HedgePolicy] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None
+    ):
+        """
+        初始化服務（各 key 的 OpenAI 客戶端延遲到第一次使用時才建立）
+
+        Args:
+            store: 存放對話歷史的共享狀態儲存
+            key_pool: API key 池，None 表示使用全域 key 池
+            model_selector: 記錄各模型延遲並供 auto 模式選擇的選擇器，None 表示使用全域選擇器
+            hedge_policy: 對沖請求策略，None 表示使用全域策略（依 HEDGE_ENABLED 設定）
+            circuit_breaker: 上游熔斷器，None 表示使用全域熔斷器
+        """
+        self.store = store
+        self.key_pool = key_pool or get_key_pool()
+        self.model_selector = model_selector or get_model_selector()
+        self.hedge_policy = hedge_policy or get_hedge_policy()
+        self.circuit_breaker = circuit_breaker or get_circuit_breaker()
+        self.compactor = HistoryCompactor(store, lambda: self.client)
+
+    @property
+    def client(self) -> "AsyncOpenAI":
+        """目前負載最低（或輪替到）的 key 的客戶端，供背景工作等單次呼叫使用"""
+        return self.key_pool.client(self.key_pool.select())
+
+    async def _open_stream(self, deadline: StreamDeadline, **params: Any) -> tuple[KeySlot, Any]:
+        """
+        借用一組 key 建立串流；收到 429 時將該 key 冷卻並改用下一組，直到所有 key 都試過
+
+        Args:
+            deadline: 串流期限（所有嘗試共用首個片段期限）
+            **params: chat.completions.create 參數
+
+        Returns:
+            tuple[KeySlot, Any]: (借用中的 key，用完需 release, 上游串流)
+
+        Raises:
+            Exception: 非額度錯誤，或所有 key 都收到 429
+        """
+        tried: list[int] = []
+        while True:
+            slot = self.key_pool.acquire(exclude=tried)
+            try:
+                stream = await deadline.guard(
+                    self.key_pool.client(slot).chat.completions.create(**params)
+                )
+                return slot, stream
+            except Exception as e:
+                self.key_pool.release(slot)
+                if not self.is_quota_error(e):
+                    raise
+                self.key_pool.mark_rate_limited(slot, retry_after_seconds(e))
+                tried.append(slot.index)
+                if len(tried) >= len(self.key_pool):
+                    raise
+
+    async def _open_first_chunk(
+        self, deadline: StreamDeadline, stats: CompletionStats, params: dict[str, Any]
+    ) -> tuple[KeySlot, Any, AsyncIterator[str], Optional[str]]:
+        """
+        建立串流並等待首個內容片段
+
+        Args:
+            deadline: 串流期限
+            stats: 記錄 token 用量的統計物件
+            params: chat.completions.create 參數
+
+        Returns:
+            tuple: (借用中的 key, 上游串流, 其餘內容片段的迭代器, 首個片段；空回應時為 None)
+        """
+        slot, stream = await self._open_stream(deadline, **params)
+        contents = self._iter_content(stream, stats)
+        try:
+            first = await deadline.guard(anext(contents, None))
+        except BaseException:
+            # 失敗或被取消（對沖落敗）：關閉上游連線並歸還 key
+            await self._discard_stream((slot, stream, contents, None))
+            raise
+        return slot, stream, contents, first
+
+    async def _discard_stream(self, opened: tuple[KeySlot, Any, AsyncIterator[str], Optional[str]]) -> None:
+        """關閉不再使用的串流並歸還 key"""
+        slot, stream, contents, _ = opened
+        self.key_pool.release(slot)
+        await contents.aclose()
+        await stream.close()
+
+    async def _race_first_chunk(
+        self, deadline: StreamDeadline, model: str, stats: CompletionStats, params: dict[str, Any]
+    ) -> tuple[KeySlot, Any, AsyncIterator[str], Optional[str]]:
+        """
+        等待首個內容片段；啟用對沖時，超過門檻仍未收到則送出相同的第二個請求，先產生首個片段者勝出
+
+        只有一個請求失敗時繼續等待另一個；落敗或未使用的請求會被取消並歸還 key
+
+        Returns:
+            tuple: 同 _open_first_chunk
+
+        Raises:
+            Exception: 所有請求都失敗時拋出第一個請求的錯誤
+        """
+        delay = self.hedge_policy.delay_for(model, self.model_selector.profile(model))
+        if delay is None:
+            return await self._open_first_chunk(deadline, stats, params)
+
+        attempts = [asyncio.create_task(self._open_first_chunk(deadline, stats, params))]
+        winner: Optional[asyncio.Task] = None
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if not done and self.hedge_policy.try_hedge(model):
+                print(f"[DEBUG] {model} 超過 {delay:.2f} 秒未收到首個片段，送出對沖請求")
+                attempts.append(asyncio.create_task(self._open_first_chunk(deadline, stats, params)))
+
+            pending = set(attempts)
+            while winner is None and pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in attempts if task in done and task.exception() is None), None)
+            if winner is None:
+                raise attempts[0].exception()
+            if winner is not attempts[0]:
+                self.hedge_policy.record_win(model)
+            return winner.result()
+        finally:
+            losers = [task for task in attempts if task is not winner]
+            for task in losers:
+                task.cancel()
+            for result in await asyncio.gather(*losers, return_exceptions=True):
+                if isinstance(result, tuple):
+                    # 與勝出者幾乎同時完成的請求
+                    await self._discard_stream(result)
 
     async def generate_streaming_response(
-        self, user_message: str, model: str
+        self,
+        user_message: str,
+        model: str,
+        session_id: str = DEFAULT_SESSION_ID,
+        deadline: Optional[StreamDeadline] = None,
+        pipeline: Optional[ChunkPipeline] = None,
+        generation: Optional[GenerationControls] = None
     ) -> AsyncGenerator[str, None]:
         """
         生成串流回應
@@ -41,74 +247,304 @@ class OpenAIService:
         Args:
             user_message: 使用者輸入的訊息
             model: 使用的模型 ID
+            session_id: 對話 session ID
+            deadline: 串流期限（None 表示不限制）
+            pipeline: 輸出過濾管線（None 表示不過濾）；歷史記錄的是過濾後的內容
+            generation: 生成參數（None 表示使用模型的預設值）
 
         Yields:
             str: 生成的文字片段
 
         Raises:
+            DeadlineExceeded: 首個片段、片段間隔或總時間到期（上游請求已取消）
             Exception: API 呼叫或串流處理錯誤（額度錯誤會作為訊息返回）
         """
         # Debug: 記錄使用的模型
         print(f"[DEBUG] generate_streaming_response called with model: {model}")
 
-        # 添加使用者訊息到歷史
-        user_msg = ChatMessage(
-            role=MessageRole.USER,
-            content=user_message
+        # 添加使用者訊息到目前分支
+        await self.store.run(self.store.append_message, session_id, HistoryEntry(MessageRole.USER, user_message))
+
+        # 失敗時移除使用者訊息
+        reply = self._stream_reply(
+            model, session_id, deadline, pipeline, generation,
+            rollback=lambda: self.store.pop_message(session_id)
         )
-        self._message_history.append(user_msg)
-
-        # 將對話歷史轉換為 OpenAI 訊息格式
-        messages = [
-            {
-                "role": msg.role.value,
-                "content": msg.content
-            }
-            for msg in self._message_history
-        ]
+        async with aclosing(reply) as chunks:
+            async for content in chunks:
+                yield content
+
+    async def regenerate_streaming_response(
+        self,
+        model: str,
+        session_id: str = DEFAULT_SESSION_ID,
+        deadline: Optional[StreamDeadline] = None,
+        pipeline: Optional[ChunkPipeline] = None,
+        generation: Optional[GenerationControls] = None
+    ) -> AsyncGenerator[str, None]:
+        """
+        重新產生目前分支最後一則使用者訊息的回應
 
-        # 調用 OpenAI Chat Completions API（串流）
-        try:
-            stream = await self.client.chat.completions.create(
-                model=model,
-                messages=messages,
-                stream=True,
-                temperature=0.7,
-                top_p=0.95,
-                max_tokens=4096
-            )
+        新回應成為該使用者訊息的另一個分支，原本的回應保留，可再切換回去
+
+        Args:
+            model: 使用的模型 ID
+            session_id: 對話 session ID
+            deadline: 串流期限（None 表示不限制）
+            pipeline: 輸出過濾管線（None 表示不過濾）
+            generation: 生成參數（None 表示使用模型的預設值）
 
-            # 收集完整回應文字
-            complete_content = ""
+        Yields:
+            str: 生成的文字片段
 
-            # 逐塊產生回應
-            async for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    content = chunk.choices[0].delta.content
+        Raises:
+            ValueError: 目前分支沒有可重新產生回應的使用者訊息
+            DeadlineExceeded: 期限到期（上游請求已取消）
+            Exception: API 呼叫或串流處理錯誤（額度錯誤會作為訊息返回）
+        """
+        previous_head = await self.store.run(self._move_head_to_regenerate_target, session_id)
+
+        # 失敗時切回原本的分支
+        reply = self._stream_reply(
+            model, session_id, deadline, pipeline, generation,
+            rollback=lambda: self.store.set_head(session_id, previous_head)
+        )
+        async with aclosing(reply) as chunks:
+            async for content in chunks:
+                yield content
+
+    def _move_head_to_regenerate_target(self, session_id: str) -> Optional[int]:
+        """將 head 移到要重新產生回應的使用者訊息，回傳原本的 head"""
+        previous_head = self.store.get_head(session_id)
+        prompt = self.regenerate_target(session_id)
+        self.store.set_head(session_id, prompt.id)
+        return previous_head
+
+    def _branch_prompt(self, session_id: str) -> list[dict[str, str]]:
+        """沿目前分支組裝 prompt（已壓縮的 session 改送摘要 + 最近訊息）"""
+        return self.compactor.build_prompt(session_id, self.store.get_messages(session_id))
+
+    async def _stream_reply(
+        self,
+        model: str,
+        session_id: str,
+        deadline: Optional[StreamDeadline],
+        pipeline: Optional[ChunkPipeline],
+        generation: Optional[GenerationControls],
+        rollback: Callable[[], Any]
+    ) -> AsyncGenerator[str, None]:
+        """
+        依目前分支的歷史產生回應，完成後接在 head 之後
+
+        Args:
+            model: 使用的模型 ID
+            session_id: 對話 session ID
+            deadline: 串流期限（None 表示不限制）
+            pipeline: 輸出過濾管線（None 表示不過濾）
+            generation: 生成參數（None 表示使用模型的預設值）
+            rollback: 發生錯誤時還原歷史的函式（同步函式，經由 store.run 執行）
+        """
+        messages = await self.store.run(self._branch_prompt, session_id)
+
+        # 收集完整回應文字
+        complete_content = ""
+        try:
+            # 客戶端中斷時立即關閉內層串流，確保 key 即時歸還
+            completion = self.stream_completion(messages, model, deadline, generation=generation)
+            async with aclosing(completion) as chunks:
+                async for content in chunks:
+                    if pipeline is not None:
+                        content = pipeline.feed(content)
+                        if not content:
+                            continue
                     complete_content += content
                     yield content
+            if pipeline is not None:
+                tail = pipeline.flush()
+                if tail:
+                    complete_content += tail
+                    yield tail
 
             # 將完整回應添加到歷史
-            assistant_msg = ChatMessage(
-                role=MessageRole.ASSISTANT,
-                content=complete_content
+            await self.store.run(
+                self.store.append_message, session_id, HistoryEntry(MessageRole.ASSISTANT, complete_content)
             )
-            self._message_history.append(assistant_msg)
 
-        except Exception as e:
-            # Debug logging：記錄原始錯誤以協助診斷
-            print(f"[OpenAI API Error] Type: {type(e).__name__}, Message: {str(e)}")
+            # 歷史過長時於背景產生摘要（不影響本次回應）
+            self.compactor.maybe_schedule(session_id)
+
+        except asyncio.CancelledError:
+            # 串流被中止（排空逾時或客戶端離線）：保存已送出的部分回應，讓歷史與客戶端看到的內容一致
+            # 寫入以 shield 保護：本 task 再次被取消時寫入仍在 thread 中完成，不在 event loop 上等待寫入鎖
+            if complete_content:
+                await asyncio.shield(self.store.run(
+                    self.store.append_message, session_id, HistoryEntry(MessageRole.ASSISTANT, complete_content)
+                ))
+            raise
 
-            # 檢查是否為額度用完錯誤
-            if self._is_quota_exceeded_error(e):
-                # 額度用完：移除使用者訊息，返回友善訊息
-                self._message_history.pop()
+        except Exception as e:
+            # 還原歷史；額度用完時返回友善訊息，其他錯誤重新拋出
+            await self.store.run(rollback)
+            if self.is_quota_error(e):
                 yield QUOTA_EXCEEDED_MESSAGE
             else:
-                # 其他錯誤：移除使用者訊息，重新拋出
-                self._message_history.pop()
                 raise
 
+    async def stream_completion(
+        self,
+        messages: list[dict[str, str]],
+        model: str,
+        deadline: Optional[StreamDeadline] = None,
+        stats: Optional[CompletionStats] = None,
+        generation: Optional[GenerationControls] = None
+    ) -> AsyncGenerator[str, None]:
+        """
+        以指定訊息呼叫模型並逐塊產生回應（不讀寫對話歷史）
+
+        Args:
+            messages: OpenAI Chat Completions 訊息格式
+            model: 使用的模型 ID
+            deadline: 串流期限（None 表示不限制）
+            stats: 填入 TTFT、片段數與 token 用量的統計物件（None 表示不需要）
+            generation: 生成參數（None 表示使用模型的預設值）
+
+        Yields:
+            str: 生成的文字片段
+
+        Raises:
+            CircuitOpenError: 上游熔斷中（不送出請求）
+            ValueError: 生成參數超過模型的上限（不送出請求）
+            DeadlineExceeded: 首個片段、片段間隔或總時間到期（上游請求已取消）
+            Exception: API 呼叫或串流處理錯誤（包含所有 key 都收到 429）
+        """
+        self.circuit_breaker.check()
+        generation_kwargs = generation_params(model, generation)
+        deadline = deadline or StreamDeadline()
+        stats = stats or CompletionStats()
+        prompt_chars = sum(len(message["content"]) for message in messages)
+        started = time.monotonic()
+
+        # 調用 OpenAI Chat Completions API（串流）
+        try:
+            params: dict[str, Any] = {}
+            if stats.include_usage:
+                params["stream_options"] = {"include_usage": True}
+            params.update(
+                model=model,
+                messages=messages,
+                stream=True,
+                **generation_kwargs
+            )
+            slot, stream, contents, first = await self._race_first_chunk(deadline, model, stats, params)
+
+            # 逐塊產生回應（每個片段都受期限保護；結束、逾時或客戶端中斷時關閉上游連線並歸還 key）
+            try:
+                if first is not None:
+                    # 記錄 TTFT，作為 auto 模式與對沖門檻的延遲統計
+                    deadline.received_first = True
+                    stats.ttft = time.monotonic() - started
+                    self.model_selector.record_success(model, stats.ttft, prompt_chars)
+                    self.circuit_breaker.record_success()
+                    stats.chunks, stats.chars = 1, len(first)
+                    yield first
+                    async for content in deadline.iterate(contents):
+                        stats.chunks += 1
+                        stats.chars += len(content)
+                        yield content
+            finally:
+                stats.duration = time.monotonic() - started
+                self.key_pool.release(slot)
+                await contents.aclose()
+                await stream.close()
+
+        except Exception as e:
+            # Debug logging：記錄原始錯誤以協助診斷
+            print(f"[OpenAI API Error] Type: {type(e).__name__}, Message: {str(e)}")
+
+            # 只有上游本身的失敗計入模型錯誤率與熔斷器（客戶端造成的逾時或錯誤不計入，
+            # 首個片段之後的錯誤也不計入：該請求已記錄為成功）
+            if self.is_upstream_failure(e, deadline):
+                self.model_selector.record_error(model)
+                self.circuit_breaker.record_failure()
+            raise
+
+    def preview_prompt(self, user_message: str, session_id: Optional[str] = None) -> list[dict[str, str]]:
+        """
+        組裝加入新訊息後會送出的 prompt（不寫入歷史）
+
+        Args:
+            user_message: 即將送出的使用者訊息
+            session_id: 作為上下文的對話 session，None 表示不帶歷史
+
+        Returns:
+            list[dict[str, str]]: OpenAI Chat Completions 訊息格式
+        """
+        messages = []
+        if session_id is not None:
+            messages = self._branch_prompt(session_id)
+        messages.append(HistoryEntry(MessageRole.USER, user_message).to_openai())
+        return messages
+
+    def estimate_prompt_chars(self, session_id: str, user_message: str) -> int:
+        """
+        估計加入新訊息後送出的 prompt 字元數（含摘要與歷史）
+
+        Args:
+            session_id: 對話 session ID
+            user_message: 即將送出的使用者訊息
+
+        Returns:
+            int: 字元數
+        """
+        return sum(len(message["content"]) for message in self.preview_prompt(user_message, session_id))
+
+    @staticmethod
+    async def _iter_content(stream, stats: CompletionStats) -> AsyncIterator[str]:
+        """僅取出串流中非空的文字片段（首個片段期限以實際內容為準），並記錄 token 用量"""
+        async for chunk in stream:
+            usage = getattr(chunk, "usage", None)
+            if usage is not None:
+                stats.prompt_tokens = usage.prompt_tokens
+                stats.completion_tokens = usage.completion_tokens
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    @classmethod
+    def is_upstream_failure(cls, error: Exception, deadline: StreamDeadline) -> bool:
+        """
+        判斷錯誤是否代表上游本身失敗（計入熔斷器與 auto 模式的模型錯誤率）
+
+        只計入首個片段之前的連線或上游錯誤，以及伺服器設定的首個片段期限到期；
+        客戶端可用 X-Request-Timeout 縮短的總時間期限、首個片段之後的錯誤、
+        額度錯誤與請求本身造成的 4xx 都不計入，避免單一客戶端觸發熔斷或左右所有使用者的模型選擇
+
+        Args:
+            error: 捕捉的例外
+            deadline: 該次呼叫的串流期限
+
+        Returns:
+            bool: 是否計入
+        """
+        if deadline.received_first or cls.is_quota_error(error):
+            return False
+        if isinstance(error, DeadlineExceeded):
+            return error.deadline == "first_token"
+        status_code = getattr(error, "status_code", None)
+        return not (isinstance(status_code, int) and 400 <= status_code < 500)
+
+    @classmethod
+    def is_quota_error(cls, error: Exception) -> bool:
+        """
+        判斷上游錯誤是否為額度用完（429）；串流期限到期不算，即使訊息中含有相同數字
+
+        Args:
+            error: 捕捉的例外
+
+        Returns:
+            bool: 是否為額度用完錯誤
+        """
+        return not isinstance(error, DeadlineExceeded) and cls._is_quota_exceeded_error(error)
+
     @staticmethod
     def _is_quota_exceeded_error(error: Exception) -> bool:
         """
@@ -137,21 +573,140 @@ class OpenAIService:
         ]
         return any(keyword in error_str for keyword in quota_keywords)
 
-    def get_history(self) -> list[ChatMessage]:
+    def get_history(self, session_id: str = DEFAULT_SESSION_ID) -> list[HistoryEntry]:
         """
         獲取對話歷史
 
+        Args:
+            session_id: 對話 session ID
+
         Returns:
-            list[ChatMessage]: 對話記錄列表
+            list[HistoryEntry]: 對話記錄列表（精簡表示，API 邊界再轉換為 ChatMessage）
         """
-        return self._message_history.copy()
+        return self.store.get_messages(session_id)
 
-    def clear_history(self) -> None:
-        """清除對話歷史"""
-        self._message_history.clear()
+    async def get_history_stats(self, session_id: str = DEFAULT_SESSION_ID) -> tuple[int, int]:
+        """
+        獲取對話歷史的長度（在 SQLite 內彙總，不載入訊息內容，也不阻塞事件迴圈）
+
+        Args:
+            session_id: 對話 session ID
+
+        Returns:
+            tuple[int, int]: (訊息數, 內容總字元數)
+        """
+        return await self.store.run(self.store.branch_stats, session_id)
+
+    def search_history(
+        self, query: str, session_id: Optional[str] = None, limit: int = 20, offset: int = 0
+    ) -> tuple[int, list[SearchHit]]:
+        """
+        全文檢索對話歷史
+
+        Args:
+            query: 查詢字串
+            session_id: 僅搜尋指定 session，None 表示全部
+            limit: 回傳筆數
+            offset: 略過筆數
+
+        Returns:
+            tuple[int, list[SearchHit]]: (命中總數, 依相關度排序的結果)
+        """
+        return self.store.search_messages(query, session_id, limit, offset)
+
+    def clear_history(self, session_id: str = DEFAULT_SESSION_ID) -> None:
+        """
+        清除對話歷史（連同所有分支回應的 Markdown 渲染快取）
+
+        Args:
+            session_id: 對話 session ID
+        """
+        for _, entry in self.store.iter_messages(session_id):
+            if entry.role == MessageRole.ASSISTANT:
+                forget_rendered_html(self.store, entry.content)
+        self.store.clear_messages(session_id)
+        self.compactor.forget(session_id)
+
+    def regenerate_target(self, session_id: str = DEFAULT_SESSION_ID) -> HistoryEntry:
+        """
+        取得重新產生回應時要回覆的使用者訊息（目前分支最後一則使用者訊息）
+
+        Args:
+            session_id: 對話 session ID
+
+        Returns:
+            HistoryEntry: 使用者訊息
+
+        Raises:
+            ValueError: 目前分支沒有可重新產生回應的使用者訊息
+        """
+        head = self.store.get_head(session_id)
+        entry = self.store.get_message(session_id, head) if head is not None else None
+        if entry is not None and entry.role == MessageRole.ASSISTANT and entry.parent_id is not None:
+            entry = self.store.get_message(session_id, entry.parent_id)
+        if entry is None or entry.role != MessageRole.USER:
+            raise ValueError("目前分支沒有可重新產生回應的使用者訊息")
+        return entry
+
+    def fork_history(self, message_id: Optional[int], session_id: str = DEFAULT_SESSION_ID) -> list[HistoryEntry]:
+        """
+        在指定訊息之後建立新分支：之後送出的訊息接在此訊息之後，原本的後續訊息保留在舊分支
+
+        編輯訊息時在該訊息的父訊息建立分支，再送出修改後的內容
+
+        Args:
+            message_id: 分支點的訊息 ID，None 表示從第一則訊息之前開始
+            session_id: 對話 session ID
+
+        Returns:
+            list[HistoryEntry]: 新分支目前的歷史
+
+        Raises:
+            ValueError: 訊息不存在
+        """
+        self.store.set_head(session_id, message_id)
+        return self.store.get_messages(session_id)
+
+    def switch_branch(self, message_id: int, session_id: str = DEFAULT_SESSION_ID) -> list[HistoryEntry]:
+        """
+        切換到經過指定訊息的分支（有多個分支時選擇最新的一個）
+
+        Args:
+            message_id: 分支上的任一訊息 ID（通常為 list_branches 回傳的最後一筆）
+            session_id: 對話 session ID
+
+        Returns:
+            list[HistoryEntry]: 切換後的歷史
+
+        Raises:
+            ValueError: 訊息不存在
+        """
+        if self.store.get_message(session_id, message_id) is None:
+            raise ValueError(f"訊息不存在: {message_id}")
+        # 由最新的分支往回找，第一個經過此訊息的分支即為目標
+        for leaf in reversed(self.store.list_leaves(session_id)):
+            entry = leaf
+            while entry is not None and entry.id > message_id:
+                entry = self.store.get_message(session_id, entry.parent_id) if entry.parent_id is not None else None
+            if entry is not None and entry.id == message_id:
+                self.store.set_head(session_id, leaf.id)
+                break
+        return self.store.get_messages(session_id)
+
+    def list_branches(self, session_id: str = DEFAULT_SESSION_ID) -> tuple[Optional[int], list[HistoryEntry]]:
+        """
+        列出 session 的所有分支
+
+        Args:
+            session_id: 對話 session ID
+
+        Returns:
+            tuple[Optional[int], list[HistoryEntry]]: (目前的 head, 各分支的最後一筆訊息)
+        """
+        return self.store.get_head(session_id), self.store.list_leaves(session_id)
 
     def add_message(
-        self, role: MessageRole, content: str
+        self, role: MessageRole, content: str, session_id: str = DEFAULT_SESSION_ID
     ) -> ChatMessage:
         """
         手動添加訊息到歷史
@@ -159,14 +714,21 @@ class OpenAIService:
         Args:
             role: 訊息角色（user 或 assistant）
             content: 訊息內容
+            session_id: 對話 session ID
 
         Returns:
             ChatMessage: 新建的訊息物件
         """
-        message = ChatMessage(role=role, content=content)
-        self._message_history.append(message)
-        return message
+        entry = self.store.append_message(session_id, HistoryEntry(role, content))
+        return entry.to_message()
 
 
-# 全域單例實例
-openai_service = OpenAIService()
+@lru_cache
+def get_openai_service() -> OpenAIService:
+    """
+    取得全域 OpenAI 服務（第一次呼叫時才建立，可作為 FastAPI dependency）
+
+    Returns:
+        OpenAIService: 全域單例實例
+    """
+    return OpenAIService(get_state_store())
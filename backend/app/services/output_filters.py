@@ -0,0 +1,296 @@
+"""
+模型輸出的串流過濾
+
+模型回應在寫入歷史與送出 SSE 之前依序經過各過濾階段（ChunkFilter）；
+內建的 RedactionFilter 以 Aho-Corasick 自動機逐字比對多個字串，
+狀態跨片段保留，只暫留可能成為比對開頭的最後幾個字元，因此每個片段的成本只與片段長度有關
+各階段的耗時以 perf_counter_ns 累計，串流結束時寫入 metrics
+"""
+import re
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from app.core.config import get_settings
+from app.core.metrics import metrics
+
+
+# 自動加入遮蔽的伺服器密鑰最短長度
+MIN_SECRET_LENGTH = 8
+
+REDACTIONS = metrics.counter("chat_output_redactions_total", "輸出中被遮蔽的片段數")
+FILTER_SECONDS = metrics.counter(
+    "chat_output_filter_seconds_total", "各過濾階段累計耗時", ("stage",)
+)
+FILTER_CHUNK_SECONDS = metrics.histogram(
+    "chat_output_filter_chunk_seconds", "各過濾階段每個片段的平均耗時（每個串流記錄一次）", ("stage",),
+    buckets=(1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 1e-3, 1e-2)
+)
+
+
+class AhoCorasick:
+    """
+    多字串比對自動機（建立後不可變，可由多個串流共用）
+
+    Attributes:
+        goto: 各節點的轉移表
+        fail: 各節點的失敗連結
+        depth: 各節點代表的前綴長度
+        match_len: 在各節點結束的最長比對長度（0 表示沒有比對）
+    """
+
+    def __init__(self, patterns: Iterable[str], ignore_case: bool = False):
+        """
+        Args:
+            patterns: 要比對的字串（空字串會被忽略）
+            ignore_case: 是否忽略大小寫
+        """
+        self.ignore_case = ignore_case
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail = [0]
+        self.depth = [0]
+        self.match_len = [0]
+        self.patterns = sorted({self.fold(p) for p in patterns if p})
+
+        for pattern in self.patterns:
+            node = 0
+            for ch in pattern:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.depth.append(self.depth[node] + 1)
+                    self.match_len.append(0)
+                node = nxt
+            self.match_len[node] = len(pattern)
+
+        # 以 BFS 建立失敗連結；節點的最長比對也涵蓋其失敗連結上的比對
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                if node:
+                    fallback = self.fail[node]
+                    while fallback and ch not in self.goto[fallback]:
+                        fallback = self.fail[fallback]
+                    self.fail[nxt] = self.goto[fallback].get(ch, 0)
+                self.match_len[nxt] = max(self.match_len[nxt], self.match_len[self.fail[nxt]])
+                queue.append(nxt)
+
+        # 在根節點時，以正規表示式跳到下一個可能開始比對的字元（於 C 中掃描）
+        starts = "".join(re.escape(ch) for ch in self.goto[0])
+        self.start_re = re.compile(f"[{starts}]") if starts else None
+
+    def fold(self, text: str) -> str:
+        """比對前的正規化（忽略大小寫時以 casefold 轉換，長度改變的字元保持原樣）"""
+        if not self.ignore_case:
+            return text
+        folded = text.casefold()
+        if len(folded) == len(text):
+            return folded
+        return "".join(ch if len(ch.casefold()) != 1 else ch.casefold() for ch in text)
+
+    def step(self, node: int, ch: str) -> int:
+        """由節點讀入一個（已正規化的）字元後的節點"""
+        while True:
+            nxt = self.goto[node].get(ch)
+            if nxt is not None:
+                return nxt
+            if node == 0:
+                return 0
+            node = self.fail[node]
+
+
+class ChunkFilter:
+    """串流過濾階段基礎類別（每個串流一個實例，可保留跨片段狀態）"""
+
+    name = "filter"
+
+    def feed(self, chunk: str) -> str:
+        """
+        處理一個片段
+
+        Args:
+            chunk: 上一階段的輸出
+
+        Returns:
+            str: 可以送往下一階段的文字（可能為空字串，表示暫留）
+        """
+        raise NotImplementedError
+
+    def flush(self) -> str:
+        """串流結束時送出暫留的文字"""
+        return ""
+
+
+class RedactionFilter(ChunkFilter):
+    """
+    以 Aho-Corasick 自動機遮蔽指定字串
+
+    重疊的比對合併為一段遮蔽；比對只可能涵蓋自動機目前深度內的字元，
+    因此只暫留最後 depth 個字元，其餘立即送出
+    """
+
+    name = "redact"
+
+    def __init__(self, automaton: AhoCorasick, replacement: str = "[REDACTED]"):
+        """
+        Args:
+            automaton: 共用的比對自動機
+            replacement: 每段遮蔽輸出的文字
+        """
+        self.automaton = automaton
+        self.replacement = replacement
+        self._node = 0
+        self._pending = ""  # 尚未送出的原始文字
+        self._base = 0  # _pending[0] 的絕對位置
+        self._pos = 0  # 已讀入的字元數
+        self._spans: deque[list[int]] = deque()  # 待遮蔽的 [start, end)（絕對位置，已合併重疊）
+        self._replacing = False  # 目前這段遮蔽的替代文字是否已送出
+
+    def feed(self, chunk: str) -> str:
+        automaton = self.automaton
+        folded = automaton.fold(chunk)
+        node = self._node
+        i, length = 0, len(folded)
+        while i < length:
+            if node == 0:
+                # 不在任何前綴中：跳過不可能開始比對的字元
+                if automaton.start_re is None:
+                    break
+                found = automaton.start_re.search(folded, i)
+                if found is None:
+                    break
+                i = found.start()
+            node = automaton.step(node, folded[i])
+            i += 1
+            matched = automaton.match_len[node]
+            if matched:
+                end = self._pos + i
+                start = end - matched
+                # 與之前重疊的遮蔽段合併（較長的比對可能涵蓋多段較短的比對）
+                while self._spans and start < self._spans[-1][1]:
+                    start = min(start, self._spans.pop()[0])
+                self._spans.append([start, end])
+        self._node = node
+        self._pending += chunk
+        self._pos += len(chunk)
+        return self._emit(self._pos - automaton.depth[node])
+
+    def flush(self) -> str:
+        self._node = 0
+        return self._emit(self._pos)
+
+    def _emit(self, safe_end: int) -> str:
+        """送出 safe_end 之前的文字（之後的字元仍可能成為比對的一部分）"""
+        out = []
+        position = self._base
+        while position < safe_end:
+            if self._spans and self._spans[0][0] <= position:
+                start, end = self._spans[0]
+                if not self._replacing:
+                    out.append(self.replacement)
+                    self._replacing = True
+                    REDACTIONS.inc()
+                position = min(end, safe_end)
+                if position == end:
+                    self._spans.popleft()
+                    self._replacing = False
+            else:
+                stop = min(self._spans[0][0], safe_end) if self._spans else safe_end
+                out.append(self._pending[position - self._base:stop - self._base])
+                position = stop
+        if position > self._base:
+            self._pending = self._pending[position - self._base:]
+            self._base = position
+        return "".join(out)
+
+
+class ChunkPipeline:
+    """依序套用多個過濾階段，並累計各階段耗時"""
+
+    def __init__(self, stages: Iterable[ChunkFilter]):
+        """
+        Args:
+            stages: 過濾階段（依序套用）
+        """
+        self.stages = list(stages)
+        self.elapsed_ns = [0] * len(self.stages)
+        self.chunks = 0
+
+    def feed(self, chunk: str) -> str:
+        """
+        將片段依序送過所有階段
+
+        Args:
+            chunk: 模型輸出的片段
+
+        Returns:
+            str: 過濾後可送出的文字（可能為空字串）
+        """
+        self.chunks += 1
+        for index, stage in enumerate(self.stages):
+            if not chunk:
+                break
+            started = time.perf_counter_ns()
+            chunk = stage.feed(chunk)
+            self.elapsed_ns[index] += time.perf_counter_ns() - started
+        return chunk
+
+    def flush(self) -> str:
+        """
+        串流結束：依序送出各階段暫留的文字，並記錄各階段耗時
+
+        Returns:
+            str: 剩餘的過濾後文字
+        """
+        tail = ""
+        for index, stage in enumerate(self.stages):
+            started = time.perf_counter_ns()
+            tail = (stage.feed(tail) if tail else "") + stage.flush()
+            self.elapsed_ns[index] += time.perf_counter_ns() - started
+        for stage, elapsed in zip(self.stages, self.elapsed_ns):
+            FILTER_SECONDS.inc(elapsed / 1e9, stage=stage.name)
+            FILTER_CHUNK_SECONDS.observe(elapsed / 1e9 / max(self.chunks, 1), stage=stage.name)
+        return tail
+
+    def stage_timings(self) -> dict[str, float]:
+        """各階段目前累計的耗時（微秒）"""
+        return {stage.name: elapsed / 1000 for stage, elapsed in zip(self.stages, self.elapsed_ns)}
+
+
+@lru_cache
+def get_redaction_automaton() -> Optional[AhoCorasick]:
+    """
+    取得依設定建立的遮蔽自動機（每個 worker 建立一次）
+
+    比對字串為 OUTPUT_REDACT_TERMS，OUTPUT_REDACT_SECRETS 開啟時另加入伺服器的 API key 與 ADMIN_TOKEN
+
+    Returns:
+        Optional[AhoCorasick]: 自動機，沒有任何比對字串時為 None
+    """
+    settings = get_settings()
+    patterns = [term.strip() for term in settings.OUTPUT_REDACT_TERMS.split(",") if term.strip()]
+    if settings.OUTPUT_REDACT_SECRETS:
+        # 過短的值（例如測試用的假 key）容易誤遮一般文字，不加入比對
+        secrets = [*settings.api_keys, settings.ADMIN_TOKEN]
+        patterns.extend(secret for secret in secrets if len(secret) >= MIN_SECRET_LENGTH)
+    automaton = AhoCorasick(patterns, ignore_case=settings.OUTPUT_REDACT_IGNORE_CASE)
+    return automaton if automaton.patterns else None
+
+
+def build_output_pipeline() -> Optional[ChunkPipeline]:
+    """
+    為一個串流建立輸出過濾管線（各階段保有該串流的狀態）
+
+    Returns:
+        Optional[ChunkPipeline]: 過濾管線，沒有任何啟用的階段時為 None
+    """
+    stages: list[ChunkFilter] = []
+    automaton = get_redaction_automaton()
+    if automaton is not None:
+        stages.append(RedactionFilter(automaton, get_settings().OUTPUT_REDACT_REPLACEMENT))
+    return ChunkPipeline(stages) if stages else None
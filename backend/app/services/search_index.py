@@ -0,0 +1,202 @@
+"""
+對話內容全文檢索
+
+- tokenize: 英數字以單字切分，中日韓文字以字元 unigram + bigram 切分（無需斷詞字典）
+- InvertedIndex: 寫入時增量維護的倒排索引，以 BM25 排序（記憶體後端使用）
+SQLite 後端使用相同的 tokenize 結果寫入 FTS5 表，排序一致
+"""
+import heapq
+import math
+import re
+from typing import Iterable, Optional
+
+# 中日韓文字（平假名、片假名、CJK 統一表意文字及擴充 A、相容表意文字、韓文音節）
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_TOKEN_RE = re.compile(rf"[{_CJK}]+|[^\W{_CJK}]+")
+_CJK_RE = re.compile(rf"[{_CJK}]")
+
+# BM25 參數
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def _is_cjk(text: str) -> bool:
+    """判斷字串是否為中日韓文字片段"""
+    return bool(_CJK_RE.match(text))
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    將內容切分為索引用 token
+
+    中日韓文字片段同時產生 unigram 與 bigram，讓單字查詢與多字查詢都能命中
+
+    Args:
+        text: 原始內容
+
+    Returns:
+        list[str]: token 列表（可重複，用於計算詞頻）
+    """
+    tokens: list[str] = []
+    for run in _TOKEN_RE.findall(text.lower()):
+        if _is_cjk(run):
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def tokenize_query(query: str) -> list[str]:
+    """
+    將查詢字串切分為 token（不重複）
+
+    中日韓文字片段長度 ≥ 2 時只使用 bigram（精確度較高），單一字元時使用 unigram
+
+    Args:
+        query: 查詢字串
+
+    Returns:
+        list[str]: 查詢 token（所有 token 皆須命中）
+    """
+    tokens: list[str] = []
+    for run in _TOKEN_RE.findall(query.lower()):
+        if _is_cjk(run) and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return list(dict.fromkeys(tokens))
+
+
+def make_snippet(content: str, query: str, width: int = 120) -> str:
+    """
+    擷取內容中第一個命中詞附近的片段
+
+    Args:
+        content: 訊息內容
+        query: 查詢字串
+        width: 片段長度上限
+
+    Returns:
+        str: 內容片段（必要時前後加上省略號）
+    """
+    if len(content) <= width:
+        return content
+    lowered = content.lower()
+    positions = [lowered.find(term) for term in _TOKEN_RE.findall(query.lower())]
+    hit = min((p for p in positions if p >= 0), default=0)
+    start = max(0, min(hit - width // 3, len(content) - width))
+    snippet = content[start:start + width]
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if start + width < len(content) else ""
+    return f"{prefix}{snippet}{suffix}"
+
+
+class InvertedIndex:
+    """
+    增量維護的倒排索引
+
+    每筆文件（訊息）寫入時即更新 posting list，刪除時依保存的 term 列表移除；
+    查詢為 AND 語意，以 BM25 排序
+    """
+
+    def __init__(self):
+        """初始化索引結構"""
+        self._postings: dict[str, dict[int, int]] = {}  # term -> {doc_id: 詞頻}
+        self._doc_terms: dict[int, tuple[str, ...]] = {}  # doc_id -> 不重複 term
+        self._doc_length: dict[int, int] = {}
+        self._doc_group: dict[int, str] = {}  # doc_id -> session_id
+        self._total_length = 0
+
+    def add(self, doc_id: int, group: str, text: str) -> None:
+        """
+        索引一筆文件
+
+        Args:
+            doc_id: 文件 ID（訊息 ID）
+            group: 文件分組（session ID），供查詢時過濾
+            text: 文件內容
+        """
+        tokens = tokenize(text)
+        frequencies: dict[str, int] = {}
+        for token in tokens:
+            frequencies[token] = frequencies.get(token, 0) + 1
+        for term, tf in frequencies.items():
+            self._postings.setdefault(term, {})[doc_id] = tf
+        self._doc_terms[doc_id] = tuple(frequencies)
+        self._doc_length[doc_id] = len(tokens)
+        self._doc_group[doc_id] = group
+        self._total_length += len(tokens)
+
+    def remove(self, doc_id: int) -> None:
+        """
+        從索引移除一筆文件
+
+        Args:
+            doc_id: 文件 ID
+        """
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self._postings[term]
+        self._total_length -= self._doc_length.pop(doc_id)
+        del self._doc_group[doc_id]
+
+    def search(
+        self,
+        terms: Iterable[str],
+        group: Optional[str] = None,
+        limit: int = 20,
+        offset: int = 0
+    ) -> tuple[int, list[tuple[int, float]]]:
+        """
+        查詢包含所有 term 的文件
+
+        Args:
+            terms: 查詢 token（tokenize_query 的結果）
+            group: 僅查詢指定分組，None 表示全部
+            limit: 回傳筆數
+            offset: 略過筆數
+
+        Returns:
+            tuple[int, list[tuple[int, float]]]: (命中總數, [(doc_id, 分數)]，依分數遞減)
+        """
+        postings = [self._postings.get(term) for term in terms]
+        if not postings or any(p is None for p in postings):
+            return 0, []
+
+        # 由最短的 posting list 開始取交集
+        postings.sort(key=len)
+        candidates = [
+            doc_id for doc_id in postings[0]
+            if all(doc_id in p for p in postings[1:])
+            and (group is None or self._doc_group[doc_id] == group)
+        ]
+        if not candidates:
+            return 0, []
+
+        doc_count = len(self._doc_length)
+        avg_length = self._total_length / doc_count if doc_count else 0.0
+        idf = [
+            math.log(1 + (doc_count - len(p) + 0.5) / (len(p) + 0.5))
+            for p in postings
+        ]
+
+        def score(doc_id: int) -> float:
+            length_norm = 1 - BM25_B + BM25_B * (self._doc_length[doc_id] / avg_length if avg_length else 0)
+            total = 0.0
+            for weight, posting in zip(idf, postings):
+                tf = posting[doc_id]
+                total += weight * tf * (BM25_K1 + 1) / (tf + BM25_K1 * length_norm)
+            return total
+
+        top = heapq.nlargest(
+            offset + limit,
+            ((score(doc_id), doc_id) for doc_id in candidates)
+        )
+        return len(candidates), [(doc_id, s) for s, doc_id in top[offset:]]
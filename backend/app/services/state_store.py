@@ -0,0 +1,848 @@
+"""
+State Store 模組
+
+集中管理所有跨請求共享的狀態：對話歷史（依 session 區分）、模型目錄快取、速率限制桶
+
+對話歷史為樹狀結構（copy-on-write）：每筆訊息指向父訊息，每個 session 記錄目前分支的最後一筆（head）；
+分支、重新產生與編輯只新增節點並移動 head，各分支共用相同的前綴，不複製任何訊息
+- MemoryStateStore: 單一程序內的記憶體實作（開發模式預設）
+- SQLiteStateStore: 以 SQLite（WAL 模式）作為跨程序後端，供多 worker 部署共用
+
+async 程式碼透過 StateStore.run() 存取：SQLite 的操作可能等待其他 worker 的寫入鎖，改在 thread 中執行，不阻塞 event loop
+"""
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, Optional, TypeVar
+
+from app.core.config import get_settings
+from app.schemas.chat import MessageRole
+from app.services.history import ContentPool, HistoryEntry
+from app.services.search_index import InvertedIndex, tokenize, tokenize_query
+
+
+# 搜尋結果：(session_id, 訊息, 相關度分數)
+SearchHit = tuple[str, HistoryEntry, float]
+
+# 匯出 / 匯入用的訊息：(session_id, 訊息)
+SessionEntry = tuple[str, HistoryEntry]
+
+# 快取的預設筆數上限（超過時淘汰最久未使用 / 最早寫入的項目）
+DEFAULT_CACHE_MAX_ENTRIES = 10000
+
+# SQLite 每寫入幾次快取清理一次過期與超過上限的資料列
+_CACHE_PURGE_INTERVAL = 100
+
+# 結構遷移與批次匯入等待寫入鎖的時間（毫秒）；一般請求使用較短的 STATE_SQLITE_BUSY_TIMEOUT_MS
+_BULK_BUSY_TIMEOUT_MS = 30000
+
+T = TypeVar("T")
+
+
+class StateStore(ABC):
+    """
+    共享狀態儲存介面
+
+    所有方法皆為同步且不阻塞於網路 I/O，可直接在 async endpoint 中呼叫
+    """
+
+    # ---------- 對話歷史 ----------
+
+    @abstractmethod
+    def append_message(self, session_id: str, entry: HistoryEntry) -> HistoryEntry:
+        """新增一筆訊息到指定 session 目前的分支（成為 head 的子訊息，並成為新的 head）"""
+
+    @abstractmethod
+    def get_messages(self, session_id: str) -> list[HistoryEntry]:
+        """取得指定 session 目前分支的歷史（由第一筆沿父訊息走到 head）"""
+
+    @abstractmethod
+    def branch_stats(self, session_id: str) -> tuple[int, int]:
+        """
+        取得指定 session 目前分支的長度（不載入訊息內容）
+
+        Returns:
+            tuple[int, int]: (訊息數, 內容總字元數)
+        """
+
+    @abstractmethod
+    def pop_message(self, session_id: str) -> Optional[HistoryEntry]:
+        """
+        移除並回傳指定 session 目前分支的最後一筆訊息（head 移回其父訊息）
+
+        該訊息已有其他分支延伸時只移動 head，不刪除訊息
+        """
+
+    @abstractmethod
+    def clear_messages(self, session_id: str) -> None:
+        """清除指定 session 的歷史（包含所有分支）"""
+
+    @abstractmethod
+    def get_message(self, session_id: str, message_id: int) -> Optional[HistoryEntry]:
+        """取得指定 session 中的單筆訊息（不存在或屬於其他 session 時回傳 None）"""
+
+    @abstractmethod
+    def get_head(self, session_id: str) -> Optional[int]:
+        """取得指定 session 目前分支最後一筆訊息的 ID（空的分支為 None）"""
+
+    @abstractmethod
+    def set_head(self, session_id: str, message_id: Optional[int]) -> None:
+        """
+        移動 head（切換或建立分支）；之後新增的訊息接在此訊息之後
+
+        Args:
+            session_id: 對話 session ID
+            message_id: 新的 head，None 表示從頭開始一個新分支
+
+        Raises:
+            ValueError: 訊息不存在或不屬於此 session
+        """
+
+    @abstractmethod
+    def list_leaves(self, session_id: str) -> list[HistoryEntry]:
+        """取得指定 session 所有分支的最後一筆訊息（沒有子訊息者，依 ID 排序）"""
+
+    @abstractmethod
+    def iter_messages(
+        self, session_id: Optional[str] = None, batch_size: int = 1000
+    ) -> Iterator[SessionEntry]:
+        """
+        依訊息 ID 順序逐筆讀取訊息，包含所有分支（分批讀取，不一次載入全部）
+
+        Args:
+            session_id: 僅讀取指定 session，None 表示全部
+            batch_size: 每批讀取筆數
+
+        Yields:
+            SessionEntry: (session_id, 訊息)
+        """
+
+    def append_messages(
+        self, items: Iterable[SessionEntry], id_map: Optional[dict[int, int]] = None
+    ) -> int:
+        """
+        批次新增訊息（訊息 ID 重新指派，保留原本的時間戳記）
+
+        Args:
+            items: (session_id, 訊息) 序列
+            id_map: 原訊息 ID -> 新 ID（跨批次共用以保留分支結構，None 表示依序接在 head 之後）
+
+        Returns:
+            int: 新增筆數
+        """
+        count = 0
+        for session_id, entry in items:
+            original_id, parent_id = entry.id, _resolve_parent(entry, id_map)
+            if parent_id is not _HEAD:
+                self.set_head(session_id, parent_id)
+            self.append_message(session_id, entry)
+            if id_map is not None and original_id is not None:
+                id_map[original_id] = entry.id
+            count += 1
+        return count
+
+    @abstractmethod
+    def search_messages(
+        self, query: str, session_id: Optional[str] = None, limit: int = 20, offset: int = 0
+    ) -> tuple[int, list[SearchHit]]:
+        """
+        全文檢索訊息內容（訊息寫入時即已建立索引）
+
+        Args:
+            query: 查詢字串（所有詞皆須命中）
+            session_id: 僅搜尋指定 session，None 表示全部
+            limit: 回傳筆數
+            offset: 略過筆數
+
+        Returns:
+            tuple[int, list[SearchHit]]: (命中總數, 依相關度排序的結果)
+        """
+
+    # ---------- 快取 ----------
+
+    @abstractmethod
+    def cache_get(self, key: str) -> Optional[Any]:
+        """取得快取值（已過期視為不存在）"""
+
+    @abstractmethod
+    def cache_set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """寫入快取值（value 必須可 JSON 序列化，ttl 為秒數，None 表示不過期）"""
+
+    @abstractmethod
+    def cache_delete(self, key: str) -> None:
+        """刪除快取值（不存在時無動作）"""
+
+    # ---------- 速率限制 ----------
+
+    @abstractmethod
+    def consume_token(
+        self, bucket: str, capacity: float, refill_per_second: float, cost: float = 1.0
+    ) -> tuple[bool, float]:
+        """
+        Token bucket 扣除額度
+
+        Args:
+            bucket: 桶識別字串（例如 "send:127.0.0.1"）
+            capacity: 桶容量（允許的突發請求數）
+            refill_per_second: 每秒補充的 token 數
+            cost: 本次請求消耗的 token 數
+
+        Returns:
+            tuple[bool, float]: (是否允許, 若拒絕則建議等待秒數)
+        """
+
+    async def run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        在 async 程式碼中執行會存取本儲存的同步函式
+
+        預設直接呼叫（記憶體操作不會阻塞）；可能阻塞的後端覆寫為在 thread 中執行
+
+        Args:
+            func: 同步函式（本儲存的方法，或內部呼叫本儲存方法的函式）
+            *args: 位置參數
+            **kwargs: 關鍵字參數
+
+        Returns:
+            func 的回傳值
+        """
+        return func(*args, **kwargs)
+
+    def close(self) -> None:
+        """釋放資源（預設無動作）"""
+
+
+# _resolve_parent 的回傳值：接在 session 目前的 head 之後
+_HEAD = object()
+
+
+def _resolve_parent(entry: HistoryEntry, id_map: Optional[dict[int, int]]):
+    """
+    決定匯入訊息的父訊息
+
+    有原 ID 的訊息依 id_map 對應父訊息（parent_id 為 None 表示分支的第一筆）；
+    沒有原 ID（舊版匯出）或父訊息不在本次匯入中時接在 head 之後
+
+    Returns:
+        新的父訊息 ID、None（分支的第一筆）或 _HEAD
+    """
+    if id_map is None or entry.id is None:
+        return _HEAD
+    if entry.parent_id is None:
+        return None
+    return id_map.get(entry.parent_id, _HEAD)
+
+
+def _refill(
+    tokens: float, updated_at: float, now: float, capacity: float, refill_per_second: float
+) -> float:
+    """計算補充後的 token 數"""
+    return min(capacity, tokens + (now - updated_at) * refill_per_second)
+
+
+def _retry_after(tokens: float, cost: float, refill_per_second: float) -> float:
+    """計算距離足夠 token 的等待秒數"""
+    if refill_per_second <= 0:
+        return 60.0
+    return max(0.0, (cost - tokens) / refill_per_second)
+
+
+class MemoryStateStore(StateStore):
+    """
+    記憶體狀態儲存
+
+    僅在單一程序內有效，多 worker 部署時每個 worker 各自擁有一份；
+    歷史以 HistoryEntry 儲存，重複內容經由 ContentPool 共用，並同步維護倒排索引；
+    分支只以 parent_id 串接，讀取目前分支時沿父訊息走回第一筆
+    """
+
+    def __init__(self, cache_max_entries: int = DEFAULT_CACHE_MAX_ENTRIES):
+        """
+        初始化記憶體結構
+
+        Args:
+            cache_max_entries: 快取筆數上限（LRU 淘汰）
+        """
+        self._sessions: dict[str, list[HistoryEntry]] = {}  # session -> 所有分支的訊息（依 ID 排序）
+        self._heads: dict[str, Optional[int]] = {}
+        self._children: dict[int, int] = {}  # 訊息 ID -> 子訊息數
+        self._contents = ContentPool()
+        self._index = InvertedIndex()
+        self._entries: dict[int, tuple[str, HistoryEntry]] = {}  # 訊息 ID -> (session_id, 訊息)
+        self._next_id = 1
+        self._cache: OrderedDict[str, tuple[Any, Optional[float]]] = OrderedDict()
+        self._cache_max_entries = cache_max_entries
+        self._buckets: dict[str, tuple[float, float]] = {}
+
+    def append_message(self, session_id: str, entry: HistoryEntry) -> HistoryEntry:
+        entry.id = self._next_id
+        self._next_id += 1
+        entry.parent_id = self._heads.get(session_id)
+        entry.content = self._contents.acquire(entry.content)
+        self._sessions.setdefault(session_id, []).append(entry)
+        self._entries[entry.id] = (session_id, entry)
+        if entry.parent_id is not None:
+            self._children[entry.parent_id] = self._children.get(entry.parent_id, 0) + 1
+        self._heads[session_id] = entry.id
+        self._index.add(entry.id, session_id, entry.content)
+        return entry
+
+    def _forget(self, entry: HistoryEntry) -> None:
+        """釋放訊息佔用的內容池引用與索引"""
+        self._contents.release(entry.content)
+        self._index.remove(entry.id)
+        self._entries.pop(entry.id, None)
+        self._children.pop(entry.id, None)
+
+    def get_messages(self, session_id: str) -> list[HistoryEntry]:
+        path = []
+        message_id = self._heads.get(session_id)
+        while message_id is not None:
+            entry = self._entries[message_id][1]
+            path.append(entry)
+            message_id = entry.parent_id
+        path.reverse()
+        return path
+
+    def branch_stats(self, session_id: str) -> tuple[int, int]:
+        count = chars = 0
+        message_id = self._heads.get(session_id)
+        while message_id is not None:
+            entry = self._entries[message_id][1]
+            count += 1
+            chars += len(entry.content)
+            message_id = entry.parent_id
+        return count, chars
+
+    def pop_message(self, session_id: str) -> Optional[HistoryEntry]:
+        head = self._heads.get(session_id)
+        if head is None:
+            return None
+        entry = self._entries[head][1]
+        self._heads[session_id] = entry.parent_id
+        if self._children.get(head):
+            return entry
+        if entry.parent_id is not None:
+            self._children[entry.parent_id] -= 1
+        history = self._sessions[session_id]
+        # head 通常是最新的一筆
+        if history[-1] is entry:
+            history.pop()
+        else:
+            history.remove(entry)
+        self._forget(entry)
+        return entry
+
+    def clear_messages(self, session_id: str) -> None:
+        self._heads.pop(session_id, None)
+        for entry in self._sessions.pop(session_id, ()):
+            self._forget(entry)
+
+    def get_message(self, session_id: str, message_id: int) -> Optional[HistoryEntry]:
+        owner, entry = self._entries.get(message_id, (None, None))
+        return entry if owner == session_id else None
+
+    def get_head(self, session_id: str) -> Optional[int]:
+        return self._heads.get(session_id)
+
+    def set_head(self, session_id: str, message_id: Optional[int]) -> None:
+        if message_id is not None and self.get_message(session_id, message_id) is None:
+            raise ValueError(f"訊息不存在: {message_id}")
+        self._heads[session_id] = message_id
+
+    def list_leaves(self, session_id: str) -> list[HistoryEntry]:
+        return [entry for entry in self._sessions.get(session_id, ()) if not self._children.get(entry.id)]
+
+    def iter_messages(
+        self, session_id: Optional[str] = None, batch_size: int = 1000
+    ) -> Iterator[SessionEntry]:
+        if session_id is not None:
+            for entry in list(self._sessions.get(session_id, ())):
+                yield session_id, entry
+            return
+        # _entries 依 ID 遞增的插入順序排列；只複製參照，不複製內容
+        yield from list(self._entries.values())
+
+    def search_messages(
+        self, query: str, session_id: Optional[str] = None, limit: int = 20, offset: int = 0
+    ) -> tuple[int, list[SearchHit]]:
+        total, ranked = self._index.search(tokenize_query(query), session_id, limit, offset)
+        hits = []
+        for doc_id, score in ranked:
+            owner, entry = self._entries[doc_id]
+            hits.append((owner, entry, score))
+        return total, hits
+
+    def cache_get(self, key: str) -> Optional[Any]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return value
+
+    def cache_set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + ttl if ttl is not None else None
+        self._cache[key] = (value, expires_at)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._cache_max_entries:
+            self._cache.popitem(last=False)
+
+    def cache_delete(self, key: str) -> None:
+        self._cache.pop(key, None)
+
+    def consume_token(
+        self, bucket: str, capacity: float, refill_per_second: float, cost: float = 1.0
+    ) -> tuple[bool, float]:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(bucket, (capacity, now))
+        tokens = _refill(tokens, updated_at, now, capacity, refill_per_second)
+        if tokens >= cost:
+            self._buckets[bucket] = (tokens - cost, now)
+            return True, 0.0
+        self._buckets[bucket] = (tokens, now)
+        return False, _retry_after(tokens, cost, refill_per_second)
+
+
+class SQLiteStateStore(StateStore):
+    """
+    SQLite 狀態儲存
+
+    多個 worker 程序開啟同一個資料庫檔案，以 WAL 模式允許並行讀取，
+    寫入由 SQLite 的檔案鎖序列化；每個程序持有一條連線
+    各 session 的 head 存放於 heads 表，目前分支以遞迴 CTE 沿 parent_id 讀取
+    結構版本記錄於 PRAGMA user_version，遷移只在版本落後時執行一次
+    """
+
+    # 目前的結構版本（1: 分支欄位 parent_id，2: 全文檢索索引補建）
+    _SCHEMA_VERSION = 2
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            parent_id INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id, id);
+        CREATE TABLE IF NOT EXISTS heads (
+            session_id TEXT PRIMARY KEY,
+            message_id INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS cache (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            expires_at REAL
+        );
+        CREATE TABLE IF NOT EXISTS rate_buckets (
+            bucket TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        -- 全文檢索：rowid 對應 messages.id，tokens 為 tokenize() 以空白串接的結果
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(tokens);
+    """
+
+    def __init__(
+        self, path: str, cache_max_entries: int = DEFAULT_CACHE_MAX_ENTRIES, busy_timeout_ms: int = 1000
+    ):
+        """
+        開啟（必要時建立）SQLite 資料庫
+
+        Args:
+            path: 資料庫檔案路徑，":memory:" 表示僅供測試的記憶體資料庫
+            cache_max_entries: 快取筆數上限（定期刪除過期與最早寫入的資料列）
+            busy_timeout_ms: 一般操作等待其他 worker 寫入鎖的上限（毫秒），逾時拋出 sqlite3.OperationalError
+        """
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._cache_max_entries = cache_max_entries
+        self._cache_writes = 0
+        self._busy_timeout_ms = busy_timeout_ms
+        # isolation_level=None：自動提交，需要原子性時明確使用 BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(
+            path, timeout=_BULK_BUSY_TIMEOUT_MS / 1000, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self._SCHEMA)
+        self._migrate()
+        self._conn.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+
+    @contextmanager
+    def _transaction(self, busy_timeout_ms: Optional[int] = None):
+        """
+        在持有程序內鎖的情況下執行 BEGIN IMMEDIATE 交易
+
+        Args:
+            busy_timeout_ms: 本次交易等待寫入鎖的上限（毫秒），None 表示使用一般操作的設定
+        """
+        with self._lock:
+            if busy_timeout_ms is not None:
+                self._conn.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    yield self._conn
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            finally:
+                if busy_timeout_ms is not None:
+                    self._conn.execute(f"PRAGMA busy_timeout={self._busy_timeout_ms}")
+
+    async def run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        # 等待寫入鎖（或程序內鎖）時只佔用 thread，event loop 上的串流不受影響
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+    def _migrate(self) -> None:
+        """
+        依 PRAGMA user_version 執行尚未套用的遷移（整個遷移在同一個交易內）
+
+        版本在取得寫入鎖之後才讀取：多個 worker 同時啟動時只有第一個執行遷移，其他 worker 看到的已是新版本；
+        已是最新版本時只讀取版本號，不取得寫入鎖
+        """
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] >= self._SCHEMA_VERSION:
+            return
+        with self._transaction() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < 1:
+                self._migrate_branches(conn)
+            if version < 2:
+                self._backfill_search_index(conn)
+            conn.execute(f"PRAGMA user_version={self._SCHEMA_VERSION}")
+
+    @staticmethod
+    def _migrate_branches(conn: sqlite3.Connection) -> None:
+        """為加入分支之前建立的資料庫補上 parent_id 欄位與 head（既有歷史依 ID 順序串成單一分支）"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(messages)")}
+        if "parent_id" not in columns:
+            conn.execute("ALTER TABLE messages ADD COLUMN parent_id INTEGER")
+            conn.execute(
+                "UPDATE messages SET parent_id = (SELECT MAX(p.id) FROM messages p "
+                "WHERE p.session_id = messages.session_id AND p.id < messages.id)"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO heads (session_id, message_id) "
+                "SELECT session_id, MAX(id) FROM messages GROUP BY session_id"
+            )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_parent ON messages(parent_id)")
+
+    @staticmethod
+    def _backfill_search_index(conn: sqlite3.Connection) -> None:
+        """為建立全文檢索表之前寫入的訊息補建索引"""
+        rows = conn.execute(
+            "SELECT id, content FROM messages WHERE id NOT IN (SELECT rowid FROM messages_fts)"
+        ).fetchall()
+        conn.executemany(
+            "INSERT INTO messages_fts (rowid, tokens) VALUES (?, ?)",
+            [(message_id, " ".join(tokenize(content))) for message_id, content in rows]
+        )
+
+    @staticmethod
+    def _row_to_entry(row: tuple) -> HistoryEntry:
+        """將資料列 (id, role, content, timestamp, parent_id) 轉換為 HistoryEntry"""
+        message_id, role, content, timestamp, parent_id = row
+        created_at = datetime.fromisoformat(timestamp).replace(tzinfo=timezone.utc).timestamp()
+        return HistoryEntry(MessageRole(role), content, created_at, id=message_id, parent_id=parent_id)
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, session_id: str, entry: HistoryEntry) -> None:
+        """在交易內寫入一筆訊息（接在 head 之後）並更新 head 與全文檢索"""
+        row = conn.execute("SELECT message_id FROM heads WHERE session_id = ?", (session_id,)).fetchone()
+        entry.parent_id = row[0] if row is not None else None
+        cursor = conn.execute(
+            "INSERT INTO messages (session_id, role, content, timestamp, parent_id) VALUES (?, ?, ?, ?, ?)",
+            (session_id, entry.role.value, entry.content, entry.timestamp.isoformat(), entry.parent_id)
+        )
+        entry.id = cursor.lastrowid
+        conn.execute(
+            "INSERT OR REPLACE INTO heads (session_id, message_id) VALUES (?, ?)", (session_id, entry.id)
+        )
+        conn.execute(
+            "INSERT INTO messages_fts (rowid, tokens) VALUES (?, ?)",
+            (entry.id, " ".join(tokenize(entry.content)))
+        )
+
+    @staticmethod
+    def _check_message(conn: sqlite3.Connection, session_id: str, message_id: Optional[int]) -> None:
+        """確認訊息屬於此 session（None 視為有效）"""
+        if message_id is None:
+            return
+        row = conn.execute(
+            "SELECT 1 FROM messages WHERE id = ? AND session_id = ?", (message_id, session_id)
+        ).fetchone()
+        if row is None:
+            raise ValueError(f"訊息不存在: {message_id}")
+
+    def append_message(self, session_id: str, entry: HistoryEntry) -> HistoryEntry:
+        with self._transaction() as conn:
+            self._insert(conn, session_id, entry)
+        return entry
+
+    def get_messages(self, session_id: str) -> list[HistoryEntry]:
+        # 由 head 沿 parent_id 走回第一筆（每一步都是主鍵查詢）
+        with self._lock:
+            rows = self._conn.execute(
+                "WITH RECURSIVE path(id) AS ("
+                "  SELECT message_id FROM heads WHERE session_id = ? AND message_id IS NOT NULL"
+                "  UNION ALL"
+                "  SELECT m.parent_id FROM messages m JOIN path ON m.id = path.id WHERE m.parent_id IS NOT NULL"
+                ") "
+                "SELECT m.id, m.role, m.content, m.timestamp, m.parent_id "
+                "FROM path JOIN messages m ON m.id = path.id ORDER BY m.id",
+                (session_id,)
+            ).fetchall()
+        return [self._row_to_entry(row) for row in rows]
+
+    def branch_stats(self, session_id: str) -> tuple[int, int]:
+        # 與 get_messages 相同的路徑，只在 SQLite 內彙總（LENGTH 對 TEXT 計算字元數）
+        with self._lock:
+            count, chars = self._conn.execute(
+                "WITH RECURSIVE path(id) AS ("
+                "  SELECT message_id FROM heads WHERE session_id = ? AND message_id IS NOT NULL"
+                "  UNION ALL"
+                "  SELECT m.parent_id FROM messages m JOIN path ON m.id = path.id WHERE m.parent_id IS NOT NULL"
+                ") "
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(m.content)), 0) FROM path JOIN messages m ON m.id = path.id",
+                (session_id,)
+            ).fetchone()
+        return count, chars
+
+    def pop_message(self, session_id: str) -> Optional[HistoryEntry]:
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT m.id, m.role, m.content, m.timestamp, m.parent_id "
+                "FROM heads h JOIN messages m ON m.id = h.message_id WHERE h.session_id = ?",
+                (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE heads SET message_id = ? WHERE session_id = ?", (row[4], session_id))
+            has_children = conn.execute(
+                "SELECT 1 FROM messages WHERE parent_id = ? LIMIT 1", (row[0],)
+            ).fetchone()
+            if has_children is None:
+                conn.execute("DELETE FROM messages WHERE id = ?", (row[0],))
+                conn.execute("DELETE FROM messages_fts WHERE rowid = ?", (row[0],))
+        return self._row_to_entry(row)
+
+    def clear_messages(self, session_id: str) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM messages_fts WHERE rowid IN (SELECT id FROM messages WHERE session_id = ?)",
+                (session_id,)
+            )
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM heads WHERE session_id = ?", (session_id,))
+
+    def get_message(self, session_id: str, message_id: int) -> Optional[HistoryEntry]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, role, content, timestamp, parent_id FROM messages WHERE id = ? AND session_id = ?",
+                (message_id, session_id)
+            ).fetchone()
+        return self._row_to_entry(row) if row is not None else None
+
+    def get_head(self, session_id: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT message_id FROM heads WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def set_head(self, session_id: str, message_id: Optional[int]) -> None:
+        with self._transaction() as conn:
+            self._check_message(conn, session_id, message_id)
+            conn.execute(
+                "INSERT OR REPLACE INTO heads (session_id, message_id) VALUES (?, ?)", (session_id, message_id)
+            )
+
+    def list_leaves(self, session_id: str) -> list[HistoryEntry]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, role, content, timestamp, parent_id FROM messages m "
+                "WHERE session_id = ? AND NOT EXISTS (SELECT 1 FROM messages c WHERE c.parent_id = m.id) "
+                "ORDER BY id",
+                (session_id,)
+            ).fetchall()
+        return [self._row_to_entry(row) for row in rows]
+
+    def iter_messages(
+        self, session_id: Optional[str] = None, batch_size: int = 1000
+    ) -> Iterator[SessionEntry]:
+        # 以 ID 做 keyset 分頁：每批只持有一次鎖，批次之間其他請求仍可寫入
+        session_filter = "AND session_id = ?" if session_id is not None else ""
+        last_id = 0
+        while True:
+            params: tuple = (last_id, session_id) if session_id is not None else (last_id,)
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT session_id, id, role, content, timestamp, parent_id FROM messages "
+                    f"WHERE id > ? {session_filter} ORDER BY id LIMIT ?",
+                    params + (batch_size,)
+                ).fetchall()
+            for row in rows:
+                yield row[0], self._row_to_entry(row[1:])
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][1]
+
+    def append_messages(
+        self, items: Iterable[SessionEntry], id_map: Optional[dict[int, int]] = None
+    ) -> int:
+        # 整批在同一個交易內寫入，避免每筆訊息各自 commit；匯入在 thread 中執行，可等待較久的寫入鎖
+        count = 0
+        with self._transaction(_BULK_BUSY_TIMEOUT_MS) as conn:
+            for session_id, entry in items:
+                original_id, parent_id = entry.id, _resolve_parent(entry, id_map)
+                if parent_id is not _HEAD:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO heads (session_id, message_id) VALUES (?, ?)",
+                        (session_id, parent_id)
+                    )
+                self._insert(conn, session_id, entry)
+                if id_map is not None and original_id is not None:
+                    id_map[original_id] = entry.id
+                count += 1
+        return count
+
+    def search_messages(
+        self, query: str, session_id: Optional[str] = None, limit: int = 20, offset: int = 0
+    ) -> tuple[int, list[SearchHit]]:
+        terms = tokenize_query(query)
+        if not terms:
+            return 0, []
+        # 每個 token 以雙引號包住（內部引號加倍跳脫），以 AND 連接
+        match = " AND ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        session_filter = "AND m.session_id = ?" if session_id is not None else ""
+        params: tuple = (match, session_id) if session_id is not None else (match,)
+
+        with self._lock:
+            total = self._conn.execute(
+                f"SELECT COUNT(*) FROM messages_fts f JOIN messages m ON m.id = f.rowid "
+                f"WHERE messages_fts MATCH ? {session_filter}",
+                params
+            ).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT m.session_id, m.id, m.role, m.content, m.timestamp, m.parent_id, bm25(messages_fts) AS rank "
+                f"FROM messages_fts f JOIN messages m ON m.id = f.rowid "
+                f"WHERE messages_fts MATCH ? {session_filter} "
+                f"ORDER BY rank, m.id DESC LIMIT ? OFFSET ?",
+                params + (limit, offset)
+            ).fetchall()
+        # FTS5 的 bm25() 越小越相關，轉為越大越相關
+        return total, [(row[0], self._row_to_entry(row[1:6]), -row[6]) for row in rows]
+
+    def cache_get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            return None
+        return json.loads(value)
+
+    def cache_set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires_at)
+            )
+            self._cache_writes += 1
+            if self._cache_writes % _CACHE_PURGE_INTERVAL == 0:
+                self._purge_cache()
+
+    def _purge_cache(self) -> None:
+        """刪除過期的快取，並在超過筆數上限時刪除最早寫入的資料列（呼叫端需持有鎖）"""
+        self._conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        # INSERT OR REPLACE 會配置新的 rowid，rowid 越小表示越早寫入
+        self._conn.execute(
+            "DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY rowid "
+            "LIMIT MAX((SELECT COUNT(*) FROM cache) - ?, 0))",
+            (self._cache_max_entries,)
+        )
+
+    def cache_delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def consume_token(
+        self, bucket: str, capacity: float, refill_per_second: float, cost: float = 1.0
+    ) -> tuple[bool, float]:
+        # 跨程序共用的桶使用牆上時間（monotonic 時鐘在不同程序間不可比較）
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM rate_buckets WHERE bucket = ?", (bucket,)
+            ).fetchone()
+            tokens, updated_at = row if row is not None else (capacity, now)
+            tokens = _refill(tokens, updated_at, now, capacity, refill_per_second)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_buckets (bucket, tokens, updated_at) VALUES (?, ?, ?)",
+                (bucket, tokens, now)
+            )
+        return allowed, 0.0 if allowed else _retry_after(tokens, cost, refill_per_second)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def create_state_store() -> StateStore:
+    """
+    依設定建立狀態儲存
+
+    Returns:
+        StateStore: STATE_BACKEND 為 "sqlite" 時回傳 SQLiteStateStore，否則回傳 MemoryStateStore
+
+    Raises:
+        ValueError: STATE_BACKEND 設定值無效時
+    """
+    settings = get_settings()
+    backend = settings.STATE_BACKEND.lower()
+    if backend == "sqlite":
+        return SQLiteStateStore(
+            settings.STATE_SQLITE_PATH, settings.STATE_CACHE_MAX_ENTRIES, settings.STATE_SQLITE_BUSY_TIMEOUT_MS
+        )
+    if backend == "memory":
+        if settings.WEB_CONCURRENCY > 1:
+            print(
+                f"[WARNING] STATE_BACKEND=memory 搭配 {settings.WEB_CONCURRENCY} 個 worker："
+                "各 worker 的對話歷史與快取不會共享，請改用 STATE_BACKEND=sqlite"
+            )
+        return MemoryStateStore(settings.STATE_CACHE_MAX_ENTRIES)
+    raise ValueError(f"無效的 STATE_BACKEND: {settings.STATE_BACKEND}（可用值: memory, sqlite）")
+
+
+@lru_cache
+def get_state_store() -> StateStore:
+    """
+    取得全域狀態儲存（第一次呼叫時才建立，可作為 FastAPI dependency）
+
+    Returns:
+        StateStore: 全域單例實例
+    """
+    return create_state_store()
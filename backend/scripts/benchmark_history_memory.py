@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+對話歷史記憶體用量基準測試
+
+以 tracemalloc 量測儲存相同對話所需的記憶體：
+- 改版前：每筆訊息為一個 Pydantic ChatMessage（含 datetime）
+- 改版後：MemoryStateStore 中的 HistoryEntry（__slots__ + 內容去重）
+
+用法:
+    python scripts/benchmark_history_memory.py --sessions 200 --turns 50 --repeat-ratio 0.3
+"""
+
+import argparse
+import gc
+import random
+import sys
+import tracemalloc
+from pathlib import Path
+
+# 確保能夠導入 app 模組
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.schemas.chat import ChatMessage, MessageRole
+from app.services.history import HistoryEntry
+from app.services.state_store import MemoryStateStore
+
+# 常見的重複訊息（打招呼、重新生成、額度用完提示等）
+COMMON_MESSAGES = [
+    "你好",
+    "謝謝！",
+    "請繼續",
+    "可以再詳細說明嗎？",
+    "抱歉，AI 服務額度已用完，請稍後再試或聯繫管理員。",
+]
+
+
+def build_workload(sessions: int, turns: int, repeat_ratio: float, seed: int) -> list[tuple[str, MessageRole, str]]:
+    """
+    產生測試用的對話內容
+
+    Returns:
+        list[tuple[str, MessageRole, str]]: (session_id, 角色, 內容) 列表
+    """
+    rng = random.Random(seed)
+    workload = []
+    for s in range(sessions):
+        for t in range(turns):
+            role = MessageRole.USER if t % 2 == 0 else MessageRole.ASSISTANT
+            if rng.random() < repeat_ratio:
+                content = rng.choice(COMMON_MESSAGES)
+            else:
+                # 動態產生的內容：每筆皆為新的字串物件
+                length = rng.randint(20, 400) if role == MessageRole.USER else rng.randint(200, 2000)
+                content = "".join(rng.choice("對話歷史記憶體測試內容abcdefg ") for _ in range(length))
+            workload.append((f"session-{s}", role, content))
+    return workload
+
+
+def measure(build) -> int:
+    """量測 build() 建立的資料結構所配置的記憶體（bytes）"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del kept
+    return size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="量測對話歷史每筆訊息的記憶體用量")
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--repeat-ratio", type=float, default=0.3, help="重複訊息比例（0~1）")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    workload = build_workload(args.sessions, args.turns, args.repeat_ratio, args.seed)
+    total = len(workload)
+
+    # 內容字串本身由兩種表示法共同持有，複製一份讓各自量測時都需重新配置
+    def build_before():
+        sessions: dict[str, list[ChatMessage]] = {}
+        for session_id, role, content in workload:
+            sessions.setdefault(session_id, []).append(
+                ChatMessage(role=role, content="".join(content))
+            )
+        return sessions
+
+    def build_after():
+        store = MemoryStateStore()
+        for session_id, role, content in workload:
+            store.append_message(session_id, HistoryEntry(role, "".join(content)))
+        return store
+
+    before = measure(build_before)
+    after = measure(build_after)
+
+    print(f"訊息數: {total}（{args.sessions} sessions × {args.turns} turns，重複比例 {args.repeat_ratio:.0%}）")
+    print(f"{'表示法':<24}{'總計 (KB)':>14}{'每筆 (bytes)':>16}")
+    print(f"{'ChatMessage (改版前)':<24}{before / 1024:>14.1f}{before / total:>16.1f}")
+    print(f"{'HistoryEntry (改版後)':<24}{after / 1024:>14.1f}{after / total:>16.1f}")
+    print(f"\n節省: {(1 - after / before):.1%}")
+
+
+if __name__ == "__main__":
+    main()
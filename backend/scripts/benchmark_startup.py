@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+冷啟動時間基準測試
+
+在全新的子程序中重複啟動 app，量測：
+- import app.main 所需時間
+- lifespan 啟動並回應第一個 /health 請求的時間
+- 第一個需要服務實例的請求（/api/chat/history）的時間
+- 第一次建立 OpenAI 客戶端（匯入 openai SDK）的時間
+
+用法:
+    python scripts/benchmark_startup.py --runs 10
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent.parent
+
+# 於子程序中執行的量測程式（每次都是全新的直譯器，沒有模組快取）
+PROBE = r"""
+import json, sys, time
+
+t0 = time.perf_counter()
+import app.main
+t_import = time.perf_counter() - t0
+openai_loaded_after_import = "openai" in sys.modules
+
+from fastapi.testclient import TestClient
+
+t0 = time.perf_counter()
+with TestClient(app.main.app) as client:
+    client.get("/health")
+    t_first_health = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    client.get("/api/chat/history")
+    t_first_history = time.perf_counter() - t0
+
+    from app.services.openai_service import get_openai_service
+    t0 = time.perf_counter()
+    get_openai_service().client
+    t_openai_client = time.perf_counter() - t0
+
+print(json.dumps({
+    "import_app": t_import,
+    "startup_first_health": t_first_health,
+    "first_history_request": t_first_history,
+    "openai_client_init": t_openai_client,
+    "openai_loaded_after_import": openai_loaded_after_import,
+}))
+"""
+
+
+def run_probe() -> dict:
+    """在新的子程序中執行一次量測"""
+    env = dict(os.environ)
+    env.setdefault("GEMINI_API_KEY", "benchmark-placeholder-key")
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="量測 FastAPI app 冷啟動時間")
+    parser.add_argument("--runs", type=int, default=5, help="重複次數（預設 5）")
+    args = parser.parse_args()
+
+    samples = [run_probe() for _ in range(args.runs)]
+
+    print(f"冷啟動基準測試（{args.runs} 次，單位 ms）")
+    print(f"{'階段':<28}{'中位數':>10}{'最小值':>10}{'最大值':>10}")
+    for key in ("import_app", "startup_first_health", "first_history_request", "openai_client_init"):
+        values = [s[key] * 1000 for s in samples]
+        print(f"{key:<28}{statistics.median(values):>10.1f}{min(values):>10.1f}{max(values):>10.1f}")
+
+    eager = any(s["openai_loaded_after_import"] for s in samples)
+    print(f"\nimport app.main 後是否已載入 openai SDK: {'是' if eager else '否'}")
+
+
+if __name__ == "__main__":
+    main()
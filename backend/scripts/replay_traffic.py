@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+流量重播工具（容量規劃用）
+
+讀取 TRAFFIC_CAPTURE_PATH 錄製的 NDJSON，依原本的到達間隔（可加速 1×–100×）對 app 重送 /api/chat/send，
+上游改由本機的 mock Gemini 端點回應：mock 依每筆記錄的 chunk 時間與字元數重現串流，
+因此負載具有實際的 prompt 長度分布、到達模式與回應時間
+
+每個重播訊息開頭帶有 [replay:N] 標記，mock 以此找到第 N 筆記錄的 chunk 時間；
+--speed 只壓縮到達間隔（同時進行的串流數約為原本的 speed 倍），--upstream-speed 另外壓縮 mock 的回應時間
+
+預設會啟動一個指向 mock 的 app 子程序（uvicorn）；指定 --target 時改對已啟動的 app 重播，
+該 app 需設定 GEMINI_API_BASE_URL 指向 --mock-port 的 mock（http://127.0.0.1:<port>/v1beta）
+
+用法:
+    python scripts/replay_traffic.py traffic.ndjson --speed 10
+    python scripts/replay_traffic.py traffic.ndjson --speed 50 --workers 4 --seed-history --output results.ndjson
+    python scripts/replay_traffic.py traffic.ndjson --target http://127.0.0.1:8000 --mock-port 8900
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import secrets
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+# 確保能夠導入 app 模組
+BACKEND_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from app.core.config import AVAILABLE_MODELS
+
+# 重播訊息的標記（mock 依此找到對應的記錄）
+MARKER_RE = re.compile(r"\[replay:(\d+)\]")
+
+# 填充訊息長度用的文字
+FILLER = "容量規劃重播訊息 capacity replay filler text. "
+
+
+def load_trace(path: str, limit: Optional[int] = None) -> list[dict[str, Any]]:
+    """
+    讀取錄製檔（依到達時間排序）
+
+    沒有 chunk 時間的記錄（被拒絕、失敗或中斷的請求）仍保留其到達時間，
+    回應時間改用另一筆完成記錄的時間（固定亂數種子，結果可重現）
+
+    Args:
+        path: 錄製檔路徑
+        limit: 最多讀取的筆數
+
+    Returns:
+        list[dict]: 記錄列表
+    """
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records = [r for r in records if r.get("message_chars", 0) > 0]
+    records.sort(key=lambda r: r["ts"])
+    if limit is not None:
+        records = records[:limit]
+
+    completed = [r for r in records if r.get("offsets_ms")]
+    rng = random.Random(0)
+    for record in records:
+        if not record.get("offsets_ms") and completed:
+            donor = rng.choice(completed)
+            record["offsets_ms"], record["chunk_chars"] = donor["offsets_ms"], donor["chunk_chars"]
+    return records
+
+
+def build_message(index: int, length: int) -> str:
+    """組出帶有標記、長度與原訊息相同的訊息"""
+    marker = f"[replay:{index}] "
+    body = FILLER * (max(length - len(marker), 0) // len(FILLER) + 1)
+    return (marker + body)[:max(length, len(marker))]
+
+
+def chunk_plan(record: dict[str, Any], upstream_speed: float = 1.0) -> list[tuple[float, int]]:
+    """
+    記錄中每個 chunk 距離上一個 chunk 的秒數與字元數
+
+    Args:
+        record: 錄製記錄
+        upstream_speed: 回應時間的加速倍數
+
+    Returns:
+        list[tuple[float, int]]: (等待秒數, 字元數)
+    """
+    plan, previous = [], 0
+    for offset, chars in zip(record.get("offsets_ms") or [], record.get("chunk_chars") or []):
+        plan.append((max(offset - previous, 0) / 1000 / upstream_speed, max(chars, 1)))
+        previous = offset
+    return plan or [(0.0, 1)]
+
+
+def create_mock_app(trace: list[dict[str, Any]], upstream_speed: float = 1.0):
+    """
+    建立 mock Gemini 端點（OpenAI 兼容的 chat/completions 與模型列表）
+
+    Args:
+        trace: 錄製記錄（依重播順序）
+        upstream_speed: 回應時間的加速倍數
+
+    Returns:
+        Starlette: ASGI app
+    """
+    from starlette.applications import Starlette
+    from starlette.requests import Request
+    from starlette.responses import JSONResponse, StreamingResponse
+    from starlette.routing import Route
+
+    model_ids = sorted({r["model"] for r in trace if r.get("model")} | set(AVAILABLE_MODELS))
+
+    async def list_models(request: Request) -> JSONResponse:
+        return JSONResponse({"models": [
+            {
+                "name": f"models/{model_id}",
+                "displayName": model_id,
+                "supportedGenerationMethods": ["generateContent"],
+                "inputTokenLimit": 1000000,
+            }
+            for model_id in model_ids
+        ]})
+
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        model = payload.get("model", "mock")
+        # 由最後一則使用者訊息的標記找到對應的記錄（摘要等其他呼叫沒有標記）
+        user_messages = [m["content"] for m in payload.get("messages", []) if m.get("role") == "user"]
+        found = MARKER_RE.search(user_messages[-1]) if user_messages else None
+        plan = chunk_plan(trace[int(found.group(1))], upstream_speed) if found else [(0.0, 16)]
+
+        if not payload.get("stream"):
+            return JSONResponse({
+                "id": "replay", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "摘要" * 8}, "finish_reason": "stop"}],
+            })
+
+        def event(choices: list, **extra) -> str:
+            chunk = {"id": "replay", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": choices, **extra}
+            return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+        async def stream():
+            total = 0
+            for delay, chars in plan:
+                await asyncio.sleep(delay)
+                total += chars
+                yield event([{"index": 0, "delta": {"content": "字" * chars}, "finish_reason": None}])
+            yield event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if (payload.get("stream_options") or {}).get("include_usage"):
+                prompt_chars = sum(len(m.get("content", "")) for m in payload.get("messages", []))
+                yield event([], usage={
+                    "prompt_tokens": prompt_chars, "completion_tokens": total, "total_tokens": prompt_chars + total
+                })
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return Starlette(routes=[
+        Route("/v1beta/models", list_models),
+        Route("/v1beta/openai/chat/completions", chat_completions, methods=["POST"]),
+    ])
+
+
+def free_port() -> int:
+    """取得一個未使用的本機埠號"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentiles(values: list[float]) -> Optional[dict[str, float]]:
+    """p50 / p95 / p99（毫秒）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(int(q * len(ordered)), len(ordered) - 1)], 1)
+
+    return {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "max": round(ordered[-1], 1)}
+
+
+def spawn_app(port: int, mock_url: str, workers: int, admin_token: str, state_dir: str) -> subprocess.Popen:
+    """啟動指向 mock 的 app 子程序（不錄製流量、不讀取 .env 以外的 key）"""
+    env = {
+        **os.environ,
+        "GEMINI_API_BASE_URL": mock_url,
+        "GEMINI_API_KEY": "replay-key",
+        "GEMINI_API_KEYS": "",
+        "ADMIN_TOKEN": admin_token,
+        "TRAFFIC_CAPTURE_PATH": "",
+        "WEB_CONCURRENCY": str(workers),
+        # 多 worker 時以 SQLite 共用歷史，與正式部署相同
+        "STATE_BACKEND": "sqlite" if workers > 1 else "memory",
+        "STATE_SQLITE_PATH": str(Path(state_dir) / "replay.db"),
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env
+    )
+
+
+async def wait_until_ready(client, target: str, workers: int, timeout: float = 30.0) -> None:
+    """
+    等待 app 就緒並預熱
+
+    /health/ready 會觸發模型目錄預熱；連續數次就緒後再以不計入結果的請求暖機，
+    避免冷啟動（目錄載入、首次匯入）被准入控制拒絕而混入重播結果
+
+    Args:
+        client: httpx.AsyncClient
+        target: app 的 URL
+        workers: worker 數（各 worker 分別需要預熱）
+        timeout: 等待的最長秒數
+    """
+    deadline, streak = time.monotonic() + timeout, 0
+    while streak < workers * 2:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"app 未在 {timeout:g} 秒內就緒: {target}")
+        try:
+            ready = (await client.get(f"{target}/health/ready")).status_code == 200
+        except Exception:
+            ready = False
+        streak = streak + 1 if ready else 0
+        await asyncio.sleep(0 if ready else 0.2)
+
+    async def warm_up(i: int) -> None:
+        body = {"message": "warm up", "session_id": f"replay-warmup-{i}"}
+        async with client.stream("POST", f"{target}/api/chat/send", json=body) as response:
+            await response.aread()
+
+    await asyncio.gather(*(warm_up(i) for i in range(workers * 2)))
+
+
+async def seed_history(client, target: str, admin_token: str, trace: list[dict[str, Any]]) -> int:
+    """
+    以 /api/admin/import 為每個 session 建立錄製時已有的歷史（長度與筆數相同，內容為填充文字）
+
+    Returns:
+        int: 匯入的訊息數
+    """
+    lines, seen = [], set()
+    for record in trace:
+        session = f"replay-{record['session']}"
+        if session in seen:
+            continue
+        seen.add(session)
+        count, chars = record.get("history_messages", 0), record.get("history_chars", 0)
+        for i in range(count):
+            content = (FILLER * (chars // max(count, 1) // len(FILLER) + 1))[:max(chars // count, 1)]
+            lines.append(json.dumps({
+                "session_id": session, "role": "user" if i % 2 == 0 else "assistant",
+                "content": content, "timestamp": "2024-01-01T00:00:00",
+            }, ensure_ascii=False))
+    if not lines:
+        return 0
+    response = await client.post(
+        f"{target}/api/admin/import", content=("\n".join(lines) + "\n").encode("utf-8"),
+        headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    response.raise_for_status()
+    return response.json().get("imported", len(lines))
+
+
+async def replay_one(client, target: str, index: int, record: dict[str, Any]) -> dict[str, Any]:
+    """重送一筆請求，量測客戶端觀察到的 TTFT 與總時間"""
+    body = {
+        "message": build_message(index, record["message_chars"]),
+        "session_id": f"replay-{record['session']}",
+    }
+    model = record.get("requested_model") or record.get("model")
+    if model:
+        body["model"] = model
+
+    result = {"index": index, "status": None, "ttft_ms": None, "duration_ms": None,
+              "recorded_ttft_ms": (record.get("offsets_ms") or [None])[0]}
+    started = time.perf_counter()
+    try:
+        async with client.stream("POST", f"{target}/api/chat/send", json=body) as response:
+            if response.status_code != 200:
+                result["status"] = f"http_{response.status_code}"
+                await response.aread()
+                return result
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    name = line[len("event: "):]
+                    if name == "chunk" and result["ttft_ms"] is None:
+                        result["ttft_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                    elif name == "done":
+                        result["status"] = "done"
+                    elif name == "error":
+                        result["status"] = "error"
+                elif line.startswith("data: ") and result["status"] == "error":
+                    result["status"] = json.loads(line[len("data: "):]).get("code") or "error"
+        result["status"] = result["status"] or "incomplete"
+    except Exception as e:
+        result["status"] = f"client_error:{type(e).__name__}"
+    finally:
+        result["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+async def replay(args: argparse.Namespace) -> dict[str, Any]:
+    """執行重播並回傳摘要"""
+    import httpx
+    import uvicorn
+
+    trace = load_trace(args.trace, args.limit)
+    if not trace:
+        raise SystemExit("錄製檔中沒有可重播的請求")
+
+    mock_port = args.mock_port or free_port()
+    mock = uvicorn.Server(uvicorn.Config(
+        create_mock_app(trace, args.upstream_speed), host="127.0.0.1", port=mock_port,
+        log_level="warning", lifespan="off"
+    ))
+    mock_task = asyncio.create_task(mock.serve())
+
+    process, state_dir = None, tempfile.TemporaryDirectory()
+    admin_token = args.admin_token
+    target = args.target
+    if target is None:
+        admin_token = admin_token or secrets.token_hex(16)
+        app_port = free_port()
+        target = f"http://127.0.0.1:{app_port}"
+        process = spawn_app(app_port, f"http://127.0.0.1:{mock_port}/v1beta", args.workers, admin_token, state_dir.name)
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=200)
+    try:
+        async with httpx.AsyncClient(timeout=httpx.Timeout(None, connect=10.0), limits=limits) as client:
+            await wait_until_ready(client, target, args.workers)
+            if args.seed_history:
+                if not admin_token:
+                    raise SystemExit("--seed-history 需要 --admin-token（或不指定 --target 由本工具啟動 app）")
+                print(f"[replay] 已建立歷史 {await seed_history(client, target, admin_token, trace)} 筆")
+
+            in_flight = peak = 0
+            lateness: list[float] = []
+
+            async def run(index: int, record: dict[str, Any]) -> dict[str, Any]:
+                nonlocal in_flight, peak
+                in_flight += 1
+                peak = max(peak, in_flight)
+                try:
+                    return await replay_one(client, target, index, record)
+                finally:
+                    in_flight -= 1
+
+            print(f"[replay] {len(trace)} 筆請求，{args.speed:g}× 到達速度 → {target}")
+            origin, started = trace[0]["ts"], time.perf_counter()
+            tasks = []
+            for index, record in enumerate(trace):
+                due = (record["ts"] - origin) / args.speed
+                delay = due - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                lateness.append(max(-delay, 0) * 1000)
+                tasks.append(asyncio.create_task(run(index, record)))
+            results = await asyncio.gather(*tasks)
+            wall = time.perf_counter() - started
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        mock.should_exit = True
+        await mock_task
+        state_dir.cleanup()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    statuses: dict[str, int] = {}
+    for result in results:
+        statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+    paired = [r for r in results if r["ttft_ms"] is not None and r["recorded_ttft_ms"] is not None]
+    span = (trace[-1]["ts"] - origin) / args.speed
+    return {
+        "requests": len(results),
+        "speed": args.speed,
+        "upstream_speed": args.upstream_speed,
+        "wall_seconds": round(wall, 2),
+        "offered_rps": round(len(results) / span, 2) if span > 0 else None,
+        "peak_in_flight": peak,
+        "statuses": statuses,
+        "ttft_ms": percentiles([r["ttft_ms"] for r in results if r["ttft_ms"] is not None]),
+        "recorded_ttft_ms": percentiles([r["recorded_ttft_ms"] for r in paired]),
+        # app 額外增加的 TTFT（重播 TTFT − 錄製 TTFT / upstream_speed）
+        "added_ttft_ms": percentiles([
+            r["ttft_ms"] - r["recorded_ttft_ms"] / args.upstream_speed for r in paired
+        ]),
+        "duration_ms": percentiles([r["duration_ms"] for r in results if r["status"] == "done"]),
+        "dispatch_lateness_ms": percentiles(lateness),
+        "median_message_chars": statistics.median(r["message_chars"] for r in trace),
+    }
+
+
+def speed_value(text: str) -> float:
+    """--speed 的範圍檢查（1–100）"""
+    value = float(text)
+    if not 1 <= value <= 100:
+        raise argparse.ArgumentTypeError("speed 必須介於 1 與 100 之間")
+    return value
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="以錄製的流量重播 /api/chat/send（上游為 mock Gemini）")
+    parser.add_argument("trace", help="TRAFFIC_CAPTURE_PATH 錄製的 NDJSON 檔")
+    parser.add_argument("--speed", type=speed_value, default=1.0, help="到達速度倍數（1–100，預設 1）")
+    parser.add_argument("--upstream-speed", type=float, default=1.0,
+                        help="mock 回應時間的加速倍數（預設 1，重現錄製時的 chunk 時間）")
+    parser.add_argument("--target", help="對已啟動的 app 重播（需設定 GEMINI_API_BASE_URL 指向 mock）")
+    parser.add_argument("--mock-port", type=int, default=0, help="mock Gemini 的埠號（預設自動選擇）")
+    parser.add_argument("--workers", type=int, default=1, help="app 的 worker 數（自動啟動時使用，並依此預熱）")
+    parser.add_argument("--admin-token", help="app 的 ADMIN_TOKEN（--target 搭配 --seed-history 時需要）")
+    parser.add_argument("--seed-history", action="store_true", help="重播前建立各 session 錄製時已有的歷史長度")
+    parser.add_argument("--limit", type=int, help="只重播前 N 筆")
+    parser.add_argument("--output", help="將每筆請求的結果寫入 NDJSON")
+    args = parser.parse_args()
+    if args.upstream_speed <= 0:
+        parser.error("--upstream-speed 必須大於 0")
+
+    summary = asyncio.run(replay(args))
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
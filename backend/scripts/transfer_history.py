@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+對話歷史匯出 / 匯入工具
+
+直接讀寫 .env 設定的狀態儲存（STATE_BACKEND=sqlite 時為 STATE_SQLITE_PATH），
+適合備份或在實例之間搬移資料；格式與 GET /api/admin/export 相同
+
+用法:
+    python scripts/transfer_history.py export backup.ndjson.gz
+    python scripts/transfer_history.py export - --session-id demo --compression none > demo.ndjson
+    python scripts/transfer_history.py import backup.ndjson.gz --batch-size 5000
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import BinaryIO, Iterator
+
+# 確保能夠導入 app 模組
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.core.config import get_settings
+from app.services.history_transfer import export_ndjson, import_ndjson
+from app.services.state_store import get_state_store
+
+# 匯入時每次讀取的位元組數
+READ_SIZE = 1 << 20
+
+
+def infer_compression(path: str) -> str:
+    """依副檔名推斷壓縮格式"""
+    if path.endswith(".gz"):
+        return "gzip"
+    if path.endswith(".zst"):
+        return "zstd"
+    return "none"
+
+
+def read_chunks(stream: BinaryIO) -> Iterator[bytes]:
+    """逐塊讀取檔案"""
+    while True:
+        chunk = stream.read(READ_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def run_export(args: argparse.Namespace) -> None:
+    compression = args.compression or infer_compression(args.path)
+    store = get_state_store()
+    written = 0
+    started = time.perf_counter()
+    output = sys.stdout.buffer if args.path == "-" else open(args.path, "wb")
+    try:
+        for chunk in export_ndjson(store, args.session_id, compression, args.batch_size):
+            output.write(chunk)
+            written += len(chunk)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+    elapsed = time.perf_counter() - started
+    print(f"已匯出 {written / 1024 / 1024:.1f} MB（{compression}），耗時 {elapsed:.2f} 秒", file=sys.stderr)
+
+
+def run_import(args: argparse.Namespace) -> None:
+    store = get_state_store()
+    started = time.perf_counter()
+    source = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+    try:
+        imported = import_ndjson(store, read_chunks(source), args.batch_size)
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+    elapsed = time.perf_counter() - started
+    rate = imported / elapsed if elapsed > 0 else float("inf")
+    print(f"已匯入 {imported} 筆訊息，耗時 {elapsed:.2f} 秒（{rate:,.0f} 筆/秒）", file=sys.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="對話歷史匯出 / 匯入（NDJSON，支援 gzip / zstd）")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="匯出對話歷史")
+    export_parser.add_argument("path", help="輸出檔案路徑（- 表示 stdout）")
+    export_parser.add_argument("--session-id", default=None, help="僅匯出指定 session")
+    export_parser.add_argument(
+        "--compression", choices=["none", "gzip", "zstd"], default=None, help="壓縮格式（預設依副檔名判斷）"
+    )
+    export_parser.add_argument("--batch-size", type=int, default=1000, help="每批讀取筆數")
+
+    import_parser = subparsers.add_parser("import", help="匯入對話歷史（壓縮格式依檔頭自動判斷）")
+    import_parser.add_argument("path", help="輸入檔案路徑（- 表示 stdin）")
+    import_parser.add_argument("--batch-size", type=int, default=1000, help="每次批次寫入筆數")
+
+    args = parser.parse_args()
+
+    if get_settings().STATE_BACKEND.lower() == "memory":
+        print("[WARNING] STATE_BACKEND=memory：資料只存在於此程序中，請改用 STATE_BACKEND=sqlite", file=sys.stderr)
+
+    if args.command == "export":
+        run_export(args)
+    else:
+        run_import(args)
+
+    get_state_store().close()
+
+
+if __name__ == "__main__":
+    main()
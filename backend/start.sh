@@ -1,6 +1,8 @@
 #!/bin/bash
 
-# FastAPI 開發伺服器啟動腳本
+# FastAPI 伺服器啟動腳本
+#   ./start.sh        開發模式（熱重載）
+#   ./start.sh prod   生產模式（多 worker，共享狀態存於 SQLite）
 
 echo "🚀 啟動 FastAPI 開發伺服器..."
 echo ""
@@ -22,6 +24,9 @@ if ! python -c "import fastapi" 2>/dev/null; then
     echo ""
 fi
 
+# 啟動模式：dev（預設，單一程序 + 熱重載）或 prod（多 worker）
+MODE="${1:-dev}"
+
 # 啟動服務
 echo "🔥 啟動中..."
 echo "📍 API 根路徑: http://localhost:8000"
@@ -29,4 +34,15 @@ echo "📚 API 文件: http://localhost:8000/docs"
 echo "💚 健康檢查: http://localhost:8000/health"
 echo ""
 
+if [ "$MODE" = "prod" ]; then
+    # worker 數量預設為 CPU 核心數；uvicorn --workers 會讀取 WEB_CONCURRENCY
+    export WEB_CONCURRENCY="${WEB_CONCURRENCY:-$(nproc 2>/dev/null || echo 2)}"
+    # 多 worker 必須使用跨程序的共享狀態後端
+    export STATE_BACKEND="${STATE_BACKEND:-sqlite}"
+    echo "🏭 生產模式: ${WEB_CONCURRENCY} 個 worker，共享狀態後端: ${STATE_BACKEND}"
+    echo ""
+    exec python -m uvicorn app.main:app --host 0.0.0.0 --port 8000 \
+        --workers "$WEB_CONCURRENCY" --proxy-headers --no-access-log
+fi
+
 python -m uvicorn app.main:app --reload --host 0.0.0.0 --port 8000
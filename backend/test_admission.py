@@ -0,0 +1,92 @@
+"""
+測試 event loop 延遲監測與准入控制
+"""
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.core.admission import AdmissionController, AdmissionMiddleware
+from app.core.loop_monitor import LoopLagMonitor
+from app.core.metrics import metrics
+
+
+def test_loop_lag_detects_blocking():
+    """測試阻塞 event loop 時延遲上升"""
+    print("=" * 60)
+    print("測試: event loop 延遲取樣")
+    print("=" * 60)
+
+    async def run():
+        monitor = LoopLagMonitor(interval=0.01, smoothing=1.0)
+        monitor.start()
+        await asyncio.sleep(0.05)
+        time.sleep(0.1)  # 刻意阻塞 loop
+        await asyncio.sleep(0.001)  # 讓取樣器醒來記錄這次延遲
+        await monitor.stop()
+        return monitor
+
+    monitor = asyncio.run(run())
+    assert monitor.last_sample >= 0.05
+    print(f"   ✓ 阻塞 100ms 後 lag={monitor.lag * 1000:.1f}ms")
+    print()
+
+
+def test_admission_rejects_when_overloaded():
+    """測試延遲或串流數超過上限時回傳 503，其他路徑不受影響"""
+    print("=" * 60)
+    print("測試: 准入控制")
+    print("=" * 60)
+
+    monitor = LoopLagMonitor()
+    controller = AdmissionController(monitor, max_loop_lag=0.2, max_active_streams=1, retry_after=3)
+
+    test_app = FastAPI()
+    test_app.add_middleware(AdmissionMiddleware, controller=controller)
+
+    @test_app.post("/api/chat/send")
+    async def send():
+        return {"active": controller.active_streams}
+
+    @test_app.get("/api/chat/history")
+    async def history():
+        return {"ok": True}
+
+    client = TestClient(test_app)
+    assert client.post("/api/chat/send").json() == {"active": 1}
+    assert controller.active_streams == 0
+    print("   ✓ 正常情況放行，結束後計數歸零")
+
+    monitor.lag = 0.5
+    rejected = client.post("/api/chat/send")
+    assert rejected.status_code == 503
+    assert rejected.headers["retry-after"] == "3"
+    assert rejected.json()["reason"] == "loop_lag"
+    assert client.get("/api/chat/history").status_code == 200
+    print("   ✓ 延遲過高時 503 + Retry-After，其他路徑不受影響")
+
+    monitor.lag = 0.0
+    controller.active_streams = 1
+    assert client.post("/api/chat/send").json()["reason"] == "active_streams"
+    controller.active_streams = 0
+    print("   ✓ 串流數達上限時 503")
+
+    exposition = metrics.render()
+    assert 'chat_admission_rejected_total{reason="loop_lag"}' in exposition
+    assert "event_loop_lag_seconds" in exposition
+    print("   ✓ metrics 已輸出")
+    print()
+
+
+if __name__ == "__main__":
+    test_loop_lag_detects_blocking()
+    test_admission_rejects_when_overloaded()
+
+    print("=" * 60)
+    print("所有准入控制測試完成！")
+    print("=" * 60)
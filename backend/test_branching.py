@@ -0,0 +1,294 @@
+"""
+測試對話分支：共用前綴的樹狀歷史、建立 / 切換分支、重新產生回應與匯出匯入
+"""
+import asyncio
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.schemas.chat import MessageRole
+from app.services.compaction import _summary_key
+from app.services.history import HistoryEntry
+from app.services.history_transfer import export_ndjson, import_ndjson
+from app.services.key_pool import ApiKeyPool
+from app.services.openai_service import OpenAIService, get_openai_service
+from app.services.state_store import MemoryStateStore, SQLiteStateStore
+
+
+def contents(entries):
+    return [entry.content for entry in entries]
+
+
+def build_tree(store, session_id="s"):
+    """u1 → a1 → u2 → a2，再於 a1 之後分支出 u2' → a2'"""
+    ids = {}
+    for name, role in (("u1", MessageRole.USER), ("a1", MessageRole.ASSISTANT),
+                       ("u2", MessageRole.USER), ("a2", MessageRole.ASSISTANT)):
+        ids[name] = store.append_message(session_id, HistoryEntry(role, name)).id
+    store.set_head(session_id, ids["a1"])
+    for name, role in (("u2'", MessageRole.USER), ("a2'", MessageRole.ASSISTANT)):
+        ids[name] = store.append_message(session_id, HistoryEntry(role, name)).id
+    return ids
+
+
+def test_store_branches():
+    """測試兩種後端的分支操作"""
+    print("=" * 60)
+    print("測試: 狀態儲存的分支")
+    print("=" * 60)
+
+    for store in (MemoryStateStore(), SQLiteStateStore(":memory:")):
+        name = type(store).__name__
+        ids = build_tree(store)
+        assert contents(store.get_messages("s")) == ["u1", "a1", "u2'", "a2'"]
+        assert contents(store.list_leaves("s")) == ["a2", "a2'"]
+        assert len(list(store.iter_messages("s"))) == 6  # 兩個分支共用 u1、a1，不複製
+
+        store.set_head("s", ids["a2"])
+        assert contents(store.get_messages("s")) == ["u1", "a1", "u2", "a2"]
+
+        # head 仍有子訊息時 pop 只移動 head
+        store.set_head("s", ids["a1"])
+        assert store.pop_message("s").content == "a1"
+        assert contents(store.get_messages("s")) == ["u1"]
+        assert store.get_message("s", ids["a1"]) is not None
+
+        # 從頭開始的新分支
+        store.set_head("s", None)
+        store.append_message("s", HistoryEntry(MessageRole.USER, "new root"))
+        assert contents(store.get_messages("s")) == ["new root"]
+        assert store.pop_message("s").content == "new root" and store.get_messages("s") == []
+
+        try:
+            store.set_head("s", 999)
+            raise AssertionError("應拒絕不存在的訊息")
+        except ValueError:
+            pass
+        assert store.get_message("other", ids["u1"]) is None
+
+        store.clear_messages("s")
+        assert store.get_head("s") is None and store.list_leaves("s") == []
+        print(f"   ✓ {name}: 分支共用前綴、切換、pop 與清除")
+
+    # 記憶體後端的分支直接共用同一批 HistoryEntry 物件
+    store = MemoryStateStore()
+    build_tree(store)
+    first = store.get_messages("s")[0]
+    store.set_head("s", store.list_leaves("s")[0].id)
+    assert store.get_messages("s")[0] is first
+    print("   ✓ 各分支的前綴為同一批物件")
+    print()
+
+
+def test_sqlite_migration():
+    """測試舊版資料庫（沒有 parent_id）升級為單一分支"""
+    print("=" * 60)
+    print("測試: SQLite 舊資料升級")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "state.db")
+        conn = sqlite3.connect(path)
+        conn.executescript("""
+            CREATE TABLE messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL,
+                role TEXT NOT NULL, content TEXT NOT NULL, timestamp TEXT NOT NULL
+            );
+            INSERT INTO messages (session_id, role, content, timestamp) VALUES
+                ('a', 'user', '一', '2024-01-01T00:00:00'),
+                ('b', 'user', 'x', '2024-01-01T00:00:00'),
+                ('a', 'assistant', '二', '2024-01-01T00:00:01'),
+                ('a', 'user', '三', '2024-01-01T00:00:02');
+        """)
+        conn.close()
+
+        store = SQLiteStateStore(path)
+        assert contents(store.get_messages("a")) == ["一", "二", "三"]
+        assert [e.parent_id for e in store.get_messages("a")] == [None, 1, 3]
+        store.append_message("a", HistoryEntry(MessageRole.ASSISTANT, "四"))
+        assert contents(store.get_messages("a")) == ["一", "二", "三", "四"]
+        assert contents(store.get_messages("b")) == ["x"]
+        store.close()
+    print("   ✓ 既有歷史依 ID 順序串成單一分支")
+    print()
+
+
+def test_export_import_keeps_tree():
+    """測試匯出匯入保留分支結構（跨批次、多個起點），舊版資料依序串接"""
+    print("=" * 60)
+    print("測試: 匯出匯入分支")
+    print("=" * 60)
+
+    source = MemoryStateStore()
+    ids = build_tree(source)
+    source.set_head("s", None)
+    source.append_message("s", HistoryEntry(MessageRole.USER, "edited first"))
+    data = b"".join(export_ndjson(source))
+
+    for target in (MemoryStateStore(), SQLiteStateStore(":memory:")):
+        assert import_ndjson(target, [data], batch_size=2) == 7
+        leaves = target.list_leaves("s")
+        assert contents(leaves) == ["a2", "a2'", "edited first"]
+        paths = []
+        for leaf in leaves:
+            target.set_head("s", leaf.id)
+            paths.append(contents(target.get_messages("s")))
+        assert paths == [["u1", "a1", "u2", "a2"], ["u1", "a1", "u2'", "a2'"], ["edited first"]]
+
+        legacy = (
+            b'{"session_id": "old", "id": 1, "role": "user", "content": "q", "timestamp": "2024-01-01T00:00:00"}\n'
+            b'{"session_id": "old", "id": 2, "role": "assistant", "content": "a", "timestamp": "2024-01-01T00:00:01"}\n'
+        )
+        import_ndjson(target, [legacy])
+        assert contents(target.get_messages("old")) == ["q", "a"]
+        print(f"   ✓ {type(target).__name__}: 分支與舊版資料皆正確匯入")
+    print()
+
+
+class FakeStream:
+    """固定內容的上游串流"""
+
+    def __init__(self, text):
+        self.text = text
+
+    async def __aiter__(self):
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=self.text))])
+
+    async def close(self):
+        pass
+
+
+def make_service(replies):
+    """依序回覆 replies 的服務（元素為例外時拋出），並記錄送出的 prompt"""
+    prompts = []
+
+    async def create(**kwargs):
+        prompts.append([m["content"] for m in kwargs["messages"]])
+        reply = replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return FakeStream(reply)
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    service = OpenAIService(MemoryStateStore(), ApiKeyPool(["k"], client_factory=lambda key: client))
+    return service, prompts
+
+
+def test_regenerate_and_edit():
+    """測試重新產生回應、編輯訊息與失敗時還原分支"""
+    print("=" * 60)
+    print("測試: 重新產生與編輯")
+    print("=" * 60)
+
+    service, prompts = make_service(["A1", "B1", "B2", RuntimeError("upstream 500"), "C1"])
+
+    async def collect(generator):
+        return "".join([chunk async for chunk in generator])
+
+    asyncio.run(collect(service.generate_streaming_response("Q1", "m", "s")))
+    assert asyncio.run(collect(service.regenerate_streaming_response("m", "s"))) == "B1"
+    assert prompts[-1] == ["Q1"]
+    head, leaves = service.list_branches("s")
+    assert contents(leaves) == ["A1", "B1"] and head == leaves[-1].id
+    print("   ✓ 重新產生的回應成為新分支，prompt 不含原回應")
+
+    asyncio.run(collect(service.generate_streaming_response("Q2", "m", "s")))
+    assert prompts[-1] == ["Q1", "B1", "Q2"]
+    before = contents(service.get_history("s"))
+    try:
+        asyncio.run(collect(service.regenerate_streaming_response("m", "s")))
+        raise AssertionError("應拋出上游錯誤")
+    except RuntimeError:
+        pass
+    assert contents(service.get_history("s")) == before
+    print("   ✓ 重新產生失敗時切回原本的分支")
+
+    # 編輯 Q1：在 Q1 的父訊息（起點）建立分支後送出新內容
+    q1 = service.get_history("s")[0]
+    assert service.fork_history(q1.parent_id, "s") == []
+    asyncio.run(collect(service.generate_streaming_response("Q1 edited", "m", "s")))
+    assert prompts[-1] == ["Q1 edited"]
+    assert contents(service.switch_branch(q1.id, "s")) == ["Q1", "B1", "Q2", "B2"]
+    print("   ✓ 編輯訊息建立新分支，切換分支選擇最新的後續")
+
+    try:
+        service.fork_history(None, "empty")
+        service.regenerate_target("empty")
+        raise AssertionError("空分支不能重新產生")
+    except ValueError:
+        pass
+    print()
+
+
+def test_summary_scoped_to_branch():
+    """測試摘要只套用在包含其前綴的分支"""
+    print("=" * 60)
+    print("測試: 摘要與分支")
+    print("=" * 60)
+
+    service, _ = make_service([])
+    service.compactor.enabled = True
+    ids = build_tree(service.store)
+    service.store.cache_set(_summary_key("s"), {"summary": "S", "until_id": ids["u2"]})
+    assert service.preview_prompt("next", "s")[0]["role"] == "user"
+    service.store.set_head("s", ids["a2"])
+    prompt = service.preview_prompt("next", "s")
+    assert prompt[0]["role"] == "system" and [m["content"] for m in prompt[1:]] == ["a2", "next"]
+    print("   ✓ 其他分支的摘要不會套用")
+    print()
+
+
+def test_branch_endpoints():
+    """測試分支相關 API"""
+    print("=" * 60)
+    print("測試: 分支 API")
+    print("=" * 60)
+
+    service, _ = make_service(["R1"])
+    ids = build_tree(service.store, "web")
+    app.dependency_overrides[get_openai_service] = lambda: service
+    client = TestClient(app)
+    try:
+        branches = client.get("/api/chat/branches", params={"session_id": "web"}).json()
+        assert [b["leaf"]["content"] for b in branches["branches"]] == ["a2", "a2'"]
+        assert branches["head_id"] == ids["a2'"] and branches["branches"][1]["active"]
+
+        response = client.post("/api/chat/switch", json={"session_id": "web", "message_id": ids["u2"]})
+        assert [m["content"] for m in response.json()["messages"]] == ["u1", "a1", "u2", "a2"]
+
+        response = client.post("/api/chat/fork", json={"session_id": "web", "message_id": ids["a1"]})
+        assert [m["content"] for m in response.json()["messages"]] == ["u1", "a1"]
+        assert client.post("/api/chat/fork", json={"session_id": "web", "message_id": 999}).status_code == 404
+        assert client.post("/api/chat/regenerate", json={"session_id": "nothing"}).status_code == 400
+
+        client.post("/api/chat/switch", json={"session_id": "web", "message_id": ids["a2"]})
+        with client.stream("POST", "/api/chat/regenerate", json={"session_id": "web"}) as response:
+            body = "".join(response.iter_text())
+        assert "event: done" in body and "R1" in body
+        history = client.get("/api/chat/history", params={"session_id": "web"}).json()["messages"]
+        assert [m["content"] for m in history] == ["u1", "a1", "u2", "R1"]
+        assert history[-1]["parent_id"] == ids["u2"]
+    finally:
+        app.dependency_overrides.clear()
+    print("   ✓ /branches、/switch、/fork 與 /regenerate")
+    print()
+
+
+if __name__ == "__main__":
+    test_store_branches()
+    test_sqlite_migration()
+    test_export_import_keeps_tree()
+    test_regenerate_and_edit()
+    test_summary_scoped_to_branch()
+    test_branch_endpoints()
+
+    print("=" * 60)
+    print("所有分支測試完成！")
+    print("=" * 60)
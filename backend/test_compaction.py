@@ -0,0 +1,133 @@
+"""
+測試對話摘要壓縮：背景產生摘要、prompt 改送「摘要 + 最近訊息」
+"""
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.schemas.chat import MessageRole
+from app.services.compaction import SUMMARY_PREFIX, HistoryCompactor
+from app.services.history import HistoryEntry
+from app.services.state_store import MemoryStateStore, SQLiteStateStore
+
+
+class FakeCompletions:
+    """記錄呼叫並回傳固定摘要的 chat.completions 替身"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        message = SimpleNamespace(content="使用者正在規劃東京旅行，偏好平價住宿。")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def test_compaction_replaces_older_turns():
+    """測試超過門檻後，較舊的訊息被摘要取代"""
+    print("=" * 60)
+    print("測試: 對話摘要壓縮")
+    print("=" * 60)
+
+    store = MemoryStateStore()
+    completions = FakeCompletions()
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    compactor = HistoryCompactor(store, lambda: client)
+    compactor.enabled = True
+    compactor.threshold_chars = 50
+    compactor.keep_recent = 2
+    compactor.model = "gemini-1.5-flash"
+
+    for i in range(3):
+        store.append_message("trip", HistoryEntry(MessageRole.USER, f"第 {i} 個問題：東京有哪些平價的住宿選擇？"))
+        store.append_message("trip", HistoryEntry(MessageRole.ASSISTANT, f"第 {i} 個回答：可以考慮膠囊旅館或商務旅館。"))
+
+    async def run():
+        compactor.maybe_schedule("trip")
+        await compactor.wait_for_pending(timeout=5)
+
+    asyncio.run(run())
+
+    assert completions.calls[0]["model"] == "gemini-1.5-flash"
+    entries = store.get_messages("trip")
+    prompt = compactor.build_prompt("trip", entries)
+    assert prompt[0]["role"] == "system" and prompt[0]["content"].startswith(SUMMARY_PREFIX)
+    assert [m["content"] for m in prompt[1:]] == [e.content for e in entries[-2:]]
+    print(f"   ✓ 6 筆訊息 → 摘要 + 最近 {len(prompt) - 1} 筆")
+
+    compactor.forget("trip")
+    assert len(compactor.build_prompt("trip", entries)) == 6
+    print("   ✓ 清除摘要後恢復完整歷史")
+    print()
+
+
+def test_compaction_disabled_by_default():
+    """測試預設不啟用時不會排程壓縮"""
+    print("=" * 60)
+    print("測試: 預設停用")
+    print("=" * 60)
+
+    store = MemoryStateStore()
+    compactor = HistoryCompactor(store, lambda: None)
+    store.append_message("s", HistoryEntry(MessageRole.USER, "x" * 100000))
+    compactor.maybe_schedule("s")
+    assert not compactor._tasks
+    print("   ✓ 未排程任何背景工作")
+    print()
+
+
+def test_schedule_reads_store_off_loop():
+    """測試門檻判斷在背景工作中經由 store.run() 讀取（SQLite 讀取不在 event loop 上執行）"""
+    print("=" * 60)
+    print("測試: 門檻判斷不阻塞 event loop")
+    print("=" * 60)
+
+    store = SQLiteStateStore(":memory:")
+    completions = FakeCompletions()
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    compactor = HistoryCompactor(store, lambda: client)
+    compactor.enabled = True
+    compactor.threshold_chars = 50
+    compactor.keep_recent = 2
+
+    on_loop = []
+    get_messages = store.get_messages
+
+    def record_thread(session_id):
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        return get_messages(session_id)
+
+    store.get_messages = record_thread
+
+    async def run():
+        compactor.maybe_schedule("s")
+        await compactor.wait_for_pending(timeout=5)
+
+    store.append_message("s", HistoryEntry(MessageRole.USER, "短"))
+    asyncio.run(run())
+    assert on_loop == [False] and not completions.calls and not compactor._in_progress
+    print("   ✓ 未超過門檻時不呼叫模型")
+
+    for i in range(3):
+        store.append_message("s", HistoryEntry(MessageRole.ASSISTANT, f"第 {i} 個較長的回答，用來超過壓縮門檻。" * 2))
+    asyncio.run(run())
+    assert len(completions.calls) == 1 and on_loop and not any(on_loop)
+    print(f"   ✓ 超過門檻時產生摘要，{len(on_loop)} 次讀取皆不在 event loop 上")
+    print()
+
+
+if __name__ == "__main__":
+    test_compaction_replaces_older_turns()
+    test_compaction_disabled_by_default()
+    test_schedule_reads_store_off_loop()
+
+    print("=" * 60)
+    print("所有摘要壓縮測試完成！")
+    print("=" * 60)
@@ -0,0 +1,172 @@
+"""
+測試多模型比較：並行串流、多工 SSE 與各模型統計
+"""
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.core.config import get_settings
+from app.routers import chat
+from app.routers.chat import generate_compare_stream
+from app.services.key_pool import ApiKeyPool
+from app.services.model_selector import ModelSelector
+from app.services.model_service import get_model_service
+from app.services.openai_service import OpenAIService, get_openai_service
+from app.services.state_store import MemoryStateStore
+
+
+class FakeStream:
+    """每個片段間隔 delay 秒，最後附上 token 用量"""
+
+    def __init__(self, pieces, delay):
+        self.pieces = pieces
+        self.delay = delay
+
+    async def __aiter__(self):
+        for piece in self.pieces:
+            await asyncio.sleep(self.delay)
+            delta = SimpleNamespace(content=piece)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+        usage = SimpleNamespace(prompt_tokens=5, completion_tokens=len(self.pieces))
+        yield SimpleNamespace(choices=[], usage=usage)
+
+    async def close(self):
+        pass
+
+
+def make_service(calls=None):
+    """fast 模型很快、slow 模型較慢、broken 模型直接失敗"""
+    async def create(model, **kwargs):
+        if calls is not None:
+            calls.append(kwargs)
+        if model == "broken":
+            raise RuntimeError("上游錯誤")
+        delay = 0.01 if model == "fast" else 0.05
+        return FakeStream(["一", "二", "三", "四"], delay)
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    pool = ApiKeyPool(["k1", "k2"], client_factory=lambda key: client)
+    return OpenAIService(MemoryStateStore(), pool, ModelSelector())
+
+
+def parse(raw_events):
+    events = []
+    for raw in raw_events:
+        name, data = raw.strip().split("\n", 1)
+        events.append((name.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+def test_models_stream_concurrently():
+    """測試各模型並行串流、片段以 model 區分，且耗時約等於最慢的模型"""
+    print("=" * 60)
+    print("測試: 多模型並行串流")
+    print("=" * 60)
+
+    calls: list = []
+    service = make_service(calls)
+    messages = service.preview_prompt("你好")
+
+    async def run():
+        return [raw async for raw in generate_compare_stream(service, messages, ["slow", "fast", "broken"])]
+
+    started = time.monotonic()
+    events = parse(asyncio.run(run()))
+    elapsed = time.monotonic() - started
+
+    assert events[0] == ("start", {"models": ["slow", "fast", "broken"]})
+    chunks = [data["model"] for name, data in events if name == "chunk"]
+    assert chunks.count("slow") == 4 and chunks.count("fast") == 4
+    assert chunks.index("fast") < chunks.index("slow")
+    assert elapsed < 0.35, elapsed
+    print(f"   ✓ 兩個模型各 4 個片段交錯送出，耗時 {elapsed:.2f} 秒（序列執行約 0.25 秒以上）")
+
+    errors = [data for name, data in events if name == "error"]
+    assert errors == [{"model": "broken", "error": "上游錯誤"}]
+    print("   ✓ 單一模型失敗不影響其他模型")
+
+    name, done = events[-1]
+    results = {result["model"]: result for result in done["results"]}
+    assert name == "done" and list(results) == ["slow", "fast", "broken"]
+    assert results["fast"]["status"] == "ok" and results["fast"]["completion_tokens"] == 4
+    assert results["fast"]["ttft_ms"] < results["slow"]["ttft_ms"]
+    assert results["slow"]["chars"] == 4 and results["broken"]["status"] == "error"
+    assert all(call["stream_options"] == {"include_usage": True} for call in calls)
+    assert service.get_history() == []
+    assert all(slot.in_flight == 0 for slot in service.key_pool.slots)
+    print(f"   ✓ done 事件包含各模型 TTFT / 耗時 / token 數（整體 {done['wall_time_ms']} ms），不寫入歷史")
+    print()
+
+
+def test_disconnect_cancels_upstreams():
+    """測試客戶端中斷時取消所有上游串流並歸還 key"""
+    print("=" * 60)
+    print("測試: 客戶端中斷")
+    print("=" * 60)
+
+    service = make_service()
+
+    async def run():
+        stream = generate_compare_stream(service, service.preview_prompt("你好"), ["slow", "fast"])
+        async for raw in stream:
+            if raw.startswith("event: chunk"):
+                break
+        await stream.aclose()
+
+    asyncio.run(run())
+    assert all(slot.in_flight == 0 for slot in service.key_pool.slots)
+    print("   ✓ 中斷後所有 key 已歸還")
+    print()
+
+
+def test_compare_endpoint_validation():
+    """測試 endpoint 的模型驗證"""
+    print("=" * 60)
+    print("測試: /api/chat/compare 驗證")
+    print("=" * 60)
+
+    async def validate_model(model):
+        return model in ("slow", "fast", "broken")
+
+    test_app = FastAPI()
+    test_app.include_router(chat.router)
+    test_app.dependency_overrides[get_settings] = lambda: SimpleNamespace(
+        RATE_LIMIT_PER_MINUTE=0, COMPARE_MAX_MODELS=2,
+        STREAM_FIRST_TOKEN_TIMEOUT=5.0, STREAM_IDLE_TIMEOUT=5.0, STREAM_TOTAL_TIMEOUT=10.0
+    )
+    test_app.dependency_overrides[get_model_service] = lambda: SimpleNamespace(validate_model=validate_model)
+    test_app.dependency_overrides[get_openai_service] = make_service
+    client = TestClient(test_app)
+
+    def post(models):
+        return client.post("/api/chat/compare", json={"message": "你好", "models": models})
+
+    assert post(["fast", "fast"]).status_code == 400
+    assert post(["fast", "slow", "broken"]).status_code == 400
+    assert "unknown" in post(["fast", "unknown"]).json()["detail"]
+    assert post(["fast"]).status_code == 422
+    print("   ✓ 重複、超過上限、無效與少於兩個模型皆被拒絕")
+
+    response = post(["fast", "slow"])
+    assert response.status_code == 200
+    assert response.text.count("event: chunk") == 8 and "event: done" in response.text
+    print("   ✓ 合法請求返回多工 SSE 串流")
+    print()
+
+
+if __name__ == "__main__":
+    test_models_stream_concurrently()
+    test_disconnect_cancels_upstreams()
+    test_compare_endpoint_validation()
+
+    print("=" * 60)
+    print("所有多模型比較測試完成！")
+    print("=" * 60)
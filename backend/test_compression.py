@@ -0,0 +1,88 @@
+"""
+測試回應壓縮 Middleware：JSON 壓縮、小回應與 SSE 串流不壓縮
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.core.compression import CompressionMiddleware, negotiate_encoding
+
+
+def _build_app() -> FastAPI:
+    """建立只掛載壓縮 middleware 的測試 app"""
+    test_app = FastAPI()
+    test_app.add_middleware(CompressionMiddleware, minimum_size=500)
+
+    @test_app.get("/large")
+    async def large():
+        return {"messages": [{"role": "user", "content": "你好" * 50}] * 20}
+
+    @test_app.get("/small")
+    async def small():
+        return {"ok": True}
+
+    @test_app.get("/stream")
+    async def stream():
+        async def events():
+            for i in range(3):
+                yield f"event: chunk\ndata: {{\"content\": \"{'x' * 400}{i}\"}}\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return test_app
+
+
+def test_negotiate_encoding():
+    """測試 Accept-Encoding 協商"""
+    print("=" * 60)
+    print("測試: Accept-Encoding 協商")
+    print("=" * 60)
+
+    supported = ["zstd", "br", "gzip"]
+    assert negotiate_encoding("gzip, deflate, br", supported) == "br"
+    assert negotiate_encoding("gzip;q=1.0, br;q=0.5", supported) == "gzip"
+    assert negotiate_encoding("identity", supported) is None
+    assert negotiate_encoding("br;q=0, gzip", ["br", "gzip"]) == "gzip"
+    assert negotiate_encoding("*", ["gzip"]) == "gzip"
+    print("   ✓ 協商結果正確")
+    print()
+
+
+def test_json_compressed_and_sse_untouched():
+    """測試大型 JSON 被壓縮、小回應與 SSE 保持原樣"""
+    print("=" * 60)
+    print("測試: JSON 壓縮與 SSE 直通")
+    print("=" * 60)
+
+    client = TestClient(_build_app())
+    headers = {"Accept-Encoding": "gzip"}
+
+    large = client.get("/large", headers=headers)
+    assert large.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in large.headers["vary"]
+    assert len(large.json()["messages"]) == 20
+    print(f"   ✓ /large 已壓縮: {large.headers['content-length']} bytes")
+
+    small = client.get("/small", headers=headers)
+    assert "content-encoding" not in small.headers
+    print("   ✓ /small 低於門檻，未壓縮")
+
+    with client.stream("GET", "/stream", headers=headers) as stream:
+        assert "content-encoding" not in stream.headers
+        chunks = list(stream.iter_raw())
+    assert b"".join(chunks).count(b"event: chunk") == 3
+    print("   ✓ text/event-stream 未壓縮")
+    print()
+
+
+if __name__ == "__main__":
+    test_negotiate_encoding()
+    test_json_compressed_and_sse_untouched()
+
+    print("=" * 60)
+    print("所有壓縮測試完成！")
+    print("=" * 60)
@@ -0,0 +1,104 @@
+"""
+測試串流期限：首個片段、片段間隔與總時間逾時
+"""
+import asyncio
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.core.deadlines import StreamDeadline
+from app.routers.chat import generate_sse_stream
+from app.services.key_pool import ApiKeyPool
+from app.services.openai_service import OpenAIService
+from app.services.state_store import MemoryStateStore
+
+
+class FakeStream:
+    """依指定延遲逐塊回傳內容的上游串流替身"""
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.closed = False
+
+    async def __aiter__(self):
+        for delay, content in self.pieces:
+            await asyncio.sleep(delay)
+            delta = SimpleNamespace(content=content)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+    async def close(self):
+        self.closed = True
+
+
+def make_service(stream):
+    """建立使用假上游的 OpenAIService"""
+    async def create(**kwargs):
+        return stream
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return OpenAIService(MemoryStateStore(), ApiKeyPool(["test-key"], client_factory=lambda key: client))
+
+
+def collect(service, deadline):
+    """執行 SSE 串流並回傳 (事件名稱, 資料) 列表"""
+    async def run():
+        events = []
+        async for raw in generate_sse_stream(service, "你好", "gemini-2.0-flash", "s", deadline):
+            name, data = raw.strip().split("\n", 1)
+            events.append((name.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+        return events
+
+    return asyncio.run(run())
+
+
+def test_idle_deadline_cancels_stream():
+    """測試片段間隔過長時送出 deadline 錯誤事件並關閉上游"""
+    print("=" * 60)
+    print("測試: 片段間隔逾時")
+    print("=" * 60)
+
+    stream = FakeStream([(0, "你"), (0, "好"), (1.0, "！")])
+    service = make_service(stream)
+    events = collect(service, StreamDeadline(first_token=1.0, idle=0.05, total=5.0))
+
+    assert [name for name, _ in events] == ["start", "chunk", "chunk", "error"]
+    error = events[-1][1]
+    assert error["code"] == "deadline_exceeded" and error["deadline"] == "idle"
+    assert stream.closed
+    assert service.get_history("s") == []
+    print(f"   ✓ {error['error']}，上游已關閉，使用者訊息已移除")
+    print()
+
+
+def test_first_token_and_total_deadlines():
+    """測試首個片段與總時間期限，以及客戶端要求不能超過伺服器上限"""
+    print("=" * 60)
+    print("測試: 首個片段 / 總時間逾時")
+    print("=" * 60)
+
+    events = collect(make_service(FakeStream([(1.0, "慢")])), StreamDeadline(first_token=0.05))
+    assert events[-1][1]["deadline"] == "first_token"
+    print("   ✓ 首個片段逾時")
+
+    pieces = [(0.02, "x")] * 20
+    events = collect(make_service(FakeStream(pieces)), StreamDeadline(idle=0.5, total=0.1))
+    assert events[-1][1]["deadline"] == "total"
+    print("   ✓ 總時間逾時")
+
+    settings = SimpleNamespace(STREAM_FIRST_TOKEN_TIMEOUT=30.0, STREAM_IDLE_TIMEOUT=20.0, STREAM_TOTAL_TIMEOUT=60.0)
+    assert StreamDeadline.from_settings(settings, 10.0).total == 10.0
+    assert StreamDeadline.from_settings(settings, 600.0).total == 60.0
+    print("   ✓ X-Request-Timeout 以伺服器上限為準")
+    print()
+
+
+if __name__ == "__main__":
+    test_idle_deadline_cancels_stream()
+    test_first_token_and_total_deadlines()
+
+    print("=" * 60)
+    print("所有串流期限測試完成！")
+    print("=" * 60)
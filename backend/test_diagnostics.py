@@ -0,0 +1,91 @@
+"""
+測試 Admin 診斷工具：task 傾印、取樣 profiler、tracemalloc 快照比較
+"""
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.core import diagnostics
+from app.core.config import get_settings
+from app.routers import admin
+
+
+def test_dump_tasks_follows_async_generators():
+    """測試 task 傾印能展開到 async generator 內部並顯示存活時間"""
+    print("=" * 60)
+    print("測試: asyncio task 傾印")
+    print("=" * 60)
+
+    async def stuck_stream():
+        await asyncio.sleep(10)
+        yield "never"
+
+    async def consumer():
+        async for _ in stuck_stream():
+            pass
+
+    async def run():
+        diagnostics.install_task_tracking(asyncio.get_running_loop())
+        task = asyncio.create_task(consumer(), name="sse-consumer")
+        await asyncio.sleep(0.05)
+        tasks = diagnostics.dump_tasks()
+        task.cancel()
+        return tasks
+
+    tasks = {item["name"]: item for item in asyncio.run(run())}
+    consumer_task = tasks["sse-consumer"]
+    assert consumer_task["age_seconds"] >= 0.05
+    assert any("stuck_stream" in frame for frame in consumer_task["stack"])
+    print(f"   ✓ 堆疊深入 async generator：{consumer_task['stack'][-1].rsplit(' in ', 1)[-1]}")
+    print()
+
+
+def test_admin_endpoints():
+    """測試 token 保護、profiler 與 tracemalloc endpoint"""
+    print("=" * 60)
+    print("測試: Admin endpoints")
+    print("=" * 60)
+
+    test_app = FastAPI()
+    test_app.include_router(admin.router)
+    client = TestClient(test_app)
+
+    test_app.dependency_overrides[get_settings] = lambda: SimpleNamespace(ADMIN_TOKEN="")
+    assert client.get("/api/admin/tasks").status_code == 404
+    print("   ✓ 未設定 ADMIN_TOKEN 時停用")
+
+    test_app.dependency_overrides[get_settings] = lambda: SimpleNamespace(ADMIN_TOKEN="secret")
+    assert client.get("/api/admin/tasks", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    headers = {"Authorization": "Bearer secret"}
+    assert client.get("/api/admin/tasks", headers=headers).json()["count"] >= 1
+    print("   ✓ token 驗證")
+
+    response = client.post("/api/admin/profile?duration=0.1&interval_ms=5", headers=headers)
+    assert response.status_code == 200
+    line = response.text.splitlines()[0]
+    assert ";" in line and line.rsplit(" ", 1)[1].isdigit()
+    print(f"   ✓ profiler 輸出 {len(response.text.splitlines())} 條 collapsed stack")
+
+    assert client.get("/api/admin/tracemalloc/diff", headers=headers).status_code == 409
+    client.post("/api/admin/tracemalloc/start", headers=headers)
+    leak = [bytearray(1024) for _ in range(200)]
+    diff = client.get("/api/admin/tracemalloc/diff", headers=headers).json()
+    client.post("/api/admin/tracemalloc/stop", headers=headers)
+    assert any("test_diagnostics.py" in stat["location"] and stat["size_diff"] >= 200 * 1024 for stat in diff["stats"])
+    print(f"   ✓ tracemalloc 找到 {len(leak)} 個新配置的 bytearray")
+    print()
+
+
+if __name__ == "__main__":
+    test_dump_tasks_follows_async_generators()
+    test_admin_endpoints()
+
+    print("=" * 60)
+    print("所有診斷工具測試完成！")
+    print("=" * 60)
@@ -0,0 +1,266 @@
+"""
+測試優雅排空、readiness 與上游熔斷器
+"""
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fastapi.testclient import TestClient
+
+from app.core.admission import AdmissionController
+from app.core.circuit_breaker import CircuitBreaker, CircuitOpenError, get_circuit_breaker
+from app.core.deadlines import DeadlineExceeded, StreamDeadline
+from app.core.drain import DrainController, get_drain_controller
+from app.core.loop_monitor import LoopLagMonitor
+from app.main import app
+from app.routers.chat import generate_sse_stream
+from app.services.key_pool import ApiKeyPool
+from app.services.model_service import get_model_service
+from app.services.openai_service import OpenAIService
+from app.services.state_store import MemoryStateStore
+
+
+class SlowStream:
+    """每 0.05 秒產生一個片段的上游串流"""
+
+    def __init__(self, pieces=100):
+        self.pieces = pieces
+
+    async def __aiter__(self):
+        for i in range(self.pieces):
+            await asyncio.sleep(0.05)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=f"{i},"))])
+
+    async def close(self):
+        pass
+
+
+def make_service(create, breaker=None):
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    pool = ApiKeyPool(["k"], client_factory=lambda key: client)
+    return OpenAIService(MemoryStateStore(), pool, circuit_breaker=breaker or CircuitBreaker())
+
+
+def test_circuit_breaker():
+    """測試連續失敗熔斷、熔斷期間直接失敗，以及半開後恢復"""
+    print("=" * 60)
+    print("測試: 上游熔斷器")
+    print("=" * 60)
+
+    calls = []
+
+    async def create(**kwargs):
+        calls.append(kwargs)
+        raise RuntimeError("upstream 503")
+
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.1)
+    service = make_service(create, breaker)
+
+    async def send():
+        return [chunk async for chunk in service.generate_streaming_response("hi", "m", "s")]
+
+    for _ in range(3):
+        try:
+            asyncio.run(send())
+        except (RuntimeError, CircuitOpenError) as e:
+            last_error = e
+    assert breaker.state == "open" and len(calls) == 2
+    assert isinstance(last_error, CircuitOpenError) and service.get_history("s") == []
+    print("   ✓ 連續失敗 2 次後熔斷，之後的請求不送往上游")
+
+    time.sleep(0.12)
+    assert breaker.state == "half_open"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    time.sleep(0.12)
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0
+    print("   ✓ 半開時失敗再次熔斷，成功則恢復")
+    print()
+
+
+def test_client_errors_do_not_trip_breaker():
+    """測試客戶端縮短的期限、首個片段後的逾時與 4xx 不計入熔斷器，伺服器的首個片段期限則計入"""
+    print("=" * 60)
+    print("測試: 熔斷器只計入上游失敗")
+    print("=" * 60)
+
+    async def slow_create(**kwargs):
+        await asyncio.sleep(1)
+
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    service = make_service(slow_create, breaker)
+
+    async def send(deadline):
+        return [chunk async for chunk in service.generate_streaming_response("hi", "m", "s", deadline)]
+
+    # 相當於 X-Request-Timeout: 0.001
+    for _ in range(5):
+        try:
+            asyncio.run(send(StreamDeadline(first_token=30, total=0.001)))
+        except DeadlineExceeded as e:
+            assert e.deadline == "total"
+    assert breaker.state == "closed" and breaker.failures == 0
+    print("   ✓ 客戶端縮短的總時間期限重複到期，熔斷器維持 closed")
+
+    async def bad_request(**kwargs):
+        error = RuntimeError("invalid argument")
+        error.status_code = 400
+        raise error
+
+    service = make_service(bad_request, breaker)
+    for _ in range(5):
+        try:
+            asyncio.run(send(None))
+        except RuntimeError:
+            pass
+    assert breaker.state == "closed"
+    print("   ✓ 請求造成的 4xx 不計入")
+
+    async def stalls_after_first(**kwargs):
+        return SlowStream(pieces=1000)
+
+    service = make_service(stalls_after_first, breaker)
+    for _ in range(3):
+        try:
+            asyncio.run(send(StreamDeadline(first_token=30, idle=0.01)))
+        except DeadlineExceeded as e:
+            assert e.deadline == "idle"
+    assert breaker.state == "closed"
+    print("   ✓ 首個片段之後的逾時不計入")
+
+    service = make_service(slow_create, breaker)
+    for _ in range(2):
+        try:
+            asyncio.run(send(StreamDeadline(first_token=0.01)))
+        except DeadlineExceeded:
+            pass
+    assert breaker.state == "open"
+    print("   ✓ 伺服器設定的首個片段期限到期計入，連續 2 次後熔斷")
+    print()
+
+
+def test_drain_aborts_streams_after_timeout():
+    """測試排空期間拒絕新請求、逾時中止串流並保存部分回應"""
+    print("=" * 60)
+    print("測試: 排空逾時")
+    print("=" * 60)
+
+    async def create(**kwargs):
+        return SlowStream()
+
+    service = make_service(create)
+    drain = get_drain_controller()
+    drain.timeout = 0.3
+    admission = AdmissionController(LoopLagMonitor(), drain=drain)
+
+    async def run():
+        events = []
+
+        async def consume():
+            async for raw in generate_sse_stream(service, "你好", "m", "s"):
+                events.append(raw)
+
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.1)
+        assert drain.active_streams == 1
+        finished = asyncio.Event()
+        drain.start(finished.set)
+        assert admission.rejection_reason() == "draining"
+        await asyncio.wait_for(finished.wait(), 2.0)
+        await task
+        return events
+
+    try:
+        events = asyncio.run(run())
+    finally:
+        get_drain_controller.cache_clear()
+
+    name, data = events[-1].strip().split("\n", 1)
+    assert name == "event: error"
+    assert json.loads(data.removeprefix("data: "))["code"] == "shutting_down"
+    history = service.get_history("s")
+    assert [entry.role.value for entry in history] == ["user", "assistant"]
+    assert history[-1].content.startswith("0,1,")
+    print(f"   ✓ 送出 shutting_down 事件，部分回應已寫入歷史: {history[-1].content[:20]}…")
+    print()
+
+
+def test_sigterm_handler_chains_after_drain():
+    """測試 SIGTERM 先排空，完成後才交給原本的處理器"""
+    print("=" * 60)
+    print("測試: SIGTERM 處理器")
+    print("=" * 60)
+
+    forwarded = []
+    original = signal.signal(signal.SIGTERM, lambda signum, frame: forwarded.append(signum))
+    drain = DrainController(timeout=1.0)
+
+    async def run():
+        assert drain.install_signal_handler(asyncio.get_running_loop())
+        stream = asyncio.current_task()
+        drain._streams.add(stream)
+        os.kill(os.getpid(), signal.SIGTERM)
+        await asyncio.sleep(0.2)
+        assert drain.draining and forwarded == []
+        drain.exit_stream(stream)
+        await asyncio.sleep(0.3)
+
+    try:
+        asyncio.run(run())
+    finally:
+        signal.signal(signal.SIGTERM, original)
+    assert forwarded == [signal.SIGTERM]
+    print("   ✓ 串流結束後才呼叫原本的 SIGTERM 處理器")
+    print()
+
+
+def test_readiness_endpoint():
+    """測試 readiness 依目錄、熔斷器與排空狀態回報"""
+    print("=" * 60)
+    print("測試: /health/ready 與 /health/live")
+    print("=" * 60)
+
+    prewarm_calls = []
+    model_service = SimpleNamespace(catalog_warm=False, ensure_prewarm=lambda: prewarm_calls.append(1))
+    breaker, drain = CircuitBreaker(failure_threshold=1, reset_timeout=60), DrainController()
+    app.dependency_overrides.update({
+        get_model_service: lambda: model_service,
+        get_circuit_breaker: lambda: breaker,
+        get_drain_controller: lambda: drain,
+    })
+    client = TestClient(app)
+    try:
+        response = client.get("/health/ready")
+        assert response.status_code == 503 and prewarm_calls == [1]
+        model_service.catalog_warm = True
+        assert client.get("/health/ready").status_code == 200
+        breaker.record_failure()
+        assert client.get("/health/ready").json()["checks"]["upstream_circuit"] == "open"
+        breaker.record_success()
+        drain.draining = True
+        assert client.get("/health/ready").status_code == 503
+        assert client.get("/health/live").status_code == 200
+    finally:
+        app.dependency_overrides.clear()
+    print("   ✓ 目錄未載入、熔斷或排空時回報 503，liveness 不受影響")
+    print()
+
+
+if __name__ == "__main__":
+    test_circuit_breaker()
+    test_client_errors_do_not_trip_breaker()
+    test_drain_aborts_streams_after_timeout()
+    test_sigterm_handler_chains_after_drain()
+    test_readiness_endpoint()
+
+    print("=" * 60)
+    print("所有排空與 readiness 測試完成！")
+    print("=" * 60)
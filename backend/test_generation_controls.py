@@ -0,0 +1,175 @@
+"""
+測試請求層級的生成參數（max_tokens、停止序列、取樣參數）與伺服器端的模型上限
+"""
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.core.config import DEFAULT_GENERATION_LIMITS, GENERATION_LIMITS, get_generation_limits
+from app.routers import chat
+from app.schemas.chat import GenerationControls
+from app.services.key_pool import ApiKeyPool
+from app.services.model_service import get_model_service
+from app.services.openai_service import OpenAIService, generation_params, get_openai_service
+from app.services.state_store import MemoryStateStore
+
+
+class FakeStream:
+    """固定內容的上游串流"""
+
+    async def __aiter__(self):
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="台北"))])
+
+    async def close(self):
+        pass
+
+
+def make_service(calls):
+    """記錄每次上游呼叫參數的服務"""
+    async def create(**kwargs):
+        calls.append(kwargs)
+        return FakeStream()
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return OpenAIService(MemoryStateStore(), ApiKeyPool(["k"], client_factory=lambda key: client))
+
+
+def test_generation_params():
+    """測試預設值、覆寫與模型上限"""
+    print("=" * 60)
+    print("測試: 生成參數與模型上限")
+    print("=" * 60)
+
+    # 未指定時與原本固定的參數相同
+    assert generation_params("gemini-2.0-flash") == {"temperature": 0.7, "top_p": 0.95, "max_tokens": 4096}
+    params = generation_params("gemini-2.0-flash", GenerationControls(max_tokens=16, stop=["\n"], temperature=0))
+    assert params == {"temperature": 0, "top_p": 0.95, "max_tokens": 16, "stop": ["\n"]}
+    print("   ✓ 未指定時使用模型預設值，temperature=0 不被預設值取代")
+
+    limits = get_generation_limits("gemini-2.0-flash")
+    for controls in (
+        GenerationControls(max_tokens=limits["max_tokens"] + 1),
+        GenerationControls(temperature=limits["max_temperature"] + 0.5),
+        GenerationControls(stop=[str(i) for i in range(limits["max_stop_sequences"] + 1)]),
+    ):
+        try:
+            generation_params("gemini-2.0-flash", controls)
+            raise AssertionError("應拒絕超過上限的參數")
+        except ValueError as e:
+            print(f"   ✓ 拒絕: {e}")
+    assert get_generation_limits("gemini-exp-unknown") == DEFAULT_GENERATION_LIMITS
+    print("   ✓ 未列出的模型使用預設上限")
+    assert get_generation_limits("gemini-2.0-flash") is DEFAULT_GENERATION_LIMITS
+    assert all(entry is not DEFAULT_GENERATION_LIMITS for entry in GENERATION_LIMITS.values())
+    print("   ✓ 覆寫的模型為獨立的設定，調整一個模型不影響其他模型")
+
+    # 同一個請求在不同模型的上限下結果不同
+    controls = GenerationControls(max_tokens=6000)
+    assert generation_params("gemini-2.0-flash", controls)["max_tokens"] == 6000
+    try:
+        generation_params("gemini-1.5-pro", controls)
+        raise AssertionError("gemini-1.5-pro 應拒絕 6000 tokens")
+    except ValueError as e:
+        print(f"   ✓ gemini-2.0-flash 接受 6000 tokens，gemini-1.5-pro 拒絕: {e}")
+    assert generation_params("gemini-1.5-pro")["max_tokens"] == 2048
+    assert generation_params("gemini-1.5-flash")["max_tokens"] == 4096
+    print("   ✓ 未指定時各模型使用各自的預設 max_tokens")
+    print()
+
+
+def test_stream_completion_passes_params():
+    """測試參數送到上游，且超過上限時不呼叫上游"""
+    print("=" * 60)
+    print("測試: 上游呼叫參數")
+    print("=" * 60)
+
+    calls = []
+    service = make_service(calls)
+
+    async def collect(generator):
+        return "".join([chunk async for chunk in generator])
+
+    controls = GenerationControls(max_tokens=8, stop=["。"], top_p=0.5)
+    assert asyncio.run(collect(service.generate_streaming_response("首都？", "m", "s", generation=controls))) == "台北"
+    assert calls[-1]["max_tokens"] == 8 and calls[-1]["stop"] == ["。"] and calls[-1]["top_p"] == 0.5
+    assert calls[-1]["temperature"] == 0.7
+    print("   ✓ max_tokens、stop 與 top_p 送到上游")
+
+    try:
+        asyncio.run(collect(service.stream_completion(
+            [{"role": "user", "content": "hi"}], "m", generation=GenerationControls(max_tokens=10 ** 6)
+        )))
+        raise AssertionError("應拒絕超過上限的 max_tokens")
+    except ValueError:
+        pass
+    assert len(calls) == 1 and service.circuit_breaker.failures == 0
+    print("   ✓ 超過上限時不呼叫上游，也不計入熔斷器")
+    print()
+
+
+def test_endpoints_validate_caps():
+    """測試 /send、/regenerate 與 /compare 的驗證"""
+    print("=" * 60)
+    print("測試: API 驗證")
+    print("=" * 60)
+
+    calls = []
+    service = make_service(calls)
+
+    async def validate_model(model):
+        return True
+
+    test_app = FastAPI()
+    test_app.include_router(chat.router)
+    test_app.dependency_overrides[get_openai_service] = lambda: service
+    test_app.dependency_overrides[get_model_service] = lambda: SimpleNamespace(validate_model=validate_model)
+    client = TestClient(test_app)
+
+    body = {"message": "台灣的首都？", "model": "gemini-2.0-flash", "session_id": "g",
+            "max_tokens": 16, "stop": ["\n"], "temperature": 0}
+    with client.stream("POST", "/api/chat/send", json=body) as response:
+        assert response.status_code == 200 and "event: done" in "".join(response.iter_text())
+    assert calls[-1]["max_tokens"] == 16 and calls[-1]["temperature"] == 0
+    print("   ✓ /send 套用請求的生成參數")
+
+    response = client.post("/api/chat/send", json={**body, "max_tokens": 100000})
+    assert response.status_code == 400 and "max_tokens" in response.json()["detail"]
+    assert client.post("/api/chat/send", json={**body, "top_p": 1.5}).status_code == 422
+    assert client.post("/api/chat/send", json={**body, "stop": [""]}).status_code == 422
+    assert len(calls) == 1
+    print("   ✓ 超過模型上限返回 400，超出範圍返回 422，皆不呼叫上游")
+
+    with client.stream("POST", "/api/chat/regenerate", json={"session_id": "g", "max_tokens": 4}) as response:
+        assert response.status_code == 200 and "event: done" in "".join(response.iter_text())
+    assert calls[-1]["max_tokens"] == 4 and "stop" not in calls[-1]
+    print("   ✓ /regenerate 套用請求的生成參數")
+
+    compare = {"message": "首都？", "models": ["gemini-2.0-flash", "gemini-1.5-pro"], "max_tokens": 8, "top_p": 0.5}
+    response = client.post("/api/chat/compare", json=compare)
+    assert response.status_code == 200 and "event: done" in response.text
+    assert sorted(call["model"] for call in calls[-2:]) == ["gemini-1.5-pro", "gemini-2.0-flash"]
+    assert all(call["max_tokens"] == 8 and call["top_p"] == 0.5 for call in calls[-2:])
+    response = client.post("/api/chat/compare", json={**compare, "max_tokens": 100000})
+    assert response.status_code == 400 and "max_tokens" in response.json()["detail"]
+    # 只有 gemini-1.5-pro 超過上限時同樣整個請求拒絕
+    response = client.post("/api/chat/compare", json={**compare, "max_tokens": 6000})
+    assert response.status_code == 400 and "gemini-1.5-pro" in response.json()["detail"]
+    assert len(calls) == 4
+    print("   ✓ /compare 將生成參數套用於每個模型，超過上限時不呼叫上游")
+    print()
+
+
+if __name__ == "__main__":
+    test_generation_params()
+    test_stream_completion_passes_params()
+    test_endpoints_validate_caps()
+
+    print("=" * 60)
+    print("所有生成參數測試完成！")
+    print("=" * 60)
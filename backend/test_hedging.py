@@ -0,0 +1,124 @@
+"""
+測試對沖請求：超過 TTFT 門檻時送出第二個請求、先到者勝出與預算限制
+"""
+import asyncio
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.core.metrics import metrics
+from app.services.hedging import HedgePolicy
+from app.services.key_pool import ApiKeyPool
+from app.services.model_selector import ModelSelector
+from app.services.openai_service import OpenAIService
+from app.services.state_store import MemoryStateStore
+
+
+class FakeStream:
+    """首個片段前等待 delay 秒（或拋出錯誤）的上游串流"""
+
+    def __init__(self, name, delay, fail=False):
+        self.name = name
+        self.delay = delay
+        self.fail = fail
+        self.closed = False
+
+    async def __aiter__(self):
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError(f"{self.name} 連線中斷")
+        for piece in (self.name, "！"):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+
+    async def close(self):
+        self.closed = True
+
+
+def make_service(streams, policy, samples=30):
+    """依呼叫順序回傳 streams 的服務，並預先填入 0.1 秒左右的 TTFT 樣本"""
+    queue = list(streams)
+
+    async def create(**kwargs):
+        return queue.pop(0)
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    selector = ModelSelector()
+    for i in range(samples):
+        selector.record_success("m", 0.08 + i / 1000, 100)
+    pool = ApiKeyPool(["k1", "k2"], client_factory=lambda key: client)
+    return OpenAIService(MemoryStateStore(), pool, selector, policy)
+
+
+def collect(service):
+    async def run():
+        return [chunk async for chunk in service.stream_completion([{"role": "user", "content": "hi"}], "m")]
+
+    return asyncio.run(run())
+
+
+def test_hedge_wins_when_primary_is_slow():
+    """測試主請求過慢時對沖請求勝出，主請求被取消並歸還 key"""
+    print("=" * 60)
+    print("測試: 對沖請求勝出")
+    print("=" * 60)
+
+    slow, fast = FakeStream("主請求", 2.0), FakeStream("對沖", 0.01)
+    policy = HedgePolicy(enabled=True, quantile=0.9, budget_ratio=1.0, min_delay=0.05)
+    service = make_service([slow, fast], policy)
+
+    started = time.monotonic()
+    assert collect(service) == ["對沖", "！"]
+    elapsed = time.monotonic() - started
+    assert elapsed < 0.5, elapsed
+    assert slow.closed and fast.closed
+    assert all(slot.in_flight == 0 for slot in service.key_pool.slots)
+    assert 'chat_hedge_wins_total{model="m"} 1.0' in metrics.render()
+    print(f"   ✓ {elapsed:.2f} 秒內由對沖請求完成，落敗的請求已關閉並歸還 key")
+
+    primary, hedge = FakeStream("主請求", 0.2), FakeStream("對沖", 0.3)
+    service = make_service([primary, hedge], HedgePolicy(enabled=True, budget_ratio=1.0, min_delay=0.05))
+    assert collect(service) == ["主請求", "！"] and hedge.closed
+    print("   ✓ 主請求先產生首個片段時保留主請求")
+
+    failing, backup = FakeStream("主請求", 0.3, fail=True), FakeStream("對沖", 0.3)
+    service = make_service([failing, backup], HedgePolicy(enabled=True, budget_ratio=1.0, min_delay=0.05))
+    assert collect(service) == ["對沖", "！"]
+    print("   ✓ 已送出對沖後主請求失敗時，改用對沖請求的結果")
+    print()
+
+
+def test_hedge_budget_and_samples():
+    """測試樣本不足或預算用完時不對沖"""
+    print("=" * 60)
+    print("測試: 對沖條件與預算")
+    print("=" * 60)
+
+    policy = HedgePolicy(enabled=True, budget_ratio=1.0, min_delay=0.05)
+    service = make_service([FakeStream("主請求", 0.3)], policy, samples=5)
+    assert collect(service) == ["主請求", "！"]
+    print("   ✓ TTFT 樣本不足時不對沖")
+
+    policy = HedgePolicy(enabled=True, budget_ratio=0.25)
+    profile = make_service([], policy).model_selector.profile("m")
+    decisions = []
+    for _ in range(8):
+        assert policy.delay_for("m", profile) is not None
+        decisions.append(policy.try_hedge("m"))
+    assert decisions.count(True) == 2
+    print(f"   ✓ budget_ratio=0.25 時 8 個慢請求只對沖 {decisions.count(True)} 次")
+
+    assert HedgePolicy(enabled=False).delay_for("m", profile) is None
+    print("   ✓ 未啟用時不對沖")
+    print()
+
+
+if __name__ == "__main__":
+    test_hedge_wins_when_primary_is_slow()
+    test_hedge_budget_and_samples()
+
+    print("=" * 60)
+    print("所有對沖請求測試完成！")
+    print("=" * 60)
@@ -0,0 +1,113 @@
+"""
+測試對話歷史的串流匯出 / 匯入
+"""
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.core.config import get_settings
+from app.routers import admin
+from app.schemas.chat import MessageRole
+from app.services.history import HistoryEntry
+from app.services.history_transfer import export_ndjson, import_ndjson
+from app.services.state_store import MemoryStateStore, SQLiteStateStore, get_state_store
+
+
+def make_source() -> MemoryStateStore:
+    """建立含兩個 session 的來源儲存"""
+    store = MemoryStateStore()
+    for i in range(25):
+        store.append_message("a", HistoryEntry(MessageRole.USER, f"問題 {i}", created_at=1700000000 + i))
+        store.append_message("b", HistoryEntry(MessageRole.ASSISTANT, f"回答 {i}\n含換行", created_at=1700000000 + i))
+    return store
+
+
+def snapshot(store, session_id):
+    return [(e.role, e.content, e.created_at) for e in store.get_messages(session_id)]
+
+
+def test_round_trip_between_backends():
+    """測試 memory → sqlite 匯出再匯入，內容、順序與時間戳記一致"""
+    print("=" * 60)
+    print("測試: 匯出 / 匯入往返")
+    print("=" * 60)
+
+    source = make_source()
+    for compression in ("none", "gzip"):
+        chunks = list(export_ndjson(source, compression=compression, batch_size=7))
+        assert len(chunks) > 1
+        target = SQLiteStateStore(":memory:")
+        # 以 3 bytes 為單位餵入，確保跨片段的行與壓縮檔頭都能正確處理
+        data = b"".join(chunks)
+        imported = import_ndjson(target, (data[i:i + 3] for i in range(0, len(data), 3)), batch_size=10)
+        assert imported == 50
+        assert snapshot(target, "a") == snapshot(source, "a")
+        assert snapshot(target, "b") == snapshot(source, "b")
+        assert target.search_messages("回答")[0] == 25
+        target.close()
+        print(f"   ✓ {compression}: {len(chunks)} 個片段，匯入 {imported} 筆且可搜尋")
+
+    only_a = b"".join(export_ndjson(source, session_id="a"))
+    assert only_a.count(b"\n") == 25
+    print("   ✓ 可僅匯出單一 session")
+    print()
+
+
+def test_admin_export_import_endpoints():
+    """測試 admin export / import endpoint 與錯誤處理"""
+    print("=" * 60)
+    print("測試: export / import endpoints")
+    print("=" * 60)
+
+    source, target = make_source(), MemoryStateStore()
+    test_app = FastAPI()
+    test_app.include_router(admin.router)
+    test_app.dependency_overrides[get_settings] = lambda: SimpleNamespace(ADMIN_TOKEN="secret")
+    headers = {"Authorization": "Bearer secret"}
+    client = TestClient(test_app)
+
+    test_app.dependency_overrides[get_state_store] = lambda: source
+    exported = client.get("/api/admin/export?compression=gzip", headers=headers)
+    assert exported.headers["content-type"] == "application/gzip"
+    assert exported.content[:2] == b"\x1f\x8b"
+
+    test_app.dependency_overrides[get_state_store] = lambda: target
+    on_loop = []
+    append_messages = target.append_messages
+
+    def record_thread(*args):
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        return append_messages(*args)
+
+    target.append_messages = record_thread
+    response = client.post("/api/admin/import?batch_size=8", headers=headers, content=exported.content)
+    assert response.json() == {"imported": 50}
+    assert snapshot(target, "b") == snapshot(source, "b")
+    print("   ✓ gzip 匯出後匯入另一個實例")
+
+    assert on_loop and not any(on_loop)
+    print(f"   ✓ {len(on_loop)} 次批次寫入皆在 event loop 以外的 thread 執行")
+
+    bad = client.post("/api/admin/import", headers=headers, content=b'{"session_id": "x", "role": "bot"}\n')
+    assert bad.status_code == 400
+    print("   ✓ 格式錯誤時返回 400")
+    print()
+
+
+if __name__ == "__main__":
+    test_round_trip_between_backends()
+    test_admin_export_import_endpoints()
+
+    print("=" * 60)
+    print("所有匯出 / 匯入測試完成！")
+    print("=" * 60)
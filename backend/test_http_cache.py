@@ -0,0 +1,120 @@
+"""
+測試預先編碼的 /api/chat/models 與 /openapi.json 回應（ETag / 304）
+"""
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fastapi.testclient import TestClient
+
+from app.core.http_cache import CachedJSON, etag_matches
+from app.main import app
+from app.services.model_service import MODEL_CATALOG_CACHE_KEY, get_model_service
+from app.services.state_store import get_state_store
+
+
+def test_etag_matching():
+    """測試 If-None-Match 弱比較"""
+    print("=" * 60)
+    print("測試: ETag 比對")
+    print("=" * 60)
+
+    payload = CachedJSON.from_content({"models": [], "default_model": "gemini-2.0-flash"})
+    assert etag_matches(payload.etag, payload.etag)
+    assert etag_matches(f'"other", W/{payload.etag}', payload.etag)
+    assert etag_matches("*", payload.etag)
+    assert not etag_matches(None, payload.etag)
+    assert not etag_matches('"other"', payload.etag)
+    print(f"   ✓ ETag: {payload.etag}")
+    print()
+
+
+def test_models_endpoint_conditional_request():
+    """測試模型列表回應帶 ETag，且重複請求回傳 304"""
+    print("=" * 60)
+    print("測試: GET /api/chat/models 條件請求")
+    print("=" * 60)
+
+    # 直接寫入共享快取，避免呼叫 Google API
+    get_state_store().cache_set(
+        MODEL_CATALOG_CACHE_KEY,
+        {"version": "test-v1", "models": [{"id": "gemini-2.0-flash", "name": "Gemini 2.0 Flash",
+                                           "category": "recommended", "description": "",
+                                           "context_window": 1000000}]},
+        ttl=60
+    )
+    get_model_service.cache_clear()
+
+    with TestClient(app) as client:
+        first = client.get("/api/chat/models")
+        assert first.status_code == 200
+        assert first.json()["models"][0]["id"] == "gemini-2.0-flash"
+        etag = first.headers["etag"]
+        print(f"   ✓ 200, ETag: {etag}, Cache-Control: {first.headers['cache-control']}")
+
+        second = client.get("/api/chat/models", headers={"If-None-Match": etag})
+        assert second.status_code == 304
+        assert second.content == b""
+        print("   ✓ 304 Not Modified")
+
+    get_model_service.cache_clear()
+    print()
+
+
+def test_openapi_conditional_request():
+    """測試 OpenAPI JSON 快取與 304"""
+    print("=" * 60)
+    print("測試: GET /openapi.json 條件請求")
+    print("=" * 60)
+
+    with TestClient(app) as client:
+        first = client.get("/openapi.json")
+        assert first.status_code == 200
+        assert "/api/chat/send" in first.json()["paths"]
+
+        second = client.get("/openapi.json", headers={"If-None-Match": first.headers["etag"]})
+        assert second.status_code == 304
+        assert client.get("/docs").status_code == 200
+        print("   ✓ 200 → 304，/docs 正常")
+
+    print()
+
+
+def test_openapi_without_settings():
+    """測試未設定 GEMINI_API_KEY 時仍可匯入 app.main 並產生 OpenAPI 文件"""
+    print("=" * 60)
+    print("測試: 匯入 app.main 不需要設定")
+    print("=" * 60)
+
+    env = {k: v for k, v in os.environ.items() if k not in ("GEMINI_API_KEY", "GEMINI_API_KEYS")}
+    env["PYTHONPATH"] = str(Path(__file__).parent)
+    script = "from app.main import app; assert app.openapi()['paths']; print(app.title)"
+    # 在暫存目錄執行，避免讀到 backend/.env
+    with tempfile.TemporaryDirectory() as tmp:
+        result = subprocess.run(
+            [sys.executable, "-c", script], cwd=tmp, env=env, capture_output=True, text=True
+        )
+    assert result.returncode == 0, result.stderr
+    print(f"   ✓ {result.stdout.strip()}")
+
+    with TestClient(app) as client:
+        assert client.get("/health").status_code == 200
+    middleware = [m.cls.__name__ for m in app.user_middleware]
+    assert "AdmissionMiddleware" in middleware and "CORSMiddleware" in middleware
+    print(f"   ✓ 啟動後依設定加入 middleware: {middleware}")
+    print()
+
+
+if __name__ == "__main__":
+    test_etag_matching()
+    test_models_endpoint_conditional_request()
+    test_openapi_conditional_request()
+    test_openapi_without_settings()
+
+    print("=" * 60)
+    print("所有 HTTP 快取測試完成！")
+    print("=" * 60)
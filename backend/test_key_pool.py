@@ -0,0 +1,102 @@
+"""
+測試 API key 池：負載分配、429 冷卻與自動改用下一組 key
+"""
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.core.metrics import metrics
+from app.services.key_pool import ApiKeyPool
+from app.services.openai_service import OpenAIService
+from app.services.state_store import MemoryStateStore
+
+
+class RateLimitError(Exception):
+    """模擬 openai.RateLimitError（帶有 response.headers）"""
+
+    def __init__(self):
+        super().__init__("Error code: 429 - RESOURCE_EXHAUSTED")
+        self.response = SimpleNamespace(headers={"retry-after": "30"})
+
+
+class FakeStream:
+    async def __aiter__(self):
+        delta = SimpleNamespace(content="好")
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+    async def close(self):
+        pass
+
+
+def fake_client(api_key: str, calls: list):
+    """key 名稱以 limited 開頭的客戶端一律回傳 429"""
+    async def create(**kwargs):
+        calls.append(api_key)
+        if api_key.startswith("limited"):
+            raise RateLimitError()
+        return FakeStream()
+
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+def test_selection_strategies():
+    """測試 least_loaded 與 round_robin 的分配方式"""
+    print("=" * 60)
+    print("測試: key 選擇策略")
+    print("=" * 60)
+
+    pool = ApiKeyPool(["a", "b", "c"], strategy="least_loaded", client_factory=lambda key: key)
+    leased = [pool.acquire() for _ in range(3)]
+    assert sorted(slot.api_key for slot in leased) == ["a", "b", "c"]
+    pool.release(leased[1])
+    assert pool.acquire().api_key == leased[1].api_key
+    print("   ✓ least_loaded 選擇進行中請求最少的 key")
+
+    pool = ApiKeyPool(["a", "b"], strategy="round_robin", client_factory=lambda key: key)
+    assert [pool.select().api_key for _ in range(4)] == ["a", "b", "a", "b"]
+    pool.mark_rate_limited(pool.slots[0])
+    assert [pool.select().api_key for _ in range(2)] == ["b", "b"]
+    print("   ✓ round_robin 輪替，冷卻中的 key 不會被選中")
+    print()
+
+
+def test_rate_limited_key_fails_over():
+    """測試 429 時改用下一組 key，並記錄冷卻與 metrics"""
+    print("=" * 60)
+    print("測試: 429 自動改用下一組 key")
+    print("=" * 60)
+
+    calls: list = []
+    pool = ApiKeyPool(["limited-1", "ok-2"], client_factory=lambda key: fake_client(key, calls))
+    service = OpenAIService(MemoryStateStore(), pool)
+
+    async def run():
+        return [chunk async for chunk in service.generate_streaming_response("你好", "gemini-2.0-flash", "s")]
+
+    assert asyncio.run(run()) == ["好"]
+    assert calls == ["limited-1", "ok-2"]
+    assert pool.slots[0].cooldown_until > 0 and all(slot.in_flight == 0 for slot in pool.slots)
+    print("   ✓ 第一組 key 收到 429 後由第二組完成回應")
+
+    calls.clear()
+    asyncio.run(run())
+    assert calls == ["ok-2"]
+    print("   ✓ 冷卻期間不再使用收到 429 的 key")
+
+    exposition = metrics.render()
+    assert 'gemini_key_rate_limited_total{key="key0"}' in exposition
+    assert "limited-1" not in exposition
+    print("   ✓ per-key metrics（不含 key 本身）")
+    print()
+
+
+if __name__ == "__main__":
+    test_selection_strategies()
+    test_rate_limited_key_fails_over()
+
+    print("=" * 60)
+    print("所有 API key 池測試完成！")
+    print("=" * 60)
@@ -0,0 +1,160 @@
+"""
+測試伺服器端增量 Markdown 渲染
+"""
+import asyncio
+import html
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.routers.chat import generate_sse_stream
+from app.schemas.chat import MessageRole
+from app.services.history import HistoryEntry
+from app.services.key_pool import ApiKeyPool
+from app.services.markdown_renderer import (
+    IncrementalMarkdownRenderer,
+    cache_rendered_html,
+    find_block_boundary,
+    get_rendered_html,
+    markdown_available,
+    render_blocks
+)
+from app.services.openai_service import OpenAIService
+from app.services.state_store import MemoryStateStore
+
+
+def fake_render(block: str) -> str:
+    """以 <md> 包裝原文的渲染替身（只測試區塊切分）"""
+    return f"<md>{html.escape(block)}</md>"
+
+
+def test_block_boundaries():
+    """測試只在安全的位置切分區塊"""
+    print("=" * 60)
+    print("測試: 區塊切分")
+    print("=" * 60)
+
+    assert find_block_boundary("# 標題\n\n第一段") == 0
+    assert find_block_boundary("# 標題\n\n第一段\n") == len("# 標題\n\n")
+    print("   ✓ 空行後的新區塊收到完整一行才定稿")
+
+    fenced = "```python\nx = 1\n\ny = 2\n"
+    assert find_block_boundary(fenced) == 0
+    assert find_block_boundary(fenced + "```\n\n後文\n") == len(fenced + "```\n\n")
+    print("   ✓ 不切開圍欄程式碼區塊")
+
+    assert find_block_boundary("- a\n\n- b\n\n  延續段落\n") == 0
+    print("   ✓ 不切開清單與清單延續段落")
+
+    renderer = IncrementalMarkdownRenderer(render=fake_render)
+    text = "# 標題\n\n第一段\n\n```\ncode\n\n```\n\n結尾"
+    emitted = []
+    for i in range(0, len(text), 3):
+        emitted.extend(renderer.feed(text[i:i + 3]))
+    emitted.extend(renderer.flush())
+    assert "".join(emitted) == renderer.html
+    assert html.unescape(renderer.html.replace("<md>", "").replace("</md>", "")) == text
+    print(f"   ✓ 逐段輸入產生 {len(emitted)} 個區塊，內容完整無重複")
+
+    assert len(emitted) == 3 and render_blocks(text, render=fake_render) == renderer.html
+    print("   ✓ 每個區塊分別渲染，切分與串流的片段大小無關")
+    print()
+
+
+def test_feed_scans_each_line_once():
+    """測試長程式碼區塊內沒有可定稿的區塊時，每一行仍只掃描一次"""
+    print("=" * 60)
+    print("測試: 增量掃描")
+    print("=" * 60)
+
+    renderer = IncrementalMarkdownRenderer(render=fake_render)
+    scanned = []
+    starts_block = renderer._scanner.starts_block
+    renderer._scanner.starts_block = lambda line: scanned.append(line) or starts_block(line)
+
+    lines = ["```python\n"] + [f"x{i} = {i}\n" for i in range(5000)] + ["```\n", "\n", "後文\n"]
+    text = "".join(lines)
+    emitted = []
+    for i in range(0, len(text), 7):
+        emitted.extend(renderer.feed(text[i:i + 7]))
+    assert len(scanned) == len(lines) and scanned == lines
+    assert len(emitted) == 1 and html.unescape(emitted[0][4:-5]) == "".join(lines[:-1])
+    emitted.extend(renderer.flush())
+    assert html.unescape(renderer.html.replace("<md>", "").replace("</md>", "")) == text
+    print(f"   ✓ {len(text)} 字元分 {len(text) // 7 + 1} 段輸入，{len(lines)} 行各掃描一次")
+    print()
+
+
+def test_stream_emits_blocks_and_caches_html():
+    """測試 SSE 串流送出 block 事件並快取完整 HTML"""
+    print("=" * 60)
+    print("測試: block 事件與 HTML 快取")
+    print("=" * 60)
+
+    if not markdown_available():
+        print("   - 未安裝 markdown-it-py，略過")
+        return
+
+    class FakeService:
+        store = MemoryStateStore()
+
+        async def generate_streaming_response(self, user_message, model, session_id, deadline, pipeline=None, generation=None):
+            for piece in ["## 標題\n", "\n**粗體**", "段落\n\n<script>", "alert(1)</script>"]:
+                yield piece
+
+    service = FakeService()
+    renderer = IncrementalMarkdownRenderer()
+
+    async def run():
+        return [raw async for raw in generate_sse_stream(service, "hi", "m", "s", None, renderer)]
+
+    events = asyncio.run(run())
+    blocks = [json.loads(e.split("data: ", 1)[1]) for e in events if e.startswith("event: block")]
+    assert [b["index"] for b in blocks] == list(range(len(blocks)))
+    assert blocks[0]["html"] == "<h2>標題</h2>\n"
+    assert "&lt;script&gt;" in blocks[-1]["html"]
+    print(f"   ✓ {len(blocks)} 個 block 事件，原始 HTML 已跳脫")
+
+    content = "## 標題\n\n**粗體**段落\n\n<script>alert(1)</script>"
+    cached = get_rendered_html(service.store, content, render=lambda _: "不應重新渲染")
+    assert cached == renderer.html
+    print("   ✓ 重新載入歷史時直接取用快取的 HTML")
+
+    assert get_rendered_html(MemoryStateStore(), content) == renderer.html
+    print("   ✓ 快取未命中時重新渲染的結果與串流寫入的 HTML 相同")
+    print()
+
+
+def test_clear_history_drops_cached_html():
+    """測試清除對話時一併刪除各分支回應的渲染快取"""
+    print("=" * 60)
+    print("測試: 清除對話的渲染快取")
+    print("=" * 60)
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=None)))
+    service = OpenAIService(MemoryStateStore(), ApiKeyPool(["k"], client_factory=lambda key: client))
+    question = service.store.append_message("s", HistoryEntry(MessageRole.USER, "問題"))
+    for reply in ("回答一", "回答二"):
+        service.store.append_message("s", HistoryEntry(MessageRole.ASSISTANT, reply, parent_id=question.id))
+        cache_rendered_html(service.store, reply, f"<p>{reply}</p>")
+    cache_rendered_html(service.store, "其他對話", "<p>其他對話</p>")
+
+    service.clear_history("s")
+    assert len(service.store._cache) == 1
+    assert get_rendered_html(service.store, "其他對話", render=lambda _: "不應重新渲染") == "<p>其他對話</p>"
+    print("   ✓ 兩個分支的回應快取皆已刪除，其他對話的快取保留")
+    print()
+
+
+if __name__ == "__main__":
+    test_block_boundaries()
+    test_feed_scans_each_line_once()
+    test_stream_emits_blocks_and_caches_html()
+    test_clear_history_drops_cached_html()
+
+    print("=" * 60)
+    print("所有 Markdown 渲染測試完成！")
+    print("=" * 60)
@@ -0,0 +1,272 @@
+"""
+測試延遲感知的 auto 模型選擇
+"""
+import asyncio
+import json
+import random
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.core.circuit_breaker import CircuitBreaker
+from app.core.config import AVAILABLE_MODELS, Settings, get_settings
+from app.core.deadlines import DeadlineExceeded, StreamDeadline
+from app.routers import chat
+from app.routers.chat import generate_sse_stream
+from app.schemas.chat import MessageRole
+from app.services.history import HistoryEntry
+from app.services.key_pool import ApiKeyPool
+from app.services.model_selector import ModelSelector
+from app.services.model_service import get_model_service
+from app.services.openai_service import OpenAIService, get_openai_service
+from app.services.state_store import MemoryStateStore
+
+
+MODELS = list(AVAILABLE_MODELS.values())
+
+
+def test_choose_by_expected_latency():
+    """測試選擇期望 TTFT 最低者，且 prompt 長度與錯誤率會影響選擇"""
+    print("=" * 60)
+    print("測試: 依延遲統計選擇模型")
+    print("=" * 60)
+
+    selector = ModelSelector(explore_ratio=0, rng=random.Random(0))
+    first = selector.choose(MODELS, 100, "stable")
+    assert first.model == "gemini-1.5-flash" and first.reason == "prior"
+    print("   ✓ 尚無統計時選擇符合條件的最低等級")
+
+    # flash 短 prompt 很快但隨長度明顯變慢；pro 起步較慢但幾乎不受長度影響
+    for chars in (1000, 5000, 20000, 40000):
+        selector.record_success("gemini-1.5-flash", 0.2 + chars / 10000, chars)
+        selector.record_success("gemini-1.5-pro", 1.0 + chars / 200000, chars)
+        selector.record_success("gemini-2.0-flash", 3.0, chars)
+
+    short = selector.choose(MODELS, 2000, "stable")
+    long = selector.choose(MODELS, 40000, "stable")
+    assert short.model == "gemini-1.5-flash" and short.reason == "latency"
+    assert long.model == "gemini-1.5-pro"
+    assert abs(short.expected_ttft - 0.4) < 0.05
+    print(f"   ✓ 短 prompt 選 {short.model}，長 prompt 選 {long.model}")
+
+    for _ in range(10):
+        selector.record_error("gemini-1.5-flash")
+    assert selector.choose(MODELS, 2000, "stable").model == "gemini-1.5-pro"
+    print("   ✓ 錯誤率升高的模型期望時間變長而不被選中")
+    print()
+
+
+def test_error_rate_recovers_over_time():
+    """測試錯誤暴增後不再被選中的模型，錯誤率隨時間衰減而重新被選擇"""
+    print("=" * 60)
+    print("測試: 錯誤率隨時間恢復")
+    print("=" * 60)
+
+    selector = ModelSelector(explore_ratio=0, error_half_life=60)
+    selector.record_success("gemini-1.5-flash", 0.4, 2000)
+    selector.record_success("gemini-1.5-pro", 1.0, 2000)
+    for _ in range(10):
+        selector.record_error("gemini-1.5-flash")
+    profile = selector.profile("gemini-1.5-flash")
+    burst = profile.error_rate
+    assert burst > 0.8 and selector.choose(MODELS, 2000, "stable").model == "gemini-1.5-pro"
+    print(f"   ✓ 錯誤暴增後（錯誤率 {burst:.2f}）改選 gemini-1.5-pro")
+
+    # 期間沒有任何請求送到 flash：只有時間經過
+    profile.error_updated_at -= 60
+    assert abs(profile.error_rate - burst / 2) < 0.01
+    profile.error_updated_at -= 5 * 60
+    assert profile.error_rate < 0.02
+    chosen = selector.choose(MODELS, 2000, "stable")
+    assert chosen.model == "gemini-1.5-flash" and chosen.reason == "latency"
+    print(f"   ✓ 一個半衰期後錯誤率減半，6 分鐘後（{profile.error_rate:.3f}）重新選擇 gemini-1.5-flash")
+
+    # 衰減後的錯誤率是新錯誤的基準，不會回到暴增時的值
+    selector.record_error("gemini-1.5-flash")
+    assert profile.error_rate < 0.25
+    print("   ✓ 恢復後的新錯誤由衰減後的錯誤率起算")
+    print()
+
+
+def test_tier_and_context_filters():
+    """測試品質等級與 context window 篩選"""
+    print("=" * 60)
+    print("測試: 品質等級與 context window")
+    print("=" * 60)
+
+    selector = ModelSelector(explore_ratio=0)
+    selector.record_success("gemini-1.5-flash", 0.1, 1000)
+    assert selector.choose(MODELS, 1000, "recommended").tier in ("recommended", "advanced")
+    assert selector.choose(MODELS, 1000, "advanced").model == "gemini-1.5-pro"
+    print("   ✓ 不選擇低於最低品質等級的模型")
+
+    small = [dict(m, context_window=500) for m in MODELS]
+    try:
+        selector.choose(small, 1000, "stable")
+        raise AssertionError("應該因 context window 不足而失敗")
+    except ValueError:
+        pass
+    print("   ✓ 沒有模型容得下對話時拋出 ValueError")
+    print()
+
+
+def test_ttft_recorded_and_start_event():
+    """測試串流時記錄 TTFT，且 start 事件帶有選擇說明"""
+    print("=" * 60)
+    print("測試: TTFT 記錄與 start 事件")
+    print("=" * 60)
+
+    class FakeStream:
+        async def __aiter__(self):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="好"))])
+
+        async def close(self):
+            pass
+
+    async def create(**kwargs):
+        return FakeStream()
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    selector = ModelSelector(explore_ratio=0)
+    service = OpenAIService(MemoryStateStore(), ApiKeyPool(["k"], client_factory=lambda key: client), selector)
+
+    selection = selector.choose(MODELS, service.estimate_prompt_chars("s", "你好"), "recommended")
+
+    async def run():
+        return [raw async for raw in generate_sse_stream(
+            service, "你好", selection.model, "s", selection=selection
+        )]
+
+    events = asyncio.run(run())
+    start = json.loads(events[0].split("data: ", 1)[1])
+    assert start["model"] == selection.model
+    assert start["selection"]["reason"] == "prior" and start["selection"]["prompt_chars"] == 2
+    assert selector.profile(selection.model).samples == 1
+    print(f"   ✓ start 事件: {start['selection']}")
+    print()
+
+
+def test_error_rate_counts_only_upstream_failures():
+    """測試只有首個片段之前的上游失敗計入錯誤率（客戶端期限與首個片段後的錯誤不計入）"""
+    print("=" * 60)
+    print("測試: 模型錯誤率")
+    print("=" * 60)
+
+    class BreaksAfterFirst:
+        async def __aiter__(self):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="好"))])
+            raise RuntimeError("connection reset")
+
+        async def close(self):
+            pass
+
+    behaviour = {}
+
+    async def create(**kwargs):
+        if behaviour["mode"] == "slow":
+            await asyncio.sleep(1)
+        if behaviour["mode"] == "error":
+            raise RuntimeError("upstream 500")
+        return BreaksAfterFirst()
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    selector = ModelSelector(explore_ratio=0)
+    service = OpenAIService(
+        MemoryStateStore(), ApiKeyPool(["k"], client_factory=lambda key: client), selector,
+        circuit_breaker=CircuitBreaker()
+    )
+    profile = selector.profile("m")
+
+    async def send(deadline=None):
+        try:
+            return [chunk async for chunk in service.generate_streaming_response("hi", "m", "s", deadline)]
+        except Exception as e:
+            return e
+
+    behaviour["mode"] = "break"
+    asyncio.run(send())
+    assert profile.samples == 1 and profile.error_rate == 0
+    print("   ✓ 首個片段之後的錯誤不計入（該請求已記錄為成功）")
+
+    behaviour["mode"] = "slow"
+    for _ in range(5):
+        assert isinstance(asyncio.run(send(StreamDeadline(first_token=30, total=0.001))), DeadlineExceeded)
+    assert profile.error_rate == 0
+    print("   ✓ 客戶端縮短的總時間期限不計入")
+
+    behaviour["mode"] = "error"
+    asyncio.run(send())
+    assert profile.error_rate > 0
+    print(f"   ✓ 上游錯誤計入，錯誤率 {profile.error_rate:.2f}")
+    print()
+
+
+def test_regenerate_uses_auto_selection():
+    """測試 /regenerate 與 /send 相同：支援 auto 與 AUTO_MODEL_DEFAULT"""
+    print("=" * 60)
+    print("測試: /regenerate 的 auto 模型選擇")
+    print("=" * 60)
+
+    class FakeStream:
+        async def __aiter__(self):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="好"))])
+
+        async def close(self):
+            pass
+
+    calls = []
+
+    async def create(**kwargs):
+        calls.append(kwargs["model"])
+        return FakeStream()
+
+    async def get_available_models():
+        return MODELS
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    service = OpenAIService(
+        MemoryStateStore(), ApiKeyPool(["k"], client_factory=lambda key: client), ModelSelector(explore_ratio=0)
+    )
+    service.store.append_message("s", HistoryEntry(MessageRole.USER, "你好"))
+    settings = Settings(GEMINI_API_KEY="k", AUTO_MODEL_DEFAULT=True, GEMINI_MODEL="gemini-1.5-pro")
+    test_app = FastAPI()
+    test_app.include_router(chat.router)
+    test_app.dependency_overrides[get_settings] = lambda: settings
+    test_app.dependency_overrides[get_openai_service] = lambda: service
+    test_app.dependency_overrides[get_model_service] = lambda: SimpleNamespace(
+        get_available_models=get_available_models
+    )
+    test_client = TestClient(test_app)
+
+    def regenerate(body):
+        with test_client.stream("POST", "/api/chat/regenerate", json={"session_id": "s", **body}) as response:
+            assert response.status_code == 200
+            return json.loads("".join(response.iter_text()).split("data: ", 1)[1].split("\n", 1)[0])
+
+    start = regenerate({"model": "auto", "quality_tier": "stable"})
+    assert start["selection"]["tier"] == "stable" and start["model"] == "gemini-1.5-flash"
+    print(f"   ✓ model=auto 依延遲統計選擇 {start['model']}")
+
+    start = regenerate({})
+    assert start["model"] != settings.GEMINI_MODEL and "selection" in start
+    assert calls == ["gemini-1.5-flash", start["model"]]
+    print(f"   ✓ AUTO_MODEL_DEFAULT 時未指定模型同樣使用 auto（{start['model']}）")
+    print()
+
+
+if __name__ == "__main__":
+    test_choose_by_expected_latency()
+    test_error_rate_recovers_over_time()
+    test_tier_and_context_filters()
+    test_ttft_recorded_and_start_event()
+    test_error_rate_counts_only_upstream_failures()
+    test_regenerate_uses_auto_selection()
+
+    print("=" * 60)
+    print("所有 auto 模型選擇測試完成！")
+    print("=" * 60)
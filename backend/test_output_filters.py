@@ -0,0 +1,95 @@
+"""
+測試模型輸出的串流過濾：跨片段的多字串遮蔽與各階段耗時
+"""
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.services.key_pool import ApiKeyPool
+from app.services.openai_service import OpenAIService
+from app.services.output_filters import AhoCorasick, ChunkFilter, ChunkPipeline, RedactionFilter
+from app.services.state_store import MemoryStateStore
+
+
+def run_filter(f, pieces):
+    """逐片段餵入，回傳每個片段的輸出與結束時的輸出"""
+    outputs = [f.feed(piece) for piece in pieces]
+    return outputs, f.flush()
+
+
+def test_redaction_across_chunk_boundaries():
+    """測試比對跨越片段邊界、重疊比對合併，且只暫留可能的比對前綴"""
+    print("=" * 60)
+    print("測試: 跨片段遮蔽")
+    print("=" * 60)
+
+    automaton = AhoCorasick(["sk-secret-42", "secret", "密碼是1234"], ignore_case=True)
+    text = "key: SK-SECRET-42，另外密碼是1234。"
+    expected = "key: [REDACTED]，另外[REDACTED]。"
+    for size in (1, 2, 3, 5, len(text)):
+        pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        outputs, tail = run_filter(RedactionFilter(automaton), pieces)
+        assert "".join(outputs) + tail == expected, (size, outputs, tail)
+    print("   ✓ 任意切割方式的結果都相同，重疊的 secret / sk-secret-42 合併為一段")
+
+    outputs, tail = run_filter(RedactionFilter(automaton), ["一般的回應文字", "，結尾是 sk-se"])
+    assert outputs == ["一般的回應文字", "，結尾是 "] and tail == "sk-se"
+    print("   ✓ 只暫留可能成為比對開頭的字元，其餘立即送出")
+
+    outputs, tail = run_filter(RedactionFilter(AhoCorasick(["ab", "bc"])), ["abbc", "ab"])
+    assert "".join(outputs) + tail == "[REDACTED][REDACTED][REDACTED]"
+    print("   ✓ 相鄰但不重疊的比對分別遮蔽")
+    print()
+
+
+def test_pipeline_stages_and_service_history():
+    """測試管線依序套用各階段、累計耗時，且歷史記錄的是過濾後的內容"""
+    print("=" * 60)
+    print("測試: 過濾管線")
+    print("=" * 60)
+
+    class Upper(ChunkFilter):
+        name = "upper"
+
+        def feed(self, chunk):
+            return chunk.upper()
+
+    class FakeStream:
+        async def __aiter__(self):
+            for piece in ["token 是 AIza", "SyFAKE", "KEY 結束"]:
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+
+        async def close(self):
+            pass
+
+    async def create(**kwargs):
+        return FakeStream()
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    service = OpenAIService(MemoryStateStore(), ApiKeyPool(["k"], client_factory=lambda key: client))
+    pipeline = ChunkPipeline([RedactionFilter(AhoCorasick(["AIzaSyFAKEKEY"])), Upper()])
+
+    async def run():
+        return [chunk async for chunk in service.generate_streaming_response(
+            "你好", "gemini-2.0-flash", "s", pipeline=pipeline
+        )]
+
+    chunks = asyncio.run(run())
+    assert "".join(chunks) == "TOKEN 是 [REDACTED] 結束"
+    assert service.get_history("s")[-1].content == "TOKEN 是 [REDACTED] 結束"
+    timings = pipeline.stage_timings()
+    assert list(timings) == ["redact", "upper"] and pipeline.chunks == 3
+    print(f"   ✓ 串流與歷史皆已遮蔽，各階段耗時（微秒）: {timings}")
+    print()
+
+
+if __name__ == "__main__":
+    test_redaction_across_chunk_boundaries()
+    test_pipeline_stages_and_service_history()
+
+    print("=" * 60)
+    print("所有輸出過濾測試完成！")
+    print("=" * 60)
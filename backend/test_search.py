@@ -0,0 +1,134 @@
+"""
+測試對話歷史全文檢索（中文 bigram 切分、排序、分頁、寫入即索引）
+"""
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.core.config import get_settings
+from app.main import app
+from app.routers import admin
+from app.schemas.chat import MessageRole
+from app.services.history import HistoryEntry
+from app.services.openai_service import get_openai_service
+from app.services.search_index import tokenize, tokenize_query
+from app.services.state_store import MemoryStateStore, SQLiteStateStore, get_state_store
+
+
+def test_tokenize_cjk():
+    """測試中英混合內容的切分"""
+    print("=" * 60)
+    print("測試: 中英混合切分")
+    print("=" * 60)
+
+    tokens = tokenize("學習 Python")
+    assert tokens == ["學", "習", "學習", "python"]
+    assert tokenize_query("機器學習") == ["機器", "器學", "學習"]
+    assert tokenize_query("貓") == ["貓"]
+    print(f"   ✓ {tokens}")
+    print()
+
+
+def test_store_search():
+    """測試兩種後端的搜尋結果一致：AND 語意、session 過濾、刪除後不再命中"""
+    print("=" * 60)
+    print("測試: 狀態儲存搜尋")
+    print("=" * 60)
+
+    for store in (MemoryStateStore(), SQLiteStateStore(":memory:")):
+        store.append_message("a", HistoryEntry(MessageRole.USER, "什麼是機器學習？"))
+        store.append_message("a", HistoryEntry(MessageRole.ASSISTANT, "機器學習是人工智慧的一個分支"))
+        store.append_message("b", HistoryEntry(MessageRole.USER, "推薦一台機器人吸塵器"))
+        store.append_message("b", HistoryEntry(MessageRole.USER, "Python machine learning 入門"))
+
+        total, hits = store.search_messages("機器學習")
+        assert total == 2 and {h[0] for h in hits} == {"a"}
+
+        total, hits = store.search_messages("機器", session_id="b")
+        assert total == 1 and hits[0][1].content.startswith("推薦")
+
+        total, hits = store.search_messages("python learning")
+        assert total == 1 and hits[0][1].id is not None
+
+        total, hits = store.search_messages("機器", limit=1, offset=1)
+        assert total == 3 and len(hits) == 1
+
+        store.clear_messages("a")
+        assert store.search_messages("機器學習") == (0, [])
+        print(f"   ✓ {type(store).__name__}")
+
+    print()
+
+
+def test_search_endpoint():
+    """測試 GET /api/chat/search 回應格式與 session 隔離"""
+    print("=" * 60)
+    print("測試: GET /api/chat/search")
+    print("=" * 60)
+
+    service = get_openai_service()
+    service.add_message(MessageRole.USER, "請解釋量子電腦的原理", session_id="search-test")
+    service.add_message(MessageRole.USER, "量子電腦的私人筆記", session_id="search-other")
+
+    with TestClient(app) as client:
+        response = client.get("/api/chat/search", params={"q": "量子電腦", "session_id": "search-test"})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["total"] == 1
+        assert data["results"][0]["session_id"] == "search-test"
+        assert "量子電腦" in data["results"][0]["snippet"]
+        print(f"   ✓ {data['results'][0]}")
+
+        # 未指定 session 時只搜尋預設 session，不會看到其他 session 的內容
+        data = client.get("/api/chat/search", params={"q": "量子電腦"}).json()
+        assert data["total"] == 0 and data["results"] == []
+        print("   ✓ 未指定 session_id 時不跨 session 搜尋")
+
+    service.clear_history("search-test")
+    service.clear_history("search-other")
+    print()
+
+
+def test_admin_search_endpoint():
+    """測試跨 session 搜尋只能透過 admin API"""
+    print("=" * 60)
+    print("測試: GET /api/admin/search")
+    print("=" * 60)
+
+    store = MemoryStateStore()
+    store.append_message("a", HistoryEntry(MessageRole.USER, "機器學習入門"))
+    store.append_message("b", HistoryEntry(MessageRole.ASSISTANT, "機器學習進階"))
+
+    test_app = FastAPI()
+    test_app.include_router(admin.router)
+    test_app.dependency_overrides[get_state_store] = lambda: store
+    client = TestClient(test_app)
+
+    test_app.dependency_overrides[get_settings] = lambda: SimpleNamespace(ADMIN_TOKEN="")
+    assert client.get("/api/admin/search", params={"q": "機器學習"}).status_code == 404
+    test_app.dependency_overrides[get_settings] = lambda: SimpleNamespace(ADMIN_TOKEN="secret")
+    assert client.get("/api/admin/search", params={"q": "機器學習"}).status_code == 401
+
+    headers = {"Authorization": "Bearer secret"}
+    data = client.get("/api/admin/search", params={"q": "機器學習"}, headers=headers).json()
+    assert data["total"] == 2 and {r["session_id"] for r in data["results"]} == {"a", "b"}
+    data = client.get("/api/admin/search", params={"q": "機器學習", "session_id": "b"}, headers=headers).json()
+    assert data["total"] == 1
+    print("   ✓ 需 admin token，可跨 session 或指定 session 搜尋")
+    print()
+
+
+if __name__ == "__main__":
+    test_tokenize_cjk()
+    test_store_search()
+    test_search_endpoint()
+    test_admin_search_endpoint()
+
+    print("=" * 60)
+    print("所有搜尋測試完成！")
+    print("=" * 60)
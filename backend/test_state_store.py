@@ -0,0 +1,232 @@
+"""
+測試共享狀態儲存（MemoryStateStore / SQLiteStateStore）
+"""
+import asyncio
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.schemas.chat import MessageRole
+from app.services.history import HistoryEntry
+from app.services.state_store import MemoryStateStore, SQLiteStateStore
+
+
+def _stores():
+    """建立兩種後端的測試實例"""
+    return [MemoryStateStore(), SQLiteStateStore(":memory:")]
+
+
+def test_session_history_isolation():
+    """測試不同 session 的歷史互不影響"""
+    print("=" * 60)
+    print("測試: session 歷史隔離")
+    print("=" * 60)
+
+    for store in _stores():
+        name = type(store).__name__
+        store.append_message("a", HistoryEntry(MessageRole.USER, "你好"))
+        store.append_message("a", HistoryEntry(MessageRole.ASSISTANT, "嗨"))
+        store.append_message("b", HistoryEntry(MessageRole.USER, "hello"))
+
+        assert [m.content for m in store.get_messages("a")] == ["你好", "嗨"]
+        assert [m.content for m in store.get_messages("b")] == ["hello"]
+
+        popped = store.pop_message("a")
+        assert popped is not None and popped.content == "嗨"
+        store.clear_messages("b")
+        assert store.get_messages("b") == []
+        assert store.pop_message("b") is None
+        print(f"   ✓ {name}")
+
+    print()
+
+
+def test_memory_store_deduplicates_content():
+    """測試記憶體後端對重複內容共用同一字串，並於清除後釋放"""
+    print("=" * 60)
+    print("測試: 內容去重")
+    print("=" * 60)
+
+    store = MemoryStateStore()
+    repeated = "".join(["請再說一次"] * 3)
+    for session_id in ("a", "b"):
+        store.append_message(session_id, HistoryEntry(MessageRole.USER, "".join(["請再說一次"] * 3)))
+
+    first, second = store.get_messages("a")[0], store.get_messages("b")[0]
+    assert first.content == repeated and first.content is second.content
+    assert len(store._contents) == 1
+
+    store.clear_messages("a")
+    store.clear_messages("b")
+    assert len(store._contents) == 0
+    print("   ✓ 重複內容共用，引用歸零後移出內容池")
+    print()
+
+
+def test_cache_ttl():
+    """測試快取寫入與過期"""
+    print("=" * 60)
+    print("測試: 快取 TTL")
+    print("=" * 60)
+
+    for store in _stores():
+        store.cache_set("models", [{"id": "gemini-2.0-flash"}], ttl=60)
+        store.cache_set("expired", {"x": 1}, ttl=-1)
+        assert store.cache_get("models") == [{"id": "gemini-2.0-flash"}]
+        assert store.cache_get("expired") is None
+        assert store.cache_get("missing") is None
+        print(f"   ✓ {type(store).__name__}")
+
+    print()
+
+
+def test_cache_bounded():
+    """測試快取筆數上限"""
+    print("=" * 60)
+    print("測試: 快取筆數上限")
+    print("=" * 60)
+
+    store = MemoryStateStore(cache_max_entries=2)
+    store.cache_set("a", 1)
+    store.cache_set("b", 2)
+    assert store.cache_get("a") == 1
+    store.cache_set("c", 3)
+    assert store.cache_get("b") is None and store.cache_get("a") == 1 and store.cache_get("c") == 3
+    print("   ✓ MemoryStateStore 淘汰最久未使用的項目")
+
+    store = SQLiteStateStore(":memory:", cache_max_entries=10)
+    store.cache_set("expired", 0, ttl=-1)
+    for i in range(99):
+        store.cache_set(f"k{i}", i, ttl=60)
+    count = store._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+    assert count == 10 and store.cache_get("k98") == 98 and store.cache_get("k88") is None
+    print(f"   ✓ SQLiteStateStore 定期清理後保留 {count} 筆最新的資料列")
+    print()
+
+
+def test_rate_limit_bucket():
+    """測試 token bucket 耗盡後拒絕"""
+    print("=" * 60)
+    print("測試: 速率限制桶")
+    print("=" * 60)
+
+    for store in _stores():
+        results = [store.consume_token("send:test", capacity=2, refill_per_second=0.01)[0] for _ in range(3)]
+        assert results == [True, True, False]
+        allowed, retry_after = store.consume_token("send:test", capacity=2, refill_per_second=0.01)
+        assert not allowed and retry_after > 0
+        print(f"   ✓ {type(store).__name__}: retry_after={retry_after:.1f}s")
+
+    print()
+
+
+def test_sqlite_shared_between_connections():
+    """測試兩個 SQLiteStateStore（模擬兩個 worker）看到同一份資料"""
+    print("=" * 60)
+    print("測試: SQLite 跨連線共享")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "state.db")
+        worker_a = SQLiteStateStore(path)
+        worker_b = SQLiteStateStore(path)
+
+        worker_a.append_message("s", HistoryEntry(MessageRole.USER, "跨 worker"))
+        assert [m.content for m in worker_b.get_messages("s")] == ["跨 worker"]
+
+        worker_a.consume_token("bucket", capacity=1, refill_per_second=0.001)
+        assert worker_b.consume_token("bucket", capacity=1, refill_per_second=0.001)[0] is False
+
+        worker_a.close()
+        worker_b.close()
+        print("   ✓ 歷史與速率限制桶皆共享")
+
+    print()
+
+
+def test_sqlite_migrates_once():
+    """測試結構遷移與索引補建只在 user_version 落後時執行一次"""
+    print("=" * 60)
+    print("測試: SQLite 結構版本")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "state.db")
+        store = SQLiteStateStore(path)
+        store.append_message("s", HistoryEntry(MessageRole.USER, "索引補建"))
+        # 模擬建立全文檢索表之前的資料：移除索引並把版本退回 1
+        store._conn.execute("DELETE FROM messages_fts")
+        store._conn.execute("PRAGMA user_version=1")
+        store.close()
+
+        store = SQLiteStateStore(path)
+        assert store._conn.execute("PRAGMA user_version").fetchone()[0] == SQLiteStateStore._SCHEMA_VERSION
+        assert store.search_messages("索引", "s")[0] == 1
+        store.close()
+        print("   ✓ 版本落後時補建索引並更新 user_version")
+
+        def fail(conn):
+            raise AssertionError("已是最新版本時不應補建索引")
+
+        backfill = SQLiteStateStore._backfill_search_index
+        SQLiteStateStore._backfill_search_index = staticmethod(fail)
+        try:
+            SQLiteStateStore(path).close()
+        finally:
+            SQLiteStateStore._backfill_search_index = staticmethod(backfill)
+        print("   ✓ 已是最新版本時不再掃描訊息表")
+    print()
+
+
+def test_sqlite_blocking_calls_off_loop():
+    """測試 SQLite 操作經由 run() 在 thread 中執行，且一般操作等待寫入鎖的時間較短"""
+    print("=" * 60)
+    print("測試: SQLite 阻塞操作")
+    print("=" * 60)
+
+    async def thread_of(store):
+        return await store.run(threading.get_ident)
+
+    assert asyncio.run(thread_of(MemoryStateStore())) == threading.get_ident()
+    assert asyncio.run(thread_of(SQLiteStateStore(":memory:"))) != threading.get_ident()
+    print("   ✓ MemoryStateStore 直接執行，SQLiteStateStore 在 thread 中執行")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "state.db")
+        store = SQLiteStateStore(path, busy_timeout_ms=100)
+        other = sqlite3.connect(path, isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")
+        started = time.monotonic()
+        try:
+            store.append_message("s", HistoryEntry(MessageRole.USER, "被鎖住"))
+            raise AssertionError("寫入鎖被佔用時應逾時")
+        except sqlite3.OperationalError:
+            waited = time.monotonic() - started
+        other.execute("ROLLBACK")
+        other.close()
+        assert waited < 1.0
+        store.append_message("s", HistoryEntry(MessageRole.USER, "鎖已釋放"))
+        assert [m.content for m in store.get_messages("s")] == ["鎖已釋放"]
+        store.close()
+        print(f"   ✓ 寫入鎖被佔用時 {waited * 1000:.0f}ms 後放棄")
+    print()
+
+
+if __name__ == "__main__":
+    test_session_history_isolation()
+    test_memory_store_deduplicates_content()
+    test_cache_ttl()
+    test_cache_bounded()
+    test_rate_limit_bucket()
+    test_sqlite_shared_between_connections()
+    test_sqlite_migrates_once()
+    test_sqlite_blocking_calls_off_loop()
+
+    print("=" * 60)
+    print("所有狀態儲存測試完成！")
+    print("=" * 60)
@@ -0,0 +1,248 @@
+"""
+測試流量錄製 Middleware 與重播工具的 mock 上游
+"""
+import asyncio
+import json
+import sys
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent))
+sys.path.insert(0, str(Path(__file__).parent / "scripts"))
+
+import httpx
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from openai import AsyncOpenAI
+
+import replay_traffic
+from app.core.traffic_capture import TrafficCaptureMiddleware, TrafficRecorder, anonymize_session
+from app.routers import chat
+from app.schemas.chat import MessageRole
+from app.services.history import HistoryEntry
+from app.services.key_pool import ApiKeyPool
+from app.services.openai_service import OpenAIService, get_openai_service
+from app.services.state_store import MemoryStateStore, SQLiteStateStore
+
+
+class FakeStream:
+    """依序產生 pieces 的上游串流"""
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+
+    async def __aiter__(self):
+        for piece in self.pieces:
+            await asyncio.sleep(0.01)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+
+    async def close(self):
+        pass
+
+
+def make_client(path, sample_rate=1.0, store=None, salt="test-salt"):
+    """掛上錄製 Middleware 的測試 app"""
+    async def create(**kwargs):
+        return FakeStream(["秘密回應", "第二段", "end"])
+
+    upstream = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    service = OpenAIService(store or MemoryStateStore(), ApiKeyPool(["k"], client_factory=lambda key: upstream))
+    recorder = TrafficRecorder(path, sample_rate, salt)
+    test_app = FastAPI()
+    test_app.include_router(chat.router)
+    test_app.add_middleware(TrafficCaptureMiddleware, recorder=recorder, history_stats=service.get_history_stats)
+    test_app.dependency_overrides[get_openai_service] = lambda: service
+    return TestClient(test_app), service, recorder
+
+
+def read_records(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_capture_records_shape():
+    """測試只錄製長度與時間，不錄製內容"""
+    print("=" * 60)
+    print("測試: 錄製請求形狀")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "capture" / "traffic.ndjson")
+        client, service, recorder = make_client(path)
+        service.store.append_message("private-session", HistoryEntry(MessageRole.USER, "之前的問題"))
+        service.store.append_message("private-session", HistoryEntry(MessageRole.ASSISTANT, "之前的回答"))
+        with client.stream("POST", "/api/chat/send", json={
+            "message": "這是不應被記錄的訊息", "session_id": "private-session"
+        }) as response:
+            body = "".join(response.iter_text())
+        recorder.close()
+        assert "event: done" in body
+
+        raw = Path(path).read_text(encoding="utf-8")
+        assert "不應被記錄" not in raw and "秘密回應" not in raw and "private-session" not in raw
+        [record] = read_records(path)
+        assert record["session"] == anonymize_session("private-session", "test-salt")
+        assert record["status"] == "done" and record["path"] == "/api/chat/send"
+        assert record["message_chars"] == len("這是不應被記錄的訊息")
+        # 歷史長度為請求到達時的狀態，不含本次的問題與回答
+        assert record["history_messages"] == 2 and record["history_chars"] == 10
+        assert record["chunk_chars"] == [4, 3, 3]
+        assert len(record["offsets_ms"]) == 3 and record["offsets_ms"] == sorted(record["offsets_ms"])
+        assert record["model"] and record["requested_model"] is None
+        print(f"   ✓ 記錄: {raw.strip()}")
+    print()
+
+
+def test_capture_errors_and_sampling():
+    """測試非 200 回應與取樣率"""
+    print("=" * 60)
+    print("測試: 錯誤回應與取樣")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "traffic.ndjson")
+        client, _, recorder = make_client(path)
+        assert client.post("/api/chat/send", json={"message": ""}).status_code == 422
+        assert client.get("/api/chat/history").status_code == 200
+        recorder.close()
+        [record] = read_records(path)
+        assert record["status"] == "http_422" and record["offsets_ms"] == []
+        print("   ✓ 驗證失敗記錄為 http_422，非錄製路徑不記錄")
+
+        skipped = str(Path(tmp) / "skipped.ndjson")
+        client, _, recorder = make_client(skipped, sample_rate=0.0)
+        client.post("/api/chat/send", json={"message": "hi"})
+        recorder.close()
+        assert not Path(skipped).exists()
+        print("   ✓ 取樣率 0 時不錄製")
+    print()
+
+
+def test_history_stats_off_loop():
+    """測試歷史長度以彙總查詢取得，且不在 event loop 上執行"""
+    print("=" * 60)
+    print("測試: 歷史長度查詢")
+    print("=" * 60)
+
+    memory, sqlite = MemoryStateStore(), SQLiteStateStore(":memory:")
+    for store in (memory, sqlite):
+        store.append_message("s", HistoryEntry(MessageRole.USER, "問題一"))
+        reply = store.append_message("s", HistoryEntry(MessageRole.ASSISTANT, "回答"))
+        store.append_message("s", HistoryEntry(MessageRole.USER, "另一個分支的問題"))
+        store.set_head("s", reply.id)
+        store.append_message("s", HistoryEntry(MessageRole.USER, "追問"))
+        messages = store.get_messages("s")
+        assert store.branch_stats("s") == (len(messages), sum(len(e.content) for e in messages)) == (3, 7)
+        assert store.branch_stats("empty") == (0, 0)
+    print("   ✓ 只計算目前分支，Memory 與 SQLite 結果一致")
+
+    on_loop = []
+    branch_stats = sqlite.branch_stats
+
+    def record_thread(session_id):
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        return branch_stats(session_id)
+
+    sqlite.branch_stats = record_thread
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "traffic.ndjson")
+        client, service, recorder = make_client(path, store=sqlite)
+        with client.stream("POST", "/api/chat/send", json={"message": "hi", "session_id": "s"}) as response:
+            "".join(response.iter_text())
+        recorder.close()
+        [record] = read_records(path)
+    assert on_loop == [False]
+    assert record["history_messages"] == 3 and record["history_chars"] == 7
+    print("   ✓ 查詢在 worker thread 執行，記錄請求到達時的長度")
+    print()
+
+
+def test_session_hash_salted():
+    """測試 session 雜湊以 salt 為金鑰（不知道 salt 無法以字典還原）"""
+    print("=" * 60)
+    print("測試: session 雜湊加鹽")
+    print("=" * 60)
+
+    import hashlib
+    assert anonymize_session("default", "a") == anonymize_session("default", "a")
+    assert anonymize_session("default", "a") != anonymize_session("default", "b")
+    assert anonymize_session("default", "a") != hashlib.sha256(b"default").hexdigest()[:12]
+    print("   ✓ 相同 salt 可串接，不同 salt 結果不同")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        first = TrafficRecorder(str(Path(tmp) / "a.ndjson"))
+        second = TrafficRecorder(str(Path(tmp) / "b.ndjson"))
+        assert first.salt and first.salt != second.salt
+        assert TrafficRecorder(str(Path(tmp) / "c.ndjson"), salt="configured").salt == "configured"
+    print("   ✓ 未設定時每個錄製器隨機產生 salt")
+    print()
+
+
+def test_replay_mock_upstream():
+    """測試重播工具的記錄讀取與 mock 上游（以 OpenAI SDK 實際串流）"""
+    print("=" * 60)
+    print("測試: 重播 mock 上游")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "trace.ndjson"
+        records = [
+            {"ts": 10.0, "session": "a", "model": "gemini-x", "message_chars": 120,
+             "offsets_ms": [30, 50, 80], "chunk_chars": [5, 2, 7]},
+            {"ts": 9.0, "session": "b", "model": "gemini-x", "message_chars": 40,
+             "offsets_ms": [], "chunk_chars": []},
+            {"ts": 11.0, "session": "c", "model": None, "message_chars": 0,
+             "offsets_ms": [], "chunk_chars": []},
+        ]
+        path.write_text("".join(json.dumps(r) + "\n" for r in records), encoding="utf-8")
+        trace = replay_traffic.load_trace(str(path))
+    assert [r["session"] for r in trace] == ["b", "a"]
+    assert trace[0]["offsets_ms"] == [30, 50, 80]
+    print("   ✓ 依到達時間排序，未完成的記錄借用其他記錄的回應時間")
+
+    message = replay_traffic.build_message(1, 120)
+    assert len(message) == 120 and message.startswith("[replay:1] ")
+    assert replay_traffic.chunk_plan(trace[1], upstream_speed=2.0) == [(0.015, 5), (0.01, 2), (0.015, 7)]
+
+    mock = replay_traffic.create_mock_app(trace)
+    models = TestClient(mock).get("/v1beta/models").json()["models"]
+    assert "models/gemini-x" in [m["name"] for m in models]
+
+    async def stream():
+        client = AsyncOpenAI(
+            api_key="k", base_url="http://mock/v1beta/openai/",
+            http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=mock))
+        )
+        response = await client.chat.completions.create(
+            model="gemini-x", stream=True, stream_options={"include_usage": True},
+            messages=[{"role": "user", "content": message}]
+        )
+        pieces, usage = [], None
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                pieces.append(chunk.choices[0].delta.content)
+            usage = chunk.usage or usage
+        return pieces, usage
+
+    pieces, usage = asyncio.run(stream())
+    assert [len(p) for p in pieces] == [5, 2, 7] and usage.completion_tokens == 14
+    print("   ✓ mock 依記錄的 chunk 字元數串流，並回報 usage")
+    print()
+
+
+if __name__ == "__main__":
+    test_capture_records_shape()
+    test_capture_errors_and_sampling()
+    test_history_stats_off_loop()
+    test_session_hash_salted()
+    test_replay_mock_upstream()
+
+    print("=" * 60)
+    print("所有流量錄製測試完成！")
+    print("=" * 60)
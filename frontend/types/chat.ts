@@ -7,9 +7,12 @@ export type MessageRole = 'user' | 'assistant'
  * 聊天訊息介面
  */
 export interface ChatMessage {
+  id?: number
+  parent_id?: number | null  // 父訊息 ID（分支點）
   role: MessageRole
   content: string
   timestamp: Date
+  html?: string
 }
 
 /**
@@ -17,7 +20,64 @@ export interface ChatMessage {
  */
 export interface SendMessageRequest {
   message: string
-  model?: string
+  model?: string  // 'auto' 表示由伺服器依延遲統計選擇
+  quality_tier?: 'stable' | 'recommended' | 'advanced'
+  render_markdown?: boolean
+  // 生成參數（留空使用模型預設值，超過伺服器的模型上限時回傳 400）
+  max_tokens?: number
+  stop?: string[]
+  temperature?: number
+  top_p?: number
+}
+
+/**
+ * 對話分支（GET /api/chat/branches）
+ */
+export interface BranchInfo {
+  leaf: ChatMessage  // 分支的最後一筆訊息
+  active: boolean
+}
+
+export interface BranchListResponse {
+  head_id: number | null
+  branches: BranchInfo[]
+}
+
+/**
+ * API 請求：建立 / 切換分支（POST /api/chat/fork、POST /api/chat/switch）
+ */
+export interface ForkRequest {
+  message_id: number | null  // null 表示從第一則訊息之前開始
+  session_id?: string
+}
+
+export interface SwitchBranchRequest {
+  message_id: number
+  session_id?: string
+}
+
+/**
+ * API 請求：多模型比較（POST /api/chat/compare）
+ */
+export interface CompareRequest {
+  message: string
+  models: string[]
+  session_id?: string
+}
+
+/**
+ * 多模型比較中單一模型的結果（done 事件的 results）
+ */
+export interface CompareModelResult {
+  model: string
+  status: 'ok' | 'error'
+  ttft_ms?: number
+  duration_ms?: number
+  chunks: number
+  chars: number
+  prompt_tokens?: number
+  completion_tokens?: number
+  error?: string
 }
 
 /**
@@ -44,7 +104,7 @@ export interface ModelInfo {
 /**
  * SSE 事件類型
  */
-export type SSEEventType = 'chunk' | 'done' | 'error'
+export type SSEEventType = 'start' | 'chunk' | 'block' | 'done' | 'error'
 
 /**
  * SSE 事件資料